@@ -2,10 +2,12 @@ from django.contrib import admin
 from django.contrib import messages
 from django.shortcuts import redirect
 from django.urls import path, reverse
+from backend.services.orders import order_items_changed
 from backend.tasks import do_import
 from .models import (
     User, Shop, Category, Product, ProductInfo,
-    Parameter, ProductParameter, Contact, Order, OrderItem
+    Parameter, ProductParameter, Contact, Order, ShopOrder, OrderItem, ProductBestOffer,
+    ArchivedOrder, ArchivedOrderItem
 )
 
 
@@ -85,6 +87,13 @@ class ProductInfoAdmin(admin.ModelAdmin):
     inlines = [ProductParameterInline]
 
 
+@admin.register(ProductBestOffer)
+class ProductBestOfferAdmin(admin.ModelAdmin):
+    list_display = ("product", "shop", "price", "total_quantity", "offer_count", "updated_at")
+    search_fields = ("product__name", "shop__name")
+    list_select_related = ("product", "shop")
+
+
 @admin.register(Parameter)
 class ParameterAdmin(admin.ModelAdmin):
     list_display = ("id", "name")
@@ -105,13 +114,54 @@ class ContactAdmin(admin.ModelAdmin):
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ("id", "user", "status", "contact", "created_at", "updated_at")
+    list_display = ("id", "user", "status", "contact", "total_sum", "item_count", "created_at", "updated_at")
     search_fields = ("user__email",)
     list_filter = ("status", "created_at")
+    readonly_fields = ("total_sum", "item_count")
     inlines = [OrderItemInline]
 
+    def save_related(self, request, form, formsets, change):
+        # Позиции редактируются inline, поэтому итоги и документ обновляем после их сохранения
+        super().save_related(request, form, formsets, change)
+        order_items_changed(form.instance.id)
+
+
+@admin.register(ShopOrder)
+class ShopOrderAdmin(admin.ModelAdmin):
+    list_display = ("id", "order", "shop", "status", "total_sum", "item_count", "created_at")
+    search_fields = ("order__id", "shop__name")
+    list_filter = ("status", "created_at")
+    readonly_fields = ("total_sum", "item_count")
+
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
-    list_display = ("id", "order", "product_info", "quantity")
-    search_fields = ("order__id", "product_info__product__name")
+    list_display = ("id", "order", "product_info", "product_name", "shop_name", "price", "quantity")
+    search_fields = ("order__id", "product_name", "product_info__product__name")
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        order_items_changed(obj.order_id)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        order_items_changed(obj.order_id)
+
+
+class ArchivedOrderItemInline(admin.TabularInline):
+    model = ArchivedOrderItem
+    extra = 0
+    can_delete = False
+    readonly_fields = ("shop_order", "product_info", "quantity", "price", "product_name", "external_id", "shop",
+                       "shop_name")
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ("id", "user", "status", "total_sum", "item_count", "created_at", "archived_at")
+    search_fields = ("id", "user__email")
+    list_filter = ("status", "created_at")
+    inlines = [ArchivedOrderItemInline]
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class BackendConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'backend'
+
+    def ready(self):
+        # Подключаем обработчики сигналов и в веб-процессе, и в Celery worker
+        import backend.signals  # noqa: F401
+        import backend.checks  # noqa: F401
@@ -0,0 +1,58 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+
+def _token_cache_key(key: str) -> str:
+    # Сам токен в ключ кэша не попадает
+    return f'auth:token:{hashlib.sha256(key.encode("utf-8")).hexdigest()}'
+
+
+def invalidate_token_cache(*keys: str) -> None:
+    """
+    Удаляет из кэша результаты проверки токенов keys (выход, сброс пароля, деактивация).
+    Удаление повторяется после фиксации транзакции, чтобы параллельный запрос
+    не вернул в кэш данные, прочитанные до коммита.
+    """
+    cache_keys = [_token_cache_key(key) for key in keys]
+    cache.delete_many(cache_keys)
+    transaction.on_commit(lambda: cache.delete_many(cache_keys), robust=True)
+
+
+def _cached_user_fields(user_model) -> list[str]:
+    # Поля пользователя, которые хранятся в кэше: все, кроме хеша пароля
+    return [field.attname for field in user_model._meta.concrete_fields if field.attname != 'password']
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication, который хранит результат проверки токена в общем кэше
+    на TOKEN_CACHE_TIMEOUT секунд: повторные запросы с тем же токеном не обращаются к БД.
+    В кэш попадают только поля пользователя без хеша пароля; пользователь восстанавливается
+    как объект с отложенным полем password (оно читается из БД при обращении, save() его не перезаписывает).
+    Кэш инвалидируется при удалении токена и при любом изменении пользователя (см. signals.py).
+    """
+    def authenticate_credentials(self, key):
+        model = self.get_model()
+        user_model = model._meta.get_field('user').related_model
+        fields = _cached_user_fields(user_model)
+        cache_key = _token_cache_key(key)
+        entry = cache.get(cache_key)
+        if entry is None:
+            try:
+                token = model.objects.select_related('user').get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            if not token.user.is_active:
+                raise exceptions.AuthenticationFailed('User inactive or deleted.')
+            entry = {'created': token.created, 'user': [getattr(token.user, field) for field in fields]}
+            cache.set(cache_key, entry, timeout=settings.TOKEN_CACHE_TIMEOUT)
+            return token.user, token
+
+        user = user_model.from_db(DEFAULT_DB_ALIAS, fields, entry['user'])
+        token = model(key=key, user=user, created=entry['created'])
+        return user, token
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+
+@register()
+def catalog_engine_check(app_configs, **kwargs):
+    """
+    Колоночный движок каталога (CATALOG_ENGINE = 'columnar') требует NumPy:
+    без него приложение не должно молча работать через ORM.
+    """
+    from backend.services.catalog_engine import np
+
+    if getattr(settings, 'CATALOG_ENGINE', 'orm') == 'columnar' and np is None:
+        return [Error('CATALOG_ENGINE = "columnar" требует NumPy',
+                      hint='Установите зависимости из requirements.txt или задайте CATALOG_ENGINE=orm',
+                      id='backend.E001')]
+    return []
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+from backend.services.locks import acquire_lock, release_lock
+
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+def _fingerprint(request) -> str:
+    # Тело запроса, приведённое к стабильному виду: один ключ нельзя использовать для разных данных
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = {key: values for key, values in data.lists()}
+    payload = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(f'{request.method} {request.path} {payload}'.encode('utf-8')).hexdigest()
+
+
+def _replay(stored: dict) -> HttpResponse:
+    response = HttpResponse(stored['content'], status=stored['status'], content_type=stored['content_type'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view_method):
+    """
+    Делает метод APIView идемпотентным по заголовку Idempotency-Key.
+    Первый ответ сохраняется в кэше на IDEMPOTENCY_KEY_TIMEOUT секунд, повтор с тем же ключом
+    возвращает сохранённый ответ без повторной записи. Параллельные повторы ждут завершения
+    первого запроса (не дольше IDEMPOTENCY_LOCK_TIMEOUT) под блокировкой в кэше, которая живёт
+    IDEMPOTENCY_LOCK_TTL - дольше любого запроса. Запросы без заголовка
+    и неаутентифицированные запросы обрабатываются как обычно.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key or not request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return JsonResponse({'Status': False, 'Errors': f'Слишком длинный {IDEMPOTENCY_HEADER}'}, status=400)
+
+        scope = hashlib.sha256(f'{request.user.id}:{key}'.encode('utf-8')).hexdigest()
+        response_key, lock_key = f'idempotency:{scope}', f'idempotency:{scope}:lock'
+        fingerprint = _fingerprint(request)
+
+        deadline = time.monotonic() + settings.IDEMPOTENCY_LOCK_TIMEOUT
+        while True:
+            stored = cache.get(response_key)
+            if stored is not None:
+                if stored['fingerprint'] != fingerprint:
+                    return JsonResponse({'Status': False,
+                                         'Errors': f'{IDEMPOTENCY_HEADER} уже использован для другого запроса'},
+                                        status=422)
+                return _replay(stored)
+            lock_token = acquire_lock(lock_key, settings.IDEMPOTENCY_LOCK_TTL)
+            if lock_token is not None:
+                break
+            if time.monotonic() > deadline:
+                return JsonResponse({'Status': False, 'Errors': 'Запрос с этим ключом ещё выполняется'},
+                                    status=409)
+            time.sleep(0.05)
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+            # Ошибки сервера не сохраняем, чтобы клиент мог повторить запрос
+            if response.status_code < 500:
+                if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+                    response.render()
+                cache.set(response_key, {
+                    'fingerprint': fingerprint,
+                    'status': response.status_code,
+                    'content': response.content,
+                    'content_type': response.get('Content-Type'),
+                }, timeout=settings.IDEMPOTENCY_KEY_TIMEOUT)
+            return response
+        finally:
+            release_lock(lock_key, lock_token)
+    return wrapper
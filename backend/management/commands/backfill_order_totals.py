@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from backend.models import Order
+from backend.services.orders import recalculate_order_totals
+
+
+class Command(BaseCommand):
+    """
+    Заполнение сохранённых итогов заказов (total_sum, item_count) по их позициям.
+    Выполняется после миграции и при восстановлении данных.
+    """
+    help = 'Пересчитывает сохранённые итоги всех заказов пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество заказов в одной транзакции')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        updated = 0
+        while True:
+            batch = list(Order.objects.filter(id__gt=last_id).order_by('id').
+                         values_list('id', flat=True)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                updated += recalculate_order_totals(*batch)
+            last_id = batch[-1]
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано заказов: {updated}'))
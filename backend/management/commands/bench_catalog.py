@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import QueryDict
+
+from backend.services.catalog_engine import (np, parse_catalog_filters, orm_catalog_page,
+                                             ColumnarCatalog)
+from backend.services.versioning import CATALOG_VERSION, get_version
+
+
+class Command(BaseCommand):
+    """
+    Сравнение задержки выборки каталога через ORM и через колоночный движок
+    на данных текущей БД.
+    """
+    help = 'Сравнивает задержку фильтрации и сортировки каталога: ORM против NumPy'
+
+    # Типовые запросы витрины: строка запроса в формате ProductInfoView
+    default_queries = (
+        'limit=20',
+        'ordering=price&limit=20',
+        'ordering=-price&price_min=100&price_max=100000&limit=20',
+        'ordering=quantity&offset=100&limit=50',
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50, help='Количество повторов каждого запроса')
+        parser.add_argument('--query', action='append', dest='queries',
+                            help='Строка запроса, например "category_id=1&ordering=price&limit=20"')
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError('Для колоночного движка требуется NumPy')
+
+        repeat = options['repeat']
+        started = time.perf_counter()
+        engine = ColumnarCatalog.load(get_version(CATALOG_VERSION))
+        load_ms = (time.perf_counter() - started) * 1000
+        self.stdout.write(f'Загрузка снимка: {len(engine.ids)} предложений за {load_ms:.1f} мс')
+
+        for query in options['queries'] or self.default_queries:
+            filters = parse_catalog_filters(QueryDict(query))
+            orm_ms, orm_result = self._measure(orm_catalog_page, filters, repeat)
+            engine_ms, engine_result = self._measure(engine.page, filters, repeat)
+            same = 'совпадает' if orm_result == engine_result else 'РАСХОДИТСЯ'
+            self.stdout.write(f'{query}: ORM {orm_ms:.3f} мс, NumPy {engine_ms:.3f} мс, '
+                              f'ускорение x{orm_ms / max(engine_ms, 1e-6):.1f}, результат {same}')
+
+    @staticmethod
+    def _measure(func, filters, repeat):
+        result = func(filters)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func(filters)
+        return (time.perf_counter() - started) * 1000 / repeat, result
@@ -0,0 +1,76 @@
+import socket
+import time
+
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.management.base import BaseCommand, CommandError
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:  # aiosmtpd нужен только для замера
+    Controller = None
+
+
+class SinkHandler:
+    """
+    Обработчик локального SMTP-сервера: принимает письма и отбрасывает их
+    """
+    async def handle_DATA(self, server, session, envelope):
+        return '250 Message accepted for delivery'
+
+
+class Command(BaseCommand):
+    """
+    Сравнение отправки писем по одному (новое SMTP-соединение на письмо, как send_email до пакетной отправки)
+    и пачкой через одно соединение (send_email_batch) на локальном SMTP-сервере aiosmtpd.
+    """
+    help = 'Сравнивает отправку писем с новым соединением на каждое письмо и через одно соединение'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=500, help='Количество писем')
+        parser.add_argument('--host', default=None,
+                            help='SMTP-сервер host:port вместо локального aiosmtpd (без TLS и авторизации)')
+
+    def handle(self, *args, **options):
+        controller = None
+        if options['host']:
+            host, _, port = options['host'].partition(':')
+            port = int(port or 25)
+        else:
+            if Controller is None:
+                raise CommandError('Для локального SMTP-сервера требуется aiosmtpd (pip install aiosmtpd)')
+            host, port = '127.0.0.1', self._free_port()
+            controller = Controller(SinkHandler(), hostname=host, port=port)
+            controller.start()
+
+        def connect():
+            return get_connection('django.core.mail.backends.smtp.EmailBackend', host=host, port=port,
+                                  username='', password='', use_tls=False, use_ssl=False)
+
+        emails = [EmailMultiAlternatives('Тест', 'Текст письма', 'bench@example.com', [f'user{i}@example.com'])
+                  for i in range(options['count'])]
+        try:
+            started = time.perf_counter()
+            for email in emails:
+                email.connection = connect()
+                email.send()
+            single = time.perf_counter() - started
+
+            started = time.perf_counter()
+            with connect() as connection:
+                for email in emails:
+                    connection.send_messages([email])
+            pooled = time.perf_counter() - started
+        finally:
+            if controller is not None:
+                controller.stop()
+
+        count = len(emails)
+        self.stdout.write(f'По одному: {single:.3f} с ({count / single:.0f} писем/с)')
+        self.stdout.write(f'Одно соединение: {pooled:.3f} с ({count / pooled:.0f} писем/с), '
+                          f'ускорение x{single / max(pooled, 1e-6):.1f}')
+
+    @staticmethod
+    def _free_port() -> int:
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Q
+
+from backend.models import Order
+from backend.services.orders import order_totals_expressions, recalculate_order_totals
+
+
+class Command(BaseCommand):
+    """
+    Проверка согласованности сохранённых итогов заказов с их позициями.
+    """
+    help = 'Находит заказы, у которых сохранённые итоги не совпадают с позициями'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Исправить найденные расхождения')
+
+    def handle(self, *args, **options):
+        expressions = order_totals_expressions()
+        mismatched = list(Order.objects.
+                          annotate(expected_sum=expressions['total_sum'],
+                                   expected_count=expressions['item_count']).
+                          filter(~Q(total_sum=F('expected_sum')) | ~Q(item_count=F('expected_count'))).
+                          order_by('id').
+                          values_list('id', 'total_sum', 'expected_sum', 'item_count', 'expected_count'))
+
+        for order_id, total_sum, expected_sum, item_count, expected_count in mismatched:
+            self.stdout.write(f'Заказ {order_id}: сумма {total_sum} (ожидается {expected_sum}), '
+                              f'позиций {item_count} (ожидается {expected_count})')
+
+        if not mismatched:
+            self.stdout.write(self.style.SUCCESS('Расхождений не найдено'))
+        elif options['fix']:
+            recalculate_order_totals(*[row[0] for row in mismatched])
+            self.stdout.write(self.style.SUCCESS(f'Исправлено заказов: {len(mismatched)}'))
+        else:
+            raise CommandError(f'Заказов с расхождениями: {len(mismatched)}')
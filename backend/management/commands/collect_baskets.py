@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from backend.services.basket import collect_abandoned_baskets
+
+
+class Command(BaseCommand):
+    """
+    Ручной запуск удаления заброшенных корзин (периодически выполняется задачей Celery beat).
+    """
+    help = 'Удаляет корзины, не менявшиеся заданное количество дней, пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Возраст корзины в днях (по умолчанию BASKET_GC_AFTER_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Количество корзин в одной транзакции')
+
+    def handle(self, *args, **options):
+        result = collect_abandoned_baskets(days=options['days'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено корзин: {result["baskets"]}, позиций: {result["items"]} за {result["seconds"]} с'))
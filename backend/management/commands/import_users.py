@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.services.users import UserImportError, parse_users_csv, import_users
+
+
+class Command(BaseCommand):
+    """
+    Массовое создание пользователей из CSV (то же, что admin/users/import, без ограничения числа строк).
+    """
+    help = 'Создаёт неактивных пользователей из CSV и отправляет письма с токенами подтверждения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV: email, password, first_name, last_name, company, position[, type]')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Процессов для хеширования паролей (по умолчанию USER_IMPORT_HASH_WORKERS)')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], 'rb') as file:
+                rows = parse_users_csv(file)
+        except (OSError, UserImportError) as error:
+            raise CommandError(str(error))
+
+        result = import_users(rows, workers=options['workers'])
+        for line, messages in result['errors'].items():
+            self.stderr.write(f'Строка {line}: {" ".join(messages)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {result["created"]}, пропущено строк: {len(result["errors"])}'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from backend.services.tokens import purge_expired_tokens
+
+
+class Command(BaseCommand):
+    """
+    Ручной запуск удаления просроченных токенов (периодически выполняется задачей Celery beat).
+    """
+    help = 'Удаляет просроченные токены подтверждения email, сброса пароля и токены неактивных пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Количество токенов в одной транзакции')
+
+    def handle(self, *args, **options):
+        result = purge_expired_tokens(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено токенов подтверждения: {result["confirm_email"]}, сброса пароля: {result["password_reset"]}, '
+            f'API: {result["auth"]} за {result["seconds"]} с'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from backend.services.best_offers import refresh_best_offers
+
+
+class Command(BaseCommand):
+    """
+    Полный пересчёт таблицы лучших предложений.
+    Нужен после миграции и для восстановления после ручных правок в БД.
+    """
+    help = 'Пересчитывает лучшие предложения по всем товарам'
+
+    def handle(self, *args, **options):
+        refreshed = refresh_best_offers()
+        self.stdout.write(self.style.SUCCESS(f'Товаров с лучшим предложением: {refreshed}'))
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.8 on 2026-10-19 00:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_best_offers(apps, schema_editor):
+    """
+    Заполняет таблицу лучших предложений для существующего каталога
+    (то же, что команда rebuild_best_offers): самое дешёвое предложение активного магазина
+    с ненулевым остатком, общее количество и число таких предложений по товару.
+    """
+    ProductInfo = apps.get_model('backend', 'ProductInfo')
+    ProductBestOffer = apps.get_model('backend', 'ProductBestOffer')
+    offers = (ProductInfo.objects.filter(shop__state=True, quantity__gt=0).
+              order_by('product_id', 'price', 'id').
+              values_list('id', 'product_id', 'shop_id', 'price', 'quantity'))
+    best = {}
+    for offer_id, product_id, shop_id, price, quantity in offers.iterator():
+        if product_id not in best:
+            best[product_id] = ProductBestOffer(product_id=product_id, product_info_id=offer_id, shop_id=shop_id,
+                                                price=price, total_quantity=0, offer_count=0)
+        best[product_id].total_quantity += quantity
+        best[product_id].offer_count += 1
+    ProductBestOffer.objects.bulk_create(best.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0002_productinfo_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductBestOffer',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='best_offer', serialize=False, to='backend.product', verbose_name='Товар')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Минимальная цена')),
+                ('total_quantity', models.PositiveIntegerField(verbose_name='Общее количество')),
+                ('offer_count', models.PositiveIntegerField(verbose_name='Количество предложений')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('product_info', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='backend.productinfo', verbose_name='Лучшее предложение')),
+                ('shop', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='backend.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Лучшее предложение',
+                'verbose_name_plural': 'Список лучших предложений',
+                'ordering': ('price',),
+                'indexes': [models.Index(fields=['price'], name='best_offer_price_idx')],
+            },
+        ),
+        migrations.RunPython(fill_best_offers, migrations.RunPython.noop),
+    ]
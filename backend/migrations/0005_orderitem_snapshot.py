@@ -0,0 +1,61 @@
+# Generated by Django 5.2.8 on 2026-10-19 00:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def snapshot_placed_orders(apps, schema_editor):
+    """
+    Фиксирует цену, товар и магазин в позициях уже оформленных заказов.
+    """
+    OrderItem = apps.get_model('backend', 'OrderItem')
+    ProductInfo = apps.get_model('backend', 'ProductInfo')
+    offer = ProductInfo.objects.filter(id=OuterRef('product_info_id'))
+    (OrderItem.objects.exclude(order__status='basket').filter(price__isnull=True, product_info__isnull=False).
+     update(price=Subquery(offer.values('price')[:1]),
+            product_name=Subquery(offer.values('product__name')[:1]),
+            external_id=Subquery(offer.values('external_id')[:1]),
+            shop_id=Subquery(offer.values('shop_id')[:1]),
+            shop_name=Subquery(offer.values('shop__name')[:1])))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0004_order_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='external_id',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Внешний ИД'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Цена'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_name',
+            field=models.CharField(blank=True, max_length=80, verbose_name='Название товара'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='shop',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_items', to='backend.shop', verbose_name='Магазин'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='shop_name',
+            field=models.CharField(blank=True, max_length=40, verbose_name='Название магазина'),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='product_info',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_items', to='backend.productinfo', verbose_name='Информация о товаре'),
+        ),
+        migrations.RunPython(snapshot_placed_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.8 on 2026-10-19 00:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def split_placed_orders(apps, schema_editor):
+    """
+    Создаёт подзаказы магазинов для уже оформленных заказов.
+    """
+    Order = apps.get_model('backend', 'Order')
+    ShopOrder = apps.get_model('backend', 'ShopOrder')
+    OrderItem = apps.get_model('backend', 'OrderItem')
+    orders = Order.objects.exclude(status='basket').values_list('id', 'status', 'created_at')
+    for order_id, status, created_at in orders.iterator():
+        lines = {}
+        for item in OrderItem.objects.filter(order_id=order_id).exclude(shop_id=None):
+            lines.setdefault(item.shop_id, []).append(item)
+        for shop_id, items in lines.items():
+            shop_order = ShopOrder.objects.create(
+                order_id=order_id, shop_id=shop_id, status=status,
+                total_sum=sum(item.quantity * (item.price or 0) for item in items),
+                item_count=len(items),
+            )
+            # created_at заполняется автоматически, поэтому дату заказа переносим отдельно
+            ShopOrder.objects.filter(id=shop_order.id).update(created_at=created_at)
+            OrderItem.objects.filter(id__in=[item.id for item in items]).update(shop_order_id=shop_order.id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0006_order_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('basket', 'Статус корзины'), ('new', 'Новый'), ('confirmed', 'Подтвержден'), ('assembled', 'Собран'), ('shipped', 'Отправлен'), ('delivered', 'Доставлен'), ('canceled', 'Отменен')], max_length=20, verbose_name='Статус заказа')),
+                ('total_sum', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Сумма заказа')),
+                ('item_count', models.PositiveIntegerField(default=0, verbose_name='Количество позиций')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_orders', to='backend.order', verbose_name='Заказ')),
+                ('shop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='shop_orders', to='backend.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Заказ магазина',
+                'verbose_name_plural': 'Список заказов магазинов',
+                'ordering': ('-created_at',),
+            },
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='shop_order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ordered_items', to='backend.shoporder', verbose_name='Заказ магазина'),
+        ),
+        migrations.AddIndex(
+            model_name='shoporder',
+            index=models.Index(fields=['shop', 'status', 'created_at'], name='shop_order_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoporder',
+            index=models.Index(fields=['shop', 'created_at'], name='shop_order_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='shoporder',
+            constraint=models.UniqueConstraint(fields=('order', 'shop'), name='unique_shop_order'),
+        ),
+        migrations.RunPython(split_placed_orders, migrations.RunPython.noop),
+    ]
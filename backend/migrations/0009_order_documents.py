@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-19 00:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0008_order_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorder',
+            name='document',
+            field=models.JSONField(blank=True, editable=False, null=True, verbose_name='Документ заказа'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='document',
+            field=models.JSONField(blank=True, editable=False, null=True, verbose_name='Документ заказа'),
+        ),
+        migrations.AddField(
+            model_name='shoporder',
+            name='document',
+            field=models.JSONField(blank=True, editable=False, null=True, verbose_name='Документ заказа'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0009_order_documents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedShopOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='ID подзаказа')),
+                ('status', models.CharField(choices=[('basket', 'Статус корзины'), ('new', 'Новый'), ('confirmed', 'Подтвержден'), ('assembled', 'Собран'), ('shipped', 'Отправлен'), ('delivered', 'Доставлен'), ('canceled', 'Отменен')], max_length=20, verbose_name='Статус заказа')),
+                ('total_sum', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Сумма заказа')),
+                ('item_count', models.PositiveIntegerField(default=0, verbose_name='Количество позиций')),
+                ('document', models.JSONField(blank=True, editable=False, null=True, verbose_name='Документ заказа')),
+                ('created_at', models.DateTimeField(verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(verbose_name='Дата обновления')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_orders', to='backend.archivedorder', verbose_name='Заказ')),
+                ('shop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_shop_orders', to='backend.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Архивный заказ магазина',
+                'verbose_name_plural': 'Архив заказов магазинов',
+                'ordering': ('-created_at',),
+            },
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='shop_order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ordered_items', to='backend.archivedshoporder', verbose_name='Заказ магазина'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedshoporder',
+            index=models.Index(fields=['shop', 'status', 'created_at'], name='archive_shop_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedshoporder',
+            index=models.Index(fields=['shop', 'created_at'], name='archive_shop_created_idx'),
+        ),
+    ]
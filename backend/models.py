@@ -103,7 +103,37 @@ class User(AbstractUser):
         ordering = ('email',)
 
 
-class Shop(models.Model):
+class ChangeTrackingModel(models.Model):
+    """
+    Запоминает значения полей, загруженные из БД, чтобы обработчики post_save
+    могли отличить реальное изменение записи от повторного сохранения тех же данных.
+    """
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {name: value for name, value in zip(field_names, values)
+                                   if value is not models.DEFERRED}
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Обработчики post_save уже отработали со старыми значениями, дальше сравниваем с сохранёнными
+        self._loaded_values = {field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields}
+
+    def changed_fields(self) -> set[str]:
+        """
+        Поля, отличающиеся от загруженных из БД. Для записи, не загруженной из БД, - все поля.
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return {field.attname for field in self._meta.concrete_fields}
+        return {name for name, value in loaded.items() if getattr(self, name) != value}
+
+
+class Shop(ChangeTrackingModel):
     objects = models.manager.Manager()
     name = models.CharField(max_length=40, verbose_name='Название')
     url = models.URLField(verbose_name='Ссылка', null=True, blank=True)
@@ -124,7 +154,7 @@ class Shop(models.Model):
         return self.name
 
 
-class Category(models.Model):
+class Category(ChangeTrackingModel):
     objects = models.manager.Manager()
     name = models.CharField(max_length=40, verbose_name='Название')
     shops = models.ManyToManyField(Shop, verbose_name='Магазины', related_name='categories', blank=True)
@@ -138,7 +168,7 @@ class Category(models.Model):
         return self.name
 
 
-class Product(models.Model):
+class Product(ChangeTrackingModel):
     objects = models.manager.Manager()
     name = models.CharField(max_length=80, verbose_name='Название')
     category = models.ForeignKey(Category,
@@ -155,7 +185,7 @@ class Product(models.Model):
         return self.name
 
 
-class ProductInfo(models.Model):
+class ProductInfo(ChangeTrackingModel):
     objects = models.manager.Manager()
     model = models.CharField(max_length=80, verbose_name='Модель', blank=True)
     external_id = models.PositiveIntegerField(verbose_name='Внешний ИД')
@@ -171,6 +201,7 @@ class ProductInfo(models.Model):
     quantity = models.PositiveIntegerField(verbose_name='Количество')
     price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Цена')
     price_rrc = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Рекомендуемая розничная цена')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата обновления')
 
     class Meta:
         verbose_name = 'Информация о товаре'
@@ -182,7 +213,7 @@ class ProductInfo(models.Model):
     def __str__(self):
         return f'{self.product.name} - {self.shop.name}'
 
-class Parameter(models.Model):
+class Parameter(ChangeTrackingModel):
     objects = models.manager.Manager()
     name = models.CharField(max_length=40, verbose_name='Название')
 
@@ -219,6 +250,44 @@ class ProductParameter(models.Model):
         return f'{self.product_info.product.name} - {self.parameter.name}: {self.value}'
 
 
+class ProductBestOffer(models.Model):
+    """
+    Лучшее предложение по товару среди всех активных магазинов.
+    Пересчитывается инкрементально при изменении предложений или статуса магазина.
+    """
+    objects = models.manager.Manager()
+    product = models.OneToOneField(Product,
+                                   verbose_name='Товар',
+                                   related_name='best_offer',
+                                   primary_key=True,
+                                   on_delete=models.CASCADE)
+    product_info = models.ForeignKey(ProductInfo,
+                                     verbose_name='Лучшее предложение',
+                                     related_name='+',
+                                     null=True,
+                                     on_delete=models.SET_NULL)
+    shop = models.ForeignKey(Shop,
+                             verbose_name='Магазин',
+                             related_name='+',
+                             null=True,
+                             on_delete=models.SET_NULL)
+    price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Минимальная цена')
+    total_quantity = models.PositiveIntegerField(verbose_name='Общее количество')
+    offer_count = models.PositiveIntegerField(verbose_name='Количество предложений')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        verbose_name = 'Лучшее предложение'
+        verbose_name_plural = 'Список лучших предложений'
+        ordering = ('price',)
+        indexes = [
+            models.Index(fields=['price'], name='best_offer_price_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id} - {self.price}'
+
+
 class Contact(models.Model):
     objects = models.manager.Manager()
     user = models.ForeignKey(User,
@@ -259,16 +328,68 @@ class Order(models.Model):
                                 blank=True,
                                 null=True,
                                 on_delete=models.CASCADE)
+    # Денормализованные итоги, обновляются в той же транзакции, что и позиции заказа
+    total_sum = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Сумма заказа')
+    item_count = models.PositiveIntegerField(default=0, verbose_name='Количество позиций')
+    # Отрисованные при оформлении позиции заказа; статус и контакт подставляются при чтении
+    document = models.JSONField(null=True, blank=True, editable=False, verbose_name='Документ заказа')
 
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Список заказов'
         ordering = ('-created_at',)
+        indexes = [
+            # История заказов пользователя с фильтром по статусу и без него
+            models.Index(fields=['user', 'status', 'created_at'], name='order_user_status_created_idx'),
+            models.Index(fields=['user', 'created_at'], name='order_user_created_idx'),
+        ]
 
     def __str__(self):
         return str(self.created_at)
 
 
+class ShopOrder(models.Model):
+    """
+    Часть заказа, относящаяся к одному магазину (подзаказ).
+    Создаётся при оформлении заказа, партнёр работает только со своими подзаказами.
+    """
+    objects = models.manager.Manager()
+    order = models.ForeignKey(Order,
+                              verbose_name='Заказ',
+                              related_name='shop_orders',
+                              on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop,
+                             verbose_name='Магазин',
+                             related_name='shop_orders',
+                             blank=True,
+                             null=True,
+                             on_delete=models.SET_NULL)
+    status = models.CharField(max_length=20,
+                              choices=STATE_CHOICES,
+                              verbose_name='Статус заказа')
+    total_sum = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Сумма заказа')
+    item_count = models.PositiveIntegerField(default=0, verbose_name='Количество позиций')
+    document = models.JSONField(null=True, blank=True, editable=False, verbose_name='Документ заказа')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        verbose_name = 'Заказ магазина'
+        verbose_name_plural = 'Список заказов магазинов'
+        ordering = ('-created_at',)
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'shop'], name='unique_shop_order')
+        ]
+        indexes = [
+            # Список заказов партнёра с фильтром по статусу и без него
+            models.Index(fields=['shop', 'status', 'created_at'], name='shop_order_status_created_idx'),
+            models.Index(fields=['shop', 'created_at'], name='shop_order_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'Заказ {self.order_id} - {self.shop_id}'
+
+
 class OrderItem(models.Model):
     objects = models.manager.Manager()
     order = models.ForeignKey(Order,
@@ -276,12 +397,31 @@ class OrderItem(models.Model):
                               related_name='ordered_items',
                               blank=True,
                               on_delete=models.CASCADE)
+    # Удаление предложения при перезагрузке прайса не должно удалять позиции оформленных заказов
     product_info = models.ForeignKey(ProductInfo,
                                      verbose_name='Информация о товаре',
                                      related_name='order_items',
                                      blank=True,
-                                     on_delete=models.CASCADE)
+                                     null=True,
+                                     on_delete=models.SET_NULL)
     quantity = models.PositiveIntegerField(verbose_name='Количество')
+    # Снимок предложения на момент оформления заказа (у позиций корзины не заполнен)
+    price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name='Цена')
+    product_name = models.CharField(max_length=80, blank=True, verbose_name='Название товара')
+    external_id = models.PositiveIntegerField(null=True, blank=True, verbose_name='Внешний ИД')
+    shop = models.ForeignKey(Shop,
+                             verbose_name='Магазин',
+                             related_name='order_items',
+                             blank=True,
+                             null=True,
+                             on_delete=models.SET_NULL)
+    shop_name = models.CharField(max_length=40, blank=True, verbose_name='Название магазина')
+    shop_order = models.ForeignKey(ShopOrder,
+                                   verbose_name='Заказ магазина',
+                                   related_name='ordered_items',
+                                   blank=True,
+                                   null=True,
+                                   on_delete=models.SET_NULL)
 
     class Meta:
         verbose_name = 'Товар заказа'
@@ -291,7 +431,125 @@ class OrderItem(models.Model):
         ]
 
     def __str__(self):
-        return f'Заказ {self.order.id} - {self.product_info.product.name}'
+        return f'Заказ {self.order_id} - {self.product_name or self.product_info_id}'
+
+
+class ArchivedOrder(models.Model):
+    """
+    Завершённый заказ, перенесённый из Order в архив. ID совпадает с ID исходного заказа.
+    """
+    objects = models.manager.Manager()
+    id = models.BigIntegerField(primary_key=True, verbose_name='ID заказа')
+    user = models.ForeignKey(User,
+                             verbose_name='Пользователь',
+                             related_name='archived_orders',
+                             on_delete=models.CASCADE)
+    contact = models.ForeignKey(Contact,
+                                verbose_name='Контакт',
+                                related_name='archived_orders',
+                                blank=True,
+                                null=True,
+                                on_delete=models.SET_NULL)
+    status = models.CharField(max_length=20,
+                              choices=STATE_CHOICES,
+                              verbose_name='Статус заказа')
+    total_sum = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Сумма заказа')
+    item_count = models.PositiveIntegerField(default=0, verbose_name='Количество позиций')
+    document = models.JSONField(null=True, blank=True, editable=False, verbose_name='Документ заказа')
+    created_at = models.DateTimeField(verbose_name='Дата создания')
+    updated_at = models.DateTimeField(verbose_name='Дата обновления')
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата архивации')
+
+    class Meta:
+        verbose_name = 'Архивный заказ'
+        verbose_name_plural = 'Архив заказов'
+        ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['user', 'status', 'created_at'], name='archive_user_status_idx'),
+            models.Index(fields=['user', 'created_at'], name='archive_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return str(self.created_at)
+
+
+class ArchivedShopOrder(models.Model):
+    """
+    Подзаказ магазина архивного заказа. ID совпадает с ID исходного подзаказа.
+    """
+    objects = models.manager.Manager()
+    id = models.BigIntegerField(primary_key=True, verbose_name='ID подзаказа')
+    order = models.ForeignKey(ArchivedOrder,
+                              verbose_name='Заказ',
+                              related_name='shop_orders',
+                              on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop,
+                             verbose_name='Магазин',
+                             related_name='archived_shop_orders',
+                             blank=True,
+                             null=True,
+                             on_delete=models.SET_NULL)
+    status = models.CharField(max_length=20,
+                              choices=STATE_CHOICES,
+                              verbose_name='Статус заказа')
+    total_sum = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Сумма заказа')
+    item_count = models.PositiveIntegerField(default=0, verbose_name='Количество позиций')
+    document = models.JSONField(null=True, blank=True, editable=False, verbose_name='Документ заказа')
+    created_at = models.DateTimeField(verbose_name='Дата создания')
+    updated_at = models.DateTimeField(verbose_name='Дата обновления')
+
+    class Meta:
+        verbose_name = 'Архивный заказ магазина'
+        verbose_name_plural = 'Архив заказов магазинов'
+        ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['shop', 'status', 'created_at'], name='archive_shop_status_idx'),
+            models.Index(fields=['shop', 'created_at'], name='archive_shop_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'Заказ {self.order_id} - {self.shop_id}'
+
+
+class ArchivedOrderItem(models.Model):
+    """
+    Позиция архивного заказа (снимок, зафиксированный при оформлении). ID совпадает с ID исходной позиции.
+    """
+    objects = models.manager.Manager()
+    order = models.ForeignKey(ArchivedOrder,
+                              verbose_name='Заказ',
+                              related_name='ordered_items',
+                              on_delete=models.CASCADE)
+    shop_order = models.ForeignKey(ArchivedShopOrder,
+                                   verbose_name='Заказ магазина',
+                                   related_name='ordered_items',
+                                   blank=True,
+                                   null=True,
+                                   on_delete=models.CASCADE)
+    product_info = models.ForeignKey(ProductInfo,
+                                     verbose_name='Информация о товаре',
+                                     related_name='+',
+                                     blank=True,
+                                     null=True,
+                                     on_delete=models.SET_NULL)
+    quantity = models.PositiveIntegerField(verbose_name='Количество')
+    price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name='Цена')
+    product_name = models.CharField(max_length=80, blank=True, verbose_name='Название товара')
+    external_id = models.PositiveIntegerField(null=True, blank=True, verbose_name='Внешний ИД')
+    shop = models.ForeignKey(Shop,
+                             verbose_name='Магазин',
+                             related_name='+',
+                             blank=True,
+                             null=True,
+                             on_delete=models.SET_NULL)
+    shop_name = models.CharField(max_length=40, blank=True, verbose_name='Название магазина')
+
+    class Meta:
+        verbose_name = 'Товар архивного заказа'
+        verbose_name_plural = 'Список товаров архивных заказов'
+
+    def __str__(self):
+        return f'Заказ {self.order_id} - {self.product_name}'
 
 
 class ConfirmEmailToken(models.Model):
@@ -0,0 +1,13 @@
+from rest_framework.pagination import CursorPagination
+
+
+class OrderCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация заказов от новых к старым.
+    Позиция хранится в курсоре, поэтому глубокие страницы не требуют OFFSET
+    и не сдвигаются при появлении новых заказов.
+    """
+    page_size = 20
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
@@ -1,5 +1,25 @@
+from django.core.exceptions import ObjectDoesNotExist
 from rest_framework import serializers
-from .models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Contact, Order, OrderItem
+from .models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Contact, Order, OrderItem, \
+    ProductBestOffer, ShopOrder, ArchivedOrder, ArchivedShopOrder, ArchivedOrderItem
+from .services.refcache import get_shop, get_category
+
+
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Поле первичного ключа, которое находит объект через справочный кэш, а не запросом к БД
+    """
+    def __init__(self, getter=None, **kwargs):
+        self.getter = getter
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        try:
+            return self.getter(data)
+        except ObjectDoesNotExist:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -23,7 +43,7 @@ class CategoryAdminSerializer(serializers.ModelSerializer):
 
 
 class ProductAdminWriteSerializer(serializers.ModelSerializer):
-    category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all())
+    category = CachedPrimaryKeyRelatedField(getter=get_category, queryset=Category.objects.all())
 
     class Meta:
         model = Product
@@ -32,7 +52,7 @@ class ProductAdminWriteSerializer(serializers.ModelSerializer):
 
 class ProductInfoAdminWriteSerializer(serializers.ModelSerializer):
     product = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all())
-    shop = serializers.PrimaryKeyRelatedField(queryset=Shop.objects.all())
+    shop = CachedPrimaryKeyRelatedField(getter=get_shop, queryset=Shop.objects.all())
 
     class Meta:
         model = ProductInfo
@@ -53,7 +73,7 @@ class OrderAdminUpdateSerializer(serializers.ModelSerializer):
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = ('id', 'name', 'shop')
+        fields = ('id', 'name', 'shops')
         read_only_fields = ('id',)
 
 
@@ -93,6 +113,16 @@ class ProductInfoSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class ProductBestOfferSerializer(serializers.ModelSerializer):
+    product = ProductSerializer(read_only=True)
+    shop = serializers.StringRelatedField()
+
+    class Meta:
+        model = ProductBestOffer
+        fields = ('product', 'product_info', 'shop_id', 'shop', 'price', 'total_quantity', 'offer_count')
+        read_only_fields = fields
+
+
 class ContactSerializer(serializers.ModelSerializer):
     class Meta:
         model = Contact
@@ -106,18 +136,81 @@ class ContactSerializer(serializers.ModelSerializer):
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
-        fields = ('id', 'order', 'product_info', 'quantity')
-        read_only_fields = ('id',)
+        fields = ('id', 'order', 'product_info', 'quantity', 'price', 'product_name', 'external_id',
+                  'shop', 'shop_name')
+        read_only_fields = ('id', 'price', 'product_name', 'external_id', 'shop', 'shop_name')
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Позиции корзины ещё не зафиксированы - показываем текущие данные предложения
+        if instance.price is None and instance.product_info_id is not None:
+            info = instance.product_info
+            data.update(price=str(info.price), product_name=info.product.name, external_id=info.external_id,
+                        shop=info.shop_id, shop_name=info.shop.name)
+        return data
+
+
+class OrderDocumentItemsField(serializers.Field):
+    """
+    Позиции заказа из документа, сохранённого при оформлении (без обращения к БД).
+    Если документа нет (корзина, старые заказы), позиции сериализуются item_serializer.
+    """
+    def __init__(self, item_serializer, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+        self.item_serializer = item_serializer
+
+    def to_representation(self, instance):
+        if instance.document is not None:
+            return instance.document['ordered_items']
+        return self.item_serializer(instance.ordered_items.all(), many=True).data
 
 
 class OrderSerializer(serializers.ModelSerializer):
-    ordered_items = OrderItemSerializer(many=True, read_only=True)
-    total_sum = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    ordered_items = OrderDocumentItemsField(OrderItemSerializer)
 
     class Meta:
         model = Order
-        fields = ('id', 'ordered_items', 'total_sum', 'contact', 'status', 'created_at', 'updated_at')
-        read_only_fields = ('id',)
+        fields = ('id', 'ordered_items', 'total_sum', 'item_count', 'contact', 'status', 'created_at', 'updated_at')
+        read_only_fields = ('id', 'total_sum', 'item_count')
+
+
+class ArchivedOrderItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ArchivedOrderItem
+        fields = ('id', 'order', 'product_info', 'quantity', 'price', 'product_name', 'external_id',
+                  'shop', 'shop_name')
+        read_only_fields = fields
+
+
+class ArchivedOrderSerializer(serializers.ModelSerializer):
+    ordered_items = OrderDocumentItemsField(ArchivedOrderItemSerializer)
+
+    class Meta:
+        model = ArchivedOrder
+        fields = ('id', 'ordered_items', 'total_sum', 'item_count', 'contact', 'status', 'created_at', 'updated_at',
+                  'archived_at')
+        read_only_fields = fields
 
 
+class ShopOrderSerializer(serializers.ModelSerializer):
+    ordered_items = OrderDocumentItemsField(OrderItemSerializer)
+    contact = serializers.PrimaryKeyRelatedField(source='order.contact', read_only=True)
 
+    class Meta:
+        model = ShopOrder
+        fields = ('id', 'order', 'shop', 'ordered_items', 'total_sum', 'item_count', 'contact', 'status',
+                  'created_at', 'updated_at')
+        read_only_fields = fields
+
+
+class ArchivedShopOrderSerializer(serializers.ModelSerializer):
+    ordered_items = OrderDocumentItemsField(ArchivedOrderItemSerializer)
+    contact = serializers.PrimaryKeyRelatedField(source='order.contact', read_only=True)
+
+    class Meta:
+        model = ArchivedShopOrder
+        fields = ('id', 'order', 'shop', 'ordered_items', 'total_sum', 'item_count', 'contact', 'status',
+                  'created_at', 'updated_at')
+        read_only_fields = fields
@@ -0,0 +1,67 @@
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from backend.models import Order, ShopOrder, OrderItem, ArchivedOrder, ArchivedShopOrder, ArchivedOrderItem
+
+
+# Конечные статусы: такие заказы больше не меняются и могут быть перенесены в архив
+ARCHIVE_STATUSES = ('delivered', 'canceled')
+
+ARCHIVED_ORDER_FIELDS = ('id', 'user_id', 'contact_id', 'status', 'total_sum', 'item_count', 'created_at', 'updated_at',
+                         'document')
+ARCHIVED_SHOP_ORDER_FIELDS = ('id', 'order_id', 'shop_id', 'status', 'total_sum', 'item_count', 'document',
+                              'created_at', 'updated_at')
+ARCHIVED_ITEM_FIELDS = ('id', 'order_id', 'shop_order_id', 'product_info_id', 'quantity', 'price', 'product_name',
+                        'external_id', 'shop_id', 'shop_name')
+
+
+def archive_cutoff() -> datetime.datetime:
+    """
+    Заказы, не менявшиеся с этого момента, считаются историческими.
+    """
+    return timezone.now() - datetime.timedelta(days=settings.ORDER_ARCHIVE_AFTER_DAYS)
+
+
+def archive_orders_batch(cutoff: datetime.datetime, batch_size: int) -> int:
+    """
+    Переносит в архив одну пачку завершённых заказов, не менявшихся с cutoff, в одной транзакции:
+    копирование заказов, подзаказов магазинов и позиций (bulk_create), затем удаление из рабочих таблиц.
+    Возвращает количество перенесённых заказов.
+    """
+    with transaction.atomic():
+        orders = list(Order.objects.select_for_update().
+                      filter(status__in=ARCHIVE_STATUSES, updated_at__lt=cutoff).
+                      order_by('id').values(*ARCHIVED_ORDER_FIELDS)[:batch_size])
+        if not orders:
+            return 0
+        order_ids = [order['id'] for order in orders]
+        ArchivedOrder.objects.bulk_create([ArchivedOrder(**order) for order in orders])
+        ArchivedShopOrder.objects.bulk_create([
+            ArchivedShopOrder(**shop_order) for shop_order in
+            ShopOrder.objects.filter(order_id__in=order_ids).order_by('id').values(*ARCHIVED_SHOP_ORDER_FIELDS)
+        ])
+        ArchivedOrderItem.objects.bulk_create([
+            ArchivedOrderItem(**item) for item in
+            OrderItem.objects.filter(order_id__in=order_ids).order_by('id').values(*ARCHIVED_ITEM_FIELDS)
+        ])
+        # Позиции и подзаказы магазинов (уже скопированные в архив) удаляются каскадно
+        Order.objects.filter(id__in=order_ids).delete()
+    return len(orders)
+
+
+def archive_orders(cutoff: datetime.datetime = None, batch_size: int = None) -> int:
+    """
+    Переносит в архив все подходящие заказы пачками по batch_size (каждая пачка - отдельная транзакция,
+    чтобы не держать блокировки долго). Возвращает общее количество перенесённых заказов.
+    """
+    cutoff = cutoff or archive_cutoff()
+    batch_size = batch_size or settings.ORDER_ARCHIVE_BATCH_SIZE
+    archived = 0
+    while True:
+        moved = archive_orders_batch(cutoff, batch_size)
+        archived += moved
+        if moved < batch_size:
+            return archived
@@ -0,0 +1,279 @@
+import datetime
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, OuterRef, Subquery, Value, Case, When, PositiveIntegerField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from backend.models import Order, OrderItem, ProductInfo
+from backend.services.basket_cache import basket_cache_enabled, basket_lock, get_cached_lines, set_cached_lines
+from backend.services.orders import recalculate_order_totals
+
+
+class BasketError(Exception):
+    """
+    Ошибка изменения корзины. errors возвращается клиенту как есть.
+    """
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def parse_basket_items(items, id_field: str, allow_zero: bool = False, accumulate: bool = True) -> dict[int, int]:
+    """
+    Проверяет список позиций вида [{id_field: int, 'quantity': int}, ...]
+    и возвращает словарь {id: количество}. Повторяющиеся позиции суммируются
+    (или, если accumulate=False, побеждает последнее значение).
+    """
+    if not isinstance(items, list) or not items:
+        raise BasketError('Ожидается непустой список позиций')
+
+    lines = {}
+    for item in items:
+        if not isinstance(item, dict):
+            raise BasketError('Неверный формат данных')
+        item_id, quantity = item.get(id_field), item.get('quantity')
+        # bool является подклассом int, поэтому исключаем его явно
+        if type(item_id) is not int or type(quantity) is not int:
+            raise BasketError(f'Поля {id_field} и quantity должны быть целыми числами')
+        if quantity < 0 or (quantity == 0 and not allow_zero):
+            raise BasketError(f'Некорректное количество для позиции {item_id}')
+        lines[item_id] = lines.get(item_id, 0) + quantity if accumulate else quantity
+    return lines
+
+
+def _check_offers(lines: dict[int, int], offers: dict[int, dict]) -> None:
+    # offers: {product_info_id: {'quantity', 'shop__state', 'in_basket'}}
+    errors = {}
+    for product_info_id, quantity in lines.items():
+        offer = offers.get(product_info_id)
+        if offer is None:
+            errors[product_info_id] = 'Товар не найден'
+        elif not offer['shop__state']:
+            errors[product_info_id] = 'Магазин не принимает заказы'
+        elif offer['in_basket'] + quantity > offer['quantity']:
+            errors[product_info_id] = f'Недостаточно товара, доступно: {offer["quantity"]}'
+    if errors:
+        raise BasketError(errors)
+
+
+@contextmanager
+def _cached_basket(user_id: int):
+    """
+    Позиции корзины из кэша для изменения на месте: записываются обратно,
+    если блок завершился без исключения.
+    """
+    try:
+        with basket_lock(user_id):
+            lines = get_cached_lines(user_id)
+            yield lines
+            set_cached_lines(user_id, lines)
+    except TimeoutError:
+        raise BasketError('Корзина изменяется другим запросом, повторите попытку')
+
+
+def add_basket_items(user_id: int, items) -> int:
+    """
+    Добавляет позиции в корзину пользователя атомарно.
+    Все позиции проверяются одним запросом (существование, активность магазина, остаток),
+    затем записываются одним upsert; количество уже лежащих в корзине позиций увеличивается.
+    Возвращает количество добавленных или изменённых строк корзины.
+    """
+    lines = parse_basket_items(items, 'product_info')
+    if basket_cache_enabled():
+        return _add_cached_items(user_id, lines)
+
+    with transaction.atomic():
+        basket, _ = Order.objects.get_or_create(user_id=user_id, status='basket')
+        # Блокируем корзину, чтобы параллельные добавления не потеряли количество
+        Order.objects.select_for_update().filter(id=basket.id).values_list('id', flat=True).get()
+
+        in_basket = OrderItem.objects.filter(order_id=basket.id, product_info_id=OuterRef('pk')).values('quantity')
+        offers = {
+            offer['id']: offer for offer in
+            ProductInfo.objects.filter(id__in=lines).
+            annotate(in_basket=Coalesce(Subquery(in_basket[:1]), Value(0))).
+            values('id', 'quantity', 'shop__state', 'in_basket')
+        }
+
+        _check_offers(lines, offers)
+
+        OrderItem.objects.bulk_create(
+            [OrderItem(order_id=basket.id,
+                       product_info_id=product_info_id,
+                       quantity=offers[product_info_id]['in_basket'] + quantity)
+             for product_info_id, quantity in lines.items()],
+            update_conflicts=True,
+            unique_fields=['order', 'product_info'],
+            update_fields=['quantity'],
+        )
+        recalculate_order_totals(basket.id)
+    return len(lines)
+
+
+def update_basket_items(user_id: int, items) -> tuple[int, int]:
+    """
+    Изменяет количество позиций корзины одним UPDATE ... CASE, позиции с нулевым количеством
+    удаляются одним DELETE. Затрагиваются только строки корзины пользователя.
+    Возвращает количество изменённых и удалённых строк.
+    """
+    lines = parse_basket_items(items, 'id', allow_zero=True, accumulate=False)
+    to_update = {item_id: quantity for item_id, quantity in lines.items() if quantity > 0}
+    to_remove = [item_id for item_id, quantity in lines.items() if quantity == 0]
+    if basket_cache_enabled():
+        return _update_cached_items(user_id, to_update, to_remove)
+
+    with transaction.atomic():
+        basket, _ = Order.objects.get_or_create(user_id=user_id, status='basket')
+        basket_items = OrderItem.objects.filter(order_id=basket.id)
+
+        updated = 0
+        if to_update:
+            updated = basket_items.filter(id__in=to_update).update(
+                quantity=Case(*[When(id=item_id, then=Value(quantity)) for item_id, quantity in to_update.items()],
+                              output_field=PositiveIntegerField())
+            )
+        removed = 0
+        if to_remove:
+            removed = basket_items.filter(id__in=to_remove).delete()[0]
+        recalculate_order_totals(basket.id)
+    return updated, removed
+
+
+def remove_basket_items(user_id: int, item_ids: list[int]) -> int:
+    """
+    Удаляет позиции из корзины пользователя одним DELETE и пересчитывает итоги.
+    Возвращает количество удалённых строк.
+    """
+    if basket_cache_enabled():
+        with _cached_basket(user_id) as cached:
+            return sum(cached.pop(item_id, None) is not None for item_id in item_ids)
+
+    with transaction.atomic():
+        basket, _ = Order.objects.get_or_create(user_id=user_id, status='basket')
+        removed = OrderItem.objects.filter(order_id=basket.id, id__in=item_ids).delete()[0]
+        recalculate_order_totals(basket.id)
+    return removed
+
+
+def _add_cached_items(user_id: int, lines: dict[int, int]) -> int:
+    with _cached_basket(user_id) as cached:
+        offers = {
+            offer['id']: dict(offer, in_basket=cached.get(offer['id'], 0)) for offer in
+            ProductInfo.objects.filter(id__in=lines).values('id', 'quantity', 'shop__state')
+        }
+        _check_offers(lines, offers)
+        for product_info_id, quantity in lines.items():
+            cached[product_info_id] = cached.get(product_info_id, 0) + quantity
+    return len(lines)
+
+
+def _update_cached_items(user_id: int, to_update: dict[int, int], to_remove: list[int]) -> tuple[int, int]:
+    # В кэше ID позиции корзины совпадает с ID предложения
+    with _cached_basket(user_id) as cached:
+        updated = [item_id for item_id in to_update if item_id in cached]
+        for item_id in updated:
+            cached[item_id] = to_update[item_id]
+        removed = sum(cached.pop(item_id, None) is not None for item_id in to_remove)
+    return len(updated), removed
+
+
+def cached_basket_data(user_id: int) -> list[dict]:
+    """
+    Корзина из кэша в том же формате, что и OrderSerializer для корзины в БД.
+    Цены и названия берутся из текущих предложений одним запросом.
+    """
+    lines = get_cached_lines(user_id)
+    if not lines:
+        return []
+    offers = ProductInfo.objects.filter(id__in=lines).select_related('product', 'shop').in_bulk()
+    items = []
+    total_sum = Decimal('0.00')
+    for product_info_id, quantity in sorted(lines.items()):
+        info = offers.get(product_info_id)
+        if info is None:
+            continue
+        items.append({
+            'id': info.id,
+            'order': None,
+            'product_info': info.id,
+            'quantity': quantity,
+            'price': str(info.price),
+            'product_name': info.product.name,
+            'external_id': info.external_id,
+            'shop': info.shop_id,
+            'shop_name': info.shop.name,
+        })
+        total_sum += info.price * quantity
+    return [{
+        'id': None,
+        'ordered_items': items,
+        'total_sum': str(total_sum.quantize(Decimal('0.01'))),
+        'item_count': len(items),
+        'contact': None,
+        'status': 'basket',
+        'created_at': None,
+        'updated_at': None,
+    }]
+
+
+def remove_offers_from_baskets(product_info_ids) -> int:
+    """
+    Удаляет из корзин в БД позиции снимаемых с продажи предложений и пересчитывает итоги корзин.
+    Вызывается в той же транзакции перед удалением предложений, иначе позиции остались бы
+    без товара (product_info = NULL). Корзины в кэше пропускают исчезнувшие предложения сами.
+    Возвращает количество удалённых позиций.
+    """
+    items = OrderItem.objects.filter(product_info_id__in=product_info_ids, order__status='basket')
+    basket_ids = list(items.values_list('order_id', flat=True).distinct())
+    if not basket_ids:
+        return 0
+    removed = items.delete()[0]
+    recalculate_order_totals(*basket_ids)
+    return removed
+
+
+def recalculate_baskets_with_offers(product_info_ids) -> int:
+    """
+    Пересчитывает итоги корзин в БД, содержащих предложения product_info_ids (после смены цены:
+    итог корзины считается по текущей цене предложения). Возвращает количество пересчитанных корзин.
+    """
+    basket_ids = list(OrderItem.objects.filter(product_info_id__in=product_info_ids, order__status='basket').
+                      values_list('order_id', flat=True).distinct())
+    if not basket_ids:
+        return 0
+    return recalculate_order_totals(*basket_ids)
+
+
+def collect_abandoned_baskets(days: int = None, batch_size: int = None) -> dict:
+    """
+    Удаляет корзины в БД, не менявшиеся days дней (BASKET_GC_AFTER_DAYS), и пустые корзины
+    старше BASKET_GC_EMPTY_AFTER_HOURS часов. Работает пачками по batch_size корзин,
+    каждая пачка - отдельная короткая транзакция; корзины, заблокированные в этот момент
+    изменением, пропускаются. Корзины в кэше (BASKET_BACKEND = 'cache') истекают сами по TTL.
+    Возвращает количество удалённых корзин и позиций и время работы в секундах.
+    """
+    days = settings.BASKET_GC_AFTER_DAYS if days is None else days
+    batch_size = batch_size or settings.BASKET_GC_BATCH_SIZE
+    now = timezone.now()
+    abandoned = (Q(updated_at__lt=now - datetime.timedelta(days=days)) |
+                 Q(item_count=0, updated_at__lt=now - datetime.timedelta(hours=settings.BASKET_GC_EMPTY_AFTER_HOURS)))
+
+    started = time.monotonic()
+    baskets = items = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            batch = list(Order.objects.select_for_update(skip_locked=True).
+                         filter(abandoned, status='basket', id__gt=last_id).
+                         order_by('id').values_list('id', flat=True)[:batch_size])
+            if not batch:
+                break
+            items += OrderItem.objects.filter(order_id__in=batch).delete()[0]
+            baskets += Order.objects.filter(id__in=batch, status='basket').delete()[1].get(Order._meta.label, 0)
+        last_id = batch[-1]
+    return {'baskets': baskets, 'items': items, 'seconds': round(time.monotonic() - started, 3)}
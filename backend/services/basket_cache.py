@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from backend.services.locks import cache_lock
+
+
+# Сколько ждать освобождения корзины, занятой параллельным запросом, секунды
+BASKET_LOCK_TIMEOUT = 5
+# Время жизни блокировки корзины: больше самого долгого изменения корзины (включая ожидание БД)
+BASKET_LOCK_TTL = 120
+
+
+def basket_cache_enabled() -> bool:
+    """
+    Корзина хранится в кэше, если BASKET_BACKEND = 'cache'.
+    В БД (Order/OrderItem) она записывается только при оформлении заказа.
+    """
+    return getattr(settings, 'BASKET_BACKEND', 'db') == 'cache'
+
+
+def _basket_key(user_id: int) -> str:
+    return f'basket:{user_id}'
+
+
+def get_cached_lines(user_id: int) -> dict[int, int]:
+    """
+    Позиции корзины пользователя из кэша: {product_info_id: количество}.
+    """
+    return cache.get(_basket_key(user_id)) or {}
+
+
+def set_cached_lines(user_id: int, lines: dict[int, int]) -> None:
+    """
+    Сохраняет позиции корзины. Пустая корзина удаляется из кэша.
+    Срок жизни продлевается при каждом изменении.
+    """
+    if lines:
+        cache.set(_basket_key(user_id), lines, timeout=settings.BASKET_CACHE_TIMEOUT)
+    else:
+        cache.delete(_basket_key(user_id))
+
+
+def clear_cached_basket(user_id: int) -> None:
+    cache.delete(_basket_key(user_id))
+
+
+def basket_lock(user_id: int):
+    """
+    Блокировка корзины на время чтения-изменения-записи,
+    чтобы параллельные запросы одного пользователя не потеряли изменения.
+    Выбрасывает TimeoutError, если корзина не освободилась за BASKET_LOCK_TIMEOUT.
+    """
+    return cache_lock(f'{_basket_key(user_id)}:lock', ttl=BASKET_LOCK_TTL, wait=BASKET_LOCK_TIMEOUT)
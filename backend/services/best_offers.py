@@ -0,0 +1,83 @@
+import threading
+from typing import Iterable
+
+from django.db import transaction
+
+from backend.models import Product, ProductInfo, ProductBestOffer
+
+
+# Ограничение на размер IN (...) в одном запросе
+REFRESH_BATCH_SIZE = 500
+
+_pending = threading.local()
+
+
+def refresh_best_offers(product_ids: Iterable[int] | None = None) -> int:
+    """
+    Пересчитывает таблицу лучших предложений для переданных товаров
+    (или для всех товаров, если product_ids не передан).
+    Учитываются только предложения активных магазинов с ненулевым остатком.
+    Возвращает количество товаров, для которых есть лучшее предложение.
+    """
+    if product_ids is None:
+        product_ids = Product.objects.values_list('id', flat=True)
+    product_ids = sorted(set(product_ids))
+
+    refreshed = 0
+    for start in range(0, len(product_ids), REFRESH_BATCH_SIZE):
+        batch = product_ids[start:start + REFRESH_BATCH_SIZE]
+        offers = (ProductInfo.objects.
+                  filter(product_id__in=batch, shop__state=True, quantity__gt=0).
+                  order_by('product_id', 'price', 'id').
+                  values_list('id', 'product_id', 'shop_id', 'price', 'quantity'))
+
+        # Предложения отсортированы по цене, поэтому первое по товару - самое дешёвое
+        best = {}
+        for offer_id, product_id, shop_id, price, quantity in offers:
+            if product_id not in best:
+                best[product_id] = ProductBestOffer(product_id=product_id,
+                                                    product_info_id=offer_id,
+                                                    shop_id=shop_id,
+                                                    price=price,
+                                                    total_quantity=0,
+                                                    offer_count=0)
+            best[product_id].total_quantity += quantity
+            best[product_id].offer_count += 1
+
+        with transaction.atomic():
+            ProductBestOffer.objects.filter(product_id__in=batch).exclude(product_id__in=best).delete()
+            ProductBestOffer.objects.bulk_create(
+                best.values(),
+                update_conflicts=True,
+                unique_fields=['product'],
+                update_fields=['product_info', 'shop', 'price', 'total_quantity', 'offer_count', 'updated_at'],
+            )
+        refreshed += len(best)
+    return refreshed
+
+
+def schedule_best_offer_refresh(product_ids: Iterable[int]) -> None:
+    """
+    Откладывает пересчёт до фиксации текущей транзакции.
+    Все товары, затронутые в одной транзакции (например, при импорте),
+    пересчитываются одним проходом.
+    """
+    pending = getattr(_pending, 'product_ids', None)
+    if pending is None:
+        pending = _pending.product_ids = set()
+    pending.update(product_ids)
+    transaction.on_commit(_flush_pending, robust=True)
+
+
+def schedule_shop_best_offer_refresh(shop_id: int) -> None:
+    """
+    Откладывает пересчёт всех товаров магазина (например, при смене статуса магазина).
+    """
+    schedule_best_offer_refresh(ProductInfo.objects.filter(shop_id=shop_id).values_list('product_id', flat=True))
+
+
+def _flush_pending() -> None:
+    product_ids = getattr(_pending, 'product_ids', None)
+    _pending.product_ids = None
+    if product_ids:
+        refresh_best_offers(product_ids)
@@ -0,0 +1,284 @@
+import re
+import threading
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Exists, FloatField, OuterRef, Value
+from django.db.models.functions import Cast, Replace, Trim
+
+from backend.models import ProductInfo, ProductParameter
+from backend.services.versioning import CATALOG_VERSION, STOCK_VERSION, get_version
+
+try:
+    import numpy as np
+except ImportError:  # NumPy нужен только для колоночного движка
+    np = None
+
+
+# Допустимые значения параметра ordering и соответствующие колонки
+ORDERING_FIELDS = ('id', 'price', 'price_rrc', 'quantity')
+
+# Числовое значение параметра (дробная часть через точку или запятую); остальные значения
+# в числовых фильтрах не участвуют. Одно правило для БД и для колоночного движка
+NUMERIC_VALUE_PATTERN = r'^\s*-?[0-9]+([.,][0-9]+)?\s*$'
+
+
+def parse_catalog_filters(query_params) -> dict:
+    """
+    Разбирает параметры запроса каталога в словарь фильтров, общий для ORM и колоночного движка.
+    Параметры: shop_id, category_id, price_min, price_max, ordering,
+    param=<название>:<мин>:<макс> (можно передать несколько раз), offset, limit.
+    Выбрасывает ValueError при некорректных значениях.
+    """
+    def to_int(name):
+        value = query_params.get(name)
+        return int(value) if value not in (None, '') else None
+
+    def to_float(value):
+        return float(value) if value not in (None, '') else None
+
+    ordering = query_params.get('ordering') or 'id'
+    if ordering.lstrip('-') not in ORDERING_FIELDS:
+        raise ValueError(f'Сортировка возможна по полям: {", ".join(ORDERING_FIELDS)}')
+
+    params = {}
+    for item in query_params.getlist('param') if hasattr(query_params, 'getlist') else ():
+        name, _, bounds = item.partition(':')
+        low, _, high = bounds.partition(':')
+        params[name] = (to_float(low), to_float(high))
+
+    offset = to_int('offset') or 0
+    limit = to_int('limit')
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ValueError('offset и limit не могут быть отрицательными')
+
+    return {
+        'shop_id': to_int('shop_id'),
+        'category_id': to_int('category_id'),
+        'price_min': to_float(query_params.get('price_min')),
+        'price_max': to_float(query_params.get('price_max')),
+        'params': params,
+        'ordering': ordering,
+        'offset': offset,
+        'limit': limit,
+    }
+
+
+def _numeric(value: str):
+    if value is None or not re.match(NUMERIC_VALUE_PATTERN, value):
+        return None
+    return float(value.strip().replace(',', '.'))
+
+
+def orm_catalog_page(filters: dict) -> tuple[int, list[int]]:
+    """
+    Отбор и сортировка предложений средствами БД.
+    Возвращает общее количество и ID предложений текущей страницы.
+    """
+    queryset = ProductInfo.objects.filter(shop__state=True)
+    if filters['shop_id']:
+        queryset = queryset.filter(shop_id=filters['shop_id'])
+    if filters['category_id']:
+        queryset = queryset.filter(product__category_id=filters['category_id'])
+    if filters['price_min'] is not None:
+        queryset = queryset.filter(price__gte=filters['price_min'])
+    if filters['price_max'] is not None:
+        queryset = queryset.filter(price__lte=filters['price_max'])
+    for name, (low, high) in filters['params'].items():
+        # Значения параметров хранятся строками: числовые отбираются регулярным выражением
+        # и приводятся к числу в БД, фильтр - коррелированный подзапрос EXISTS
+        values = (ProductParameter.objects.
+                  filter(product_info_id=OuterRef('pk'), parameter__name=name, value__regex=NUMERIC_VALUE_PATTERN).
+                  annotate(number=Cast(Replace(Trim('value'), Value(','), Value('.')), FloatField())))
+        if low is not None:
+            values = values.filter(number__gte=low)
+        if high is not None:
+            values = values.filter(number__lte=high)
+        queryset = queryset.filter(Exists(values))
+
+    end = filters['offset'] + filters['limit'] if filters['limit'] is not None else None
+    ids = queryset.order_by(filters['ordering'], 'id').values_list('id', flat=True)[filters['offset']:end]
+    return queryset.count(), list(ids)
+
+
+class ColumnarCatalog:
+    """
+    Снимок активных предложений в виде колонок NumPy.
+    Фильтры вычисляются векторными масками, сортировка - через argsort,
+    из БД затем загружается только страница найденных ID.
+    Снимок не изменяется: обновление остатков создаёт новый снимок с новой колонкой quantity.
+    """
+    def __init__(self, version: int, ids, shop_ids, category_ids, price, price_rrc, quantity, params: dict,
+                 stock_version: int = None):
+        self.version = version
+        self.stock_version = stock_version
+        self.ids = ids
+        self.shop_ids = shop_ids
+        self.category_ids = category_ids
+        self.columns = {'id': ids, 'price': price, 'price_rrc': price_rrc, 'quantity': quantity}
+        self.params = params
+
+    @classmethod
+    def load(cls, version: int, stock_version: int = None) -> 'ColumnarCatalog':
+        """
+        Загружает снимок каталога из БД (два запроса).
+        """
+        rows = list(ProductInfo.objects.filter(shop__state=True).order_by('id').
+                    values_list('id', 'shop_id', 'product__category_id', 'price', 'price_rrc', 'quantity'))
+        count = len(rows)
+        columns = list(zip(*rows)) if rows else [()] * 6
+        ids = np.fromiter(columns[0], dtype=np.int64, count=count)
+
+        params = {}
+        parameter_rows = (ProductParameter.objects.filter(product_info__shop__state=True).
+                          values_list('product_info_id', 'parameter__name', 'value'))
+        for product_info_id, name, value in parameter_rows.iterator():
+            number = _numeric(value)
+            if number is None:
+                continue
+            if name not in params:
+                params[name] = np.full(count, np.nan)
+            # ids отсортированы, поэтому позицию находим двоичным поиском
+            params[name][np.searchsorted(ids, product_info_id)] = number
+
+        return cls(version=version,
+                   ids=ids,
+                   shop_ids=np.fromiter(columns[1], dtype=np.int64, count=count),
+                   category_ids=np.fromiter(columns[2], dtype=np.int64, count=count),
+                   price=np.fromiter(columns[3], dtype=np.float64, count=count),
+                   price_rrc=np.fromiter(columns[4], dtype=np.float64, count=count),
+                   quantity=np.fromiter(columns[5], dtype=np.int64, count=count),
+                   params=params,
+                   stock_version=stock_version)
+
+    def with_quantities(self, stock_version: int) -> 'ColumnarCatalog':
+        """
+        Копия снимка с остатками, перечитанными из БД одним запросом (id, quantity).
+        Остальные колонки общие с исходным снимком.
+        """
+        rows = list(ProductInfo.objects.filter(shop__state=True).values_list('id', 'quantity'))
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        quantities = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+        # Предложения, появившиеся после загрузки снимка, в него не входят до полной перезагрузки
+        positions = np.minimum(np.searchsorted(self.ids, ids), max(len(self.ids) - 1, 0))
+        found = self.ids[positions] == ids if len(self.ids) else np.zeros(len(ids), dtype=bool)
+        quantity = self.columns['quantity'].copy()
+        quantity[positions[found]] = quantities[found]
+        return ColumnarCatalog(version=self.version, ids=self.ids, shop_ids=self.shop_ids,
+                               category_ids=self.category_ids, price=self.columns['price'],
+                               price_rrc=self.columns['price_rrc'], quantity=quantity, params=self.params,
+                               stock_version=stock_version)
+
+    def page(self, filters: dict) -> tuple[int, list[int]]:
+        """
+        Возвращает общее количество и ID предложений текущей страницы.
+        Семантика совпадает с orm_catalog_page.
+        """
+        mask = np.ones(len(self.ids), dtype=bool)
+        if filters['shop_id']:
+            mask &= self.shop_ids == filters['shop_id']
+        if filters['category_id']:
+            mask &= self.category_ids == filters['category_id']
+        if filters['price_min'] is not None:
+            mask &= self.columns['price'] >= filters['price_min']
+        if filters['price_max'] is not None:
+            mask &= self.columns['price'] <= filters['price_max']
+        for name, (low, high) in filters['params'].items():
+            column = self.params.get(name)
+            if column is None:
+                return 0, []
+            # Сравнение с NaN даёт False, поэтому предложения без параметра отсекаются
+            mask &= ~np.isnan(column)
+            if low is not None:
+                mask &= column >= low
+            if high is not None:
+                mask &= column <= high
+
+        positions = np.flatnonzero(mask)
+        ordering = filters['ordering']
+        if ordering != 'id':
+            values = self.columns[ordering.lstrip('-')][positions]
+            if ordering.startswith('-'):
+                values = -values
+            # Стабильная сортировка сохраняет порядок по id при равных значениях, как в ORM
+            positions = positions[np.argsort(values, kind='stable')]
+
+        end = filters['offset'] + filters['limit'] if filters['limit'] is not None else None
+        return len(positions), self.ids[positions[filters['offset']:end]].tolist()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+_reloading = False
+
+
+def columnar_engine_enabled() -> bool:
+    """
+    Колоночный движок включается настройкой CATALOG_ENGINE и требует NumPy
+    (без NumPy проверка backend.E001 не даёт запустить приложение).
+    """
+    return np is not None and getattr(settings, 'CATALOG_ENGINE', 'orm') == 'columnar'
+
+
+def reload_catalog_engine() -> ColumnarCatalog:
+    """
+    Приводит снимок каталога процесса к текущим версиям: при смене версии каталога загружает его заново,
+    при смене только версии остатков перечитывает колонку quantity.
+    """
+    global _engine
+    version, stock_version = get_version(CATALOG_VERSION), get_version(STOCK_VERSION)
+    engine = _engine
+    if engine is None or engine.version != version:
+        engine = ColumnarCatalog.load(version, stock_version)
+    elif engine.stock_version != stock_version:
+        engine = engine.with_quantities(stock_version)
+    _engine = engine
+    return engine
+
+
+def _reload_in_background() -> None:
+    global _reloading
+    try:
+        reload_catalog_engine()
+    finally:
+        _reloading = False
+        connections.close_all()
+
+
+def _start_reload() -> None:
+    """
+    Запускает обновление снимка в фоновом потоке (не больше одного одновременно).
+    """
+    global _reloading
+    with _engine_lock:
+        if _reloading:
+            return
+        _reloading = True
+    threading.Thread(target=_reload_in_background, name='catalog-reload', daemon=True).start()
+
+
+def get_catalog_engine(quantity: bool = False) -> ColumnarCatalog:
+    """
+    Снимок каталога текущего процесса. Первый снимок загружается в запросе, дальше при смене версии
+    каталога в общем кэше запросы обслуживает прежний снимок, пока новый загружается в фоновом потоке.
+    Версия остатков проверяется, только если запросу нужна колонка quantity (сортировка по остатку).
+    """
+    engine = _engine
+    if engine is None:
+        with _engine_lock:
+            if _engine is None:
+                reload_catalog_engine()
+            return _engine
+    if engine.version != get_version(CATALOG_VERSION) or (quantity and
+                                                          engine.stock_version != get_version(STOCK_VERSION)):
+        _start_reload()
+    return engine
+
+
+def catalog_page(filters: dict) -> tuple[int, list[int]]:
+    """
+    Страница ID предложений через колоночный движок, если он включён, иначе через ORM.
+    """
+    if columnar_engine_enabled():
+        return get_catalog_engine(quantity=filters['ordering'].lstrip('-') == 'quantity').page(filters)
+    return orm_catalog_page(filters)
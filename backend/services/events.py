@@ -0,0 +1,141 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+import redis
+import redis.asyncio
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from backend.models import Order, ShopOrder
+
+
+_pending = threading.local()
+
+
+def user_channel(user_id: int) -> str:
+    return f'orders:user:{user_id}'
+
+
+def shop_channel(shop_id: int) -> str:
+    return f'orders:shop:{shop_id}'
+
+
+class MemoryEventChannel:
+    """
+    Канал событий в памяти процесса (для разработки и тестов): события видят
+    только подписчики этого же процесса.
+    """
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, channel: str, message: str) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            # Публикация идёт из синхронного кода, подписчик живёт в своём event loop
+            loop.call_soon_threadsafe(queue.put_nowait, message)
+
+    async def listen(self, channels: list[str], timeout: float):
+        """
+        Асинхронный генератор сообщений каналов channels.
+        Если за timeout секунд сообщений не было, возвращает None (для keepalive).
+        """
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            for channel in channels:
+                self._subscribers[channel].add(subscriber)
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscriber[1].get(), timeout)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                for channel in channels:
+                    self._subscribers[channel].discard(subscriber)
+
+
+class RedisEventChannel:
+    """
+    Канал событий через Redis pub/sub: события видят подписчики всех процессов.
+    """
+    def __init__(self, url: str):
+        self.url = url
+        self._client = None
+
+    def publish(self, channel: str, message: str) -> None:
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url)
+        self._client.publish(channel, message)
+
+    async def listen(self, channels: list[str], timeout: float):
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(*channels)
+        try:
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+                yield message['data'].decode('utf-8') if message else None
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+            await client.aclose()
+
+
+_channel = None
+_channel_lock = threading.Lock()
+
+
+def get_event_channel():
+    """
+    Канал событий процесса: Redis, если задан EVENTS_URL, иначе память процесса.
+    """
+    global _channel
+    if _channel is None:
+        with _channel_lock:
+            if _channel is None:
+                url = getattr(settings, 'EVENTS_URL', None)
+                _channel = RedisEventChannel(url) if url else MemoryEventChannel()
+    return _channel
+
+
+def publish_status_changes(order_ids) -> None:
+    """
+    Публикует текущий статус заказов в каналы покупателей и магазинов (по подзаказам).
+    Два запроса на всю пачку заказов.
+    """
+    channel = get_event_channel()
+    for order in Order.objects.filter(id__in=order_ids).values('id', 'user_id', 'status', 'updated_at'):
+        channel.publish(user_channel(order['user_id']), json.dumps(
+            {'order_id': order['id'], 'status': order['status'], 'updated_at': order['updated_at']},
+            cls=DjangoJSONEncoder))
+    for shop_order in (ShopOrder.objects.filter(order_id__in=order_ids).exclude(shop_id=None).
+                       values('id', 'order_id', 'shop_id', 'status', 'updated_at')):
+        channel.publish(shop_channel(shop_order['shop_id']), json.dumps(
+            {'order_id': shop_order['order_id'], 'shop_order_id': shop_order['id'],
+             'status': shop_order['status'], 'updated_at': shop_order['updated_at']},
+            cls=DjangoJSONEncoder))
+
+
+def publish_status_changes_on_commit(order_ids) -> None:
+    """
+    Откладывает публикацию до фиксации транзакции, чтобы клиенты не увидели
+    статус, который ещё может откатиться. Заказы одной транзакции публикуются одной пачкой.
+    """
+    pending = getattr(_pending, 'order_ids', None)
+    if pending is None:
+        pending = _pending.order_ids = set()
+    pending.update(order_ids)
+    transaction.on_commit(_flush_pending, robust=True)
+
+
+def _flush_pending() -> None:
+    order_ids = getattr(_pending, 'order_ids', None)
+    _pending.order_ids = None
+    if order_ids:
+        publish_status_changes(order_ids)
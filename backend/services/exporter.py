@@ -0,0 +1,163 @@
+import csv
+import io
+import json
+import zlib
+from typing import Iterable, Iterator
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from backend.models import ProductInfo, OrderItem, ArchivedOrderItem
+
+
+# Размер пачки строк, которую выбирает серверный курсор и которую мы отдаем клиенту за раз
+EXPORT_CHUNK_SIZE = 2000
+
+OFFER_EXPORT_FIELDS = (
+    'id', 'external_id', 'model', 'product_id', 'product', 'category_id', 'category',
+    'shop_id', 'shop', 'quantity', 'price', 'price_rrc', 'updated_at', 'parameters',
+)
+
+
+def offers_export_queryset(shop_id=None, category_id=None, updated_since=None):
+    """
+    Queryset предложений для выгрузки: только активные магазины,
+    стабильный порядок по id, связанные объекты подтягиваются пачками.
+    """
+    queryset = ProductInfo.objects.filter(shop__state=True)
+    if shop_id:
+        queryset = queryset.filter(shop_id=shop_id)
+    if category_id:
+        queryset = queryset.filter(product__category_id=category_id)
+    if updated_since:
+        queryset = queryset.filter(updated_at__gte=updated_since)
+    return (queryset.
+            select_related('shop', 'product__category').
+            prefetch_related('product_parameters__parameter').
+            order_by('id'))
+
+
+def iter_offer_rows(queryset, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[dict]:
+    """
+    Построчно отдает предложения в виде плоских словарей.
+    Используется .iterator(), поэтому в памяти держится не больше одной пачки.
+    """
+    for info in queryset.iterator(chunk_size=chunk_size):
+        yield {
+            'id': info.id,
+            'external_id': info.external_id,
+            'model': info.model,
+            'product_id': info.product_id,
+            'product': info.product.name,
+            'category_id': info.product.category_id,
+            'category': info.product.category.name,
+            'shop_id': info.shop_id,
+            'shop': info.shop.name,
+            'quantity': info.quantity,
+            'price': info.price,
+            'price_rrc': info.price_rrc,
+            'updated_at': info.updated_at,
+            'parameters': {item.parameter.name: item.value for item in info.product_parameters.all()},
+        }
+
+
+ORDER_LINE_EXPORT_FIELDS = (
+    'order_id', 'shop_order_id', 'status', 'created_at', 'item_id', 'product_info_id', 'external_id',
+    'product_name', 'quantity', 'price', 'sum', 'email', 'phone', 'city', 'street', 'house', 'structure',
+    'building', 'apartment',
+)
+
+_ORDER_LINE_VALUES = {
+    'order_id': 'order_id',
+    'shop_order_id': 'shop_order_id',
+    'status': 'shop_order__status',
+    'created_at': 'shop_order__created_at',
+    'item_id': 'id',
+    'product_info_id': 'product_info_id',
+    'external_id': 'external_id',
+    'product_name': 'product_name',
+    'quantity': 'quantity',
+    'price': 'price',
+    'email': 'order__user__email',
+    'phone': 'order__contact__phone',
+    'city': 'order__contact__city',
+    'street': 'order__contact__street',
+    'house': 'order__contact__house',
+    'structure': 'order__contact__structure',
+    'building': 'order__contact__building',
+    'apartment': 'order__contact__apartment',
+}
+
+
+def partner_order_lines_queryset(shop_id: int, filters: dict, archive: bool = False):
+    """
+    Позиции подзаказов магазина для выгрузки. filters - фильтры подзаказа (status__in, created_at__gte, ...).
+    С archive=True позиции берутся из архива завершённых заказов.
+    Выбираются только плоские значения (values), без создания моделей и вложенной сериализации.
+    """
+    filters = {f'shop_order__{lookup}': value for lookup, value in filters.items()}
+    model = ArchivedOrderItem if archive else OrderItem
+    return (model.objects.filter(shop_order__shop_id=shop_id, **filters).
+            order_by('shop_order_id', 'id').
+            values(*_ORDER_LINE_VALUES.values()))
+
+
+def iter_order_line_rows(queryset, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[dict]:
+    """
+    Построчно отдает позиции заказов: одна строка на позицию, с суммой и контактом доставки.
+    """
+    for values in queryset.iterator(chunk_size=chunk_size):
+        row = {field: values[lookup] for field, lookup in _ORDER_LINE_VALUES.items()}
+        row['sum'] = row['price'] * row['quantity'] if row['price'] is not None else None
+        yield row
+
+
+def ndjson_chunks(rows: Iterable[dict], chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Сериализует строки в NDJSON (один JSON-объект на строку), отдавая их пачками.
+    """
+    buffer = []
+    for row in rows:
+        buffer.append(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False))
+        if len(buffer) >= chunk_size:
+            yield ('\n'.join(buffer) + '\n').encode('utf-8')
+            buffer = []
+    if buffer:
+        yield ('\n'.join(buffer) + '\n').encode('utf-8')
+
+
+def csv_chunks(rows: Iterable[dict], fields: tuple, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Сериализует строки в CSV с заголовком. Вложенные значения (словари, списки)
+    записываются в ячейку как JSON.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    written = 0
+    for row in rows:
+        writer.writerow([
+            json.dumps(row[field], cls=DjangoJSONEncoder, ensure_ascii=False)
+            if isinstance(row[field], (dict, list)) else row[field]
+            for field in fields
+        ])
+        written += 1
+        if written >= chunk_size:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            written = 0
+    # Заголовок отдаем даже при пустой выгрузке
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Сжимает поток на лету в формат gzip.
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,81 @@
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from backend.models import ProductInfo
+from backend.serializers import ProductInfoSerializer
+from backend.services.transactions import TransactionBatch
+
+
+# Сколько значений отбора передаётся в одном UPDATE ... WHERE <поле> IN (...)
+TOUCH_BATCH_SIZE = 500
+
+_pending = threading.local()
+
+
+def offer_fragment_key(product_info_id: int, updated_at) -> str:
+    """
+    Ключ фрагмента: ID предложения и версия строки (время последнего изменения).
+    После изменения предложения старый фрагмент становится недостижим и истекает по TTL.
+    """
+    return f'offer:{product_info_id}:{int(updated_at.timestamp() * 1000000)}'
+
+
+def render_offers(product_info_ids: list[int]) -> list[dict]:
+    """
+    Сериализованные предложения в порядке product_info_ids.
+    Готовые фрагменты берутся из кэша одним get_many, сериализуются только промахи.
+    """
+    versions = dict(ProductInfo.objects.filter(id__in=product_info_ids).values_list('id', 'updated_at'))
+    keys = {product_info_id: offer_fragment_key(product_info_id, updated_at)
+            for product_info_id, updated_at in versions.items()}
+    cached = cache.get_many(keys.values())
+    fragments = {product_info_id: cached[key] for product_info_id, key in keys.items() if key in cached}
+
+    missing = [product_info_id for product_info_id in keys if product_info_id not in fragments]
+    if missing:
+        queryset = (ProductInfo.objects.filter(id__in=missing).
+                    select_related('shop', 'product__category').
+                    prefetch_related('product_parameters__parameter'))
+        fresh = {}
+        for info in queryset:
+            fragments[info.id] = dict(ProductInfoSerializer(info).data)
+            fresh[offer_fragment_key(info.id, info.updated_at)] = fragments[info.id]
+        cache.set_many(fresh, timeout=settings.OFFER_FRAGMENT_TIMEOUT)
+
+    return [fragments[product_info_id] for product_info_id in product_info_ids if product_info_id in fragments]
+
+
+class _OfferTouchBatch(TransactionBatch):
+    """
+    Отборы предложений, которые нужно пометить изменёнными: значения собираются во множества по полю,
+    поэтому повторные изменения одних и тех же записей (удаление и создание параметров) не множатся.
+    """
+    def __init__(self):
+        super().__init__()
+        self.lookups = defaultdict(set)
+
+    def add(self, **lookups) -> None:
+        for field, value in lookups.items():
+            self.lookups[field].add(value)
+
+    def flush(self) -> None:
+        now = timezone.now()
+        for field, values in self.lookups.items():
+            values = sorted(values)
+            for start in range(0, len(values), TOUCH_BATCH_SIZE):
+                (ProductInfo.objects.filter(**{f'{field}__in': values[start:start + TOUCH_BATCH_SIZE]}).
+                 update(updated_at=now))
+
+
+def schedule_offer_touch(**lookups) -> None:
+    """
+    Помечает предложения, отобранные по lookups, изменёнными после фиксации транзакции.
+    Используется, когда меняются вложенные в фрагмент данные (товар, магазин, параметры):
+    новая версия строки инвалидирует фрагмент и попадает в выгрузку по updated_since.
+    Изменения одной транзакции применяются одним обработчиком on_commit, UPDATE - пачками по TOUCH_BATCH_SIZE значений.
+    """
+    _OfferTouchBatch.collect(_pending, **lookups)
@@ -3,6 +3,7 @@ import yaml
 from django.conf import settings
 from django.db import transaction
 from backend.models import Shop, Category, ProductInfo, Parameter, ProductParameter, Product
+from backend.services.refcache import get_category, get_or_create_parameter
 
 
 def import_data_from_yaml(file_path: str | None = None) -> dict:
@@ -65,7 +66,7 @@ def import_data_from_yaml(file_path: str | None = None) -> dict:
                 id=goods_data.get('id'),
                 defaults={
                     'name': goods_data['name'],
-                    'category': Category.objects.get(id=goods_data['category'])
+                    'category': get_category(goods_data['category'])
                 }
             )
 
@@ -94,9 +95,7 @@ def import_data_from_yaml(file_path: str | None = None) -> dict:
 
             # Импортируем параметры товара
             for param_name, param_value in goods_data.get('parameters', {}).items():
-                parameter, created = Parameter.objects.update_or_create(
-                    name=param_name
-                )
+                parameter, created = get_or_create_parameter(param_name)
                 if created:
                     stats['parameters_created'] += 1
                 product_parameter, created = ProductParameter.objects.update_or_create(
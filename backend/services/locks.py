@@ -0,0 +1,57 @@
+import secrets
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.core.cache.backends.redis import RedisCache
+
+
+# Удаление ключа блокировки, только если в нём всё ещё наш маркер (атомарно на стороне Redis)
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def acquire_lock(key: str, ttl: float) -> int | None:
+    """
+    Пытается занять блокировку в общем кэше (cache.add) и возвращает маркер владельца или None, если она занята.
+    ttl должен быть больше самого долгого выполнения под блокировкой: по его истечении блокировку
+    может занять другой запрос.
+    """
+    # Маркер - целое число: RedisCache хранит int без сериализации, и его можно сравнить в скрипте
+    token = secrets.randbits(62)
+    return token if cache.add(key, token, timeout=ttl) else None
+
+
+def release_lock(key: str, token: int) -> None:
+    """
+    Освобождает блокировку, только если её владелец - token. Блокировка, истёкшая и занятая другим
+    запросом, не снимается.
+    """
+    if isinstance(cache, RedisCache):
+        redis_key = cache.make_and_validate_key(key)
+        client = cache._cache.get_client(redis_key, write=True)
+        client.eval(_RELEASE_SCRIPT, 1, redis_key, str(token))
+    elif cache.get(key) == token:
+        # Кэш в памяти процесса: другие процессы его не видят, проверка и удаление не пересекаются с ними
+        cache.delete(key)
+
+
+@contextmanager
+def cache_lock(key: str, ttl: float, wait: float):
+    """
+    Блокировка в общем кэше на время блока. Ждёт освобождения не дольше wait секунд,
+    иначе выбрасывает TimeoutError.
+    """
+    deadline = time.monotonic() + wait
+    while (token := acquire_lock(key, ttl)) is None:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'Блокировка {key} занята')
+        time.sleep(0.01)
+    try:
+        yield
+    finally:
+        release_lock(key, token)
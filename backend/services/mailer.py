@@ -0,0 +1,116 @@
+import smtplib
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+
+from backend.services.transactions import TransactionBatch
+from backend.tasks import send_email_batch
+from backend.throttling import parse_rate, sliding_window_hit
+
+
+_pending = threading.local()
+_pool = threading.local()
+
+
+class EmailDeferred(Exception):
+    """
+    Отправка пачки прервана: sent писем уже отправлено, остальные нужно отправить повторно.
+    countdown - через сколько секунд повторить (при превышении лимита провайдера),
+    None - повтор с экспоненциальной задержкой (ошибка SMTP).
+    """
+    def __init__(self, sent: int, countdown: float = None):
+        super().__init__(f'Отправлено {sent} писем, отправка отложена')
+        self.sent = sent
+        self.countdown = countdown
+
+
+class _EmailBatch(TransactionBatch):
+    """
+    Письма одной транзакции, отправляемые одной задачей send_email_batch.
+    """
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def add(self, item: dict) -> None:
+        self.messages.append(item)
+
+    def flush(self) -> None:
+        if self.messages:
+            send_email_batch.delay(self.messages)
+
+
+def queue_email(to_email: str, subject: str, message: str) -> None:
+    """
+    Откладывает письмо до фиксации транзакции: письма одной транзакции отправляются одной задачей
+    send_email_batch, письма откатившейся транзакции (или точки сохранения) не отправляются.
+    Вне транзакции письмо ставится в очередь сразу.
+    """
+    _EmailBatch.collect(_pending, {'to_email': to_email, 'subject': subject, 'message': message})
+
+
+def get_pooled_connection():
+    """
+    Открытое SMTP-соединение процесса воркера, переиспользуемое между задачами.
+    Соединение, простаивавшее дольше EMAIL_CONNECTION_MAX_IDLE секунд, открывается заново:
+    серверы закрывают такие соединения сами.
+    """
+    connection = getattr(_pool, 'connection', None)
+    if connection is not None and (_pool.backend != settings.EMAIL_BACKEND or
+                                   time.monotonic() - _pool.used_at > settings.EMAIL_CONNECTION_MAX_IDLE):
+        close_pooled_connection()
+        connection = None
+    if connection is None:
+        connection = get_connection()
+        connection.open()
+        _pool.connection, _pool.backend = connection, settings.EMAIL_BACKEND
+    _pool.used_at = time.monotonic()
+    return connection
+
+
+def close_pooled_connection() -> None:
+    connection = getattr(_pool, 'connection', None)
+    _pool.connection = None
+    if connection is not None:
+        try:
+            connection.close()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+
+def _acquire_send_budget() -> float:
+    """
+    Учитывает письмо в лимите провайдера EMAIL_RATE_LIMIT (общий для всех воркеров, по EMAIL_HOST).
+    Возвращает 0, если письмо можно отправить, иначе - через сколько секунд повторить.
+    """
+    if not settings.EMAIL_RATE_LIMIT:
+        return 0
+    limit, window = parse_rate(settings.EMAIL_RATE_LIMIT)
+    now = time.time()
+    if sliding_window_hit(f'email:rate:{settings.EMAIL_HOST}', limit, window, now) > limit:
+        return window - now % window
+    return 0
+
+
+def send_email_messages(messages: list[dict]) -> int:
+    """
+    Отправляет письма (словари с ключами to_email, subject, message) по одному через общее соединение,
+    чтобы при сбое точно знать, сколько уже отправлено. Возвращает количество отправленных писем.
+    При превышении лимита провайдера или ошибке SMTP выбрасывает EmailDeferred.
+    """
+    from_email = getattr(settings, 'DEFAULT_FROM_EMAIL', None)
+    sent = 0
+    for item in messages:
+        wait = _acquire_send_budget()
+        if wait:
+            raise EmailDeferred(sent, countdown=wait)
+        email = EmailMultiAlternatives(item['subject'], item['message'], from_email, [item['to_email']])
+        try:
+            get_pooled_connection().send_messages([email])
+        except (smtplib.SMTPException, OSError) as error:
+            close_pooled_connection()
+            raise EmailDeferred(sent) from error
+        sent += 1
+    return sent
@@ -0,0 +1,346 @@
+import datetime
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Sum, Count, OuterRef, Subquery, Value, DecimalField, PositiveIntegerField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from backend.models import STATE_CHOICES, Order, ShopOrder, OrderItem, ProductInfo, Contact
+from backend.serializers import OrderItemSerializer
+from backend.services.basket_cache import basket_cache_enabled, get_cached_lines, clear_cached_basket
+from backend.services.best_offers import schedule_best_offer_refresh
+from backend.services.events import publish_status_changes_on_commit
+from backend.services.versioning import STOCK_VERSION, bump_version_on_commit
+from backend.tasks import send_email_batch
+
+
+# Статусы, в которых товар заказа зарезервирован на складе
+RESERVED_STATUSES = ('new', 'confirmed', 'assembled', 'shipped', 'delivered')
+
+# Допустимые переходы статусов при массовой смене статуса заказов
+ALLOWED_TRANSITIONS = {
+    'new': ('confirmed', 'canceled'),
+    'confirmed': ('assembled', 'canceled'),
+    'assembled': ('shipped', 'canceled'),
+    'shipped': ('delivered',),
+    'delivered': (),
+    'canceled': ('new',),
+}
+
+# Максимум заказов в одном запросе массовой смены статуса
+BULK_STATUS_MAX_ORDERS = 1000
+
+
+class OrderError(Exception):
+    """
+    Ошибка оформления или изменения заказа. errors возвращается клиенту как есть.
+    """
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def _parse_moment(value: str, end_of_day: bool = False):
+    # Дата без времени означает начало дня (или конец дня для верхней границы)
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            return None
+        moment = datetime.datetime.combine(day, datetime.time.max if end_of_day else datetime.time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def parse_order_filters(query_params) -> dict:
+    """
+    Фильтры списка заказов из query-параметров:
+    status (один или несколько через запятую), created_from и created_to (дата или дата и время).
+    Возвращает аргументы для QuerySet.filter(); при ошибке выбрасывает OrderError.
+    """
+    filters = {}
+    status = query_params.get('status')
+    if status:
+        statuses = [item.strip() for item in status.split(',') if item.strip()]
+        allowed = {choice for choice, _ in STATE_CHOICES if choice != 'basket'}
+        if not statuses or not set(statuses) <= allowed:
+            raise OrderError(f'Некорректный статус, допустимые значения: {", ".join(sorted(allowed))}')
+        filters['status__in'] = statuses
+    for param, lookup in (('created_from', 'created_at__gte'), ('created_to', 'created_at__lte')):
+        value = query_params.get(param)
+        if value:
+            moment = _parse_moment(value, end_of_day=param == 'created_to')
+            if moment is None:
+                raise OrderError(f'Некорректное значение {param}')
+            filters[lookup] = moment
+    return filters
+
+
+def order_totals_expressions(group_field: str = 'order_id') -> dict:
+    """
+    Выражения для расчёта итогов заказа по его позициям (подзапросы к OrderItem).
+    group_field - поле позиции, ссылающееся на заказ: order_id или shop_order_id для подзаказа магазина.
+    """
+    items = OrderItem.objects.filter(**{group_field: OuterRef('pk')}).order_by().values(group_field)
+    # Для оформленных заказов берётся зафиксированная цена, для корзины - текущая цена предложения
+    total_sum = (items.annotate(total=Sum(F('quantity') * Coalesce('price', 'product_info__price'))).
+                 values('total'))
+    item_count = items.annotate(count=Count('id')).values('count')
+    return {
+        'total_sum': Coalesce(Subquery(total_sum), Value(Decimal('0.00')),
+                              output_field=DecimalField(max_digits=12, decimal_places=2)),
+        'item_count': Coalesce(Subquery(item_count), Value(0), output_field=PositiveIntegerField()),
+    }
+
+
+def recalculate_order_totals(*order_ids: int) -> int:
+    """
+    Пересчитывает сохранённые итоги заказов одним UPDATE.
+    Вызывается в той же транзакции, что и изменение позиций.
+    """
+    return Order.objects.filter(id__in=order_ids).update(updated_at=timezone.now(), **order_totals_expressions())
+
+
+def recalculate_shop_order_totals(*order_ids: int) -> int:
+    """
+    Пересчитывает итоги подзаказов магазинов для заказов order_ids одним UPDATE.
+    """
+    return (ShopOrder.objects.filter(order_id__in=order_ids).
+            update(updated_at=timezone.now(), **order_totals_expressions('shop_order_id')))
+
+
+def split_order_by_shop(order_id: int, status: str) -> int:
+    """
+    Разбивает оформленный заказ на подзаказы магазинов: один ShopOrder на магазин,
+    позиции привязываются к своему подзаказу одним UPDATE, итоги считаются одним UPDATE.
+    Вызывается после фиксации снимка позиций (snapshot_order_items). Возвращает число подзаказов.
+    """
+    items = OrderItem.objects.filter(order_id=order_id)
+    shop_ids = set(items.exclude(shop_id=None).values_list('shop_id', flat=True))
+    ShopOrder.objects.bulk_create([ShopOrder(order_id=order_id, shop_id=shop_id, status=status)
+                                   for shop_id in sorted(shop_ids)])
+    shop_order = ShopOrder.objects.filter(order_id=order_id, shop_id=OuterRef('shop_id')).values('id')
+    items.update(shop_order_id=Subquery(shop_order[:1]))
+    ShopOrder.objects.filter(order_id=order_id).update(**order_totals_expressions('shop_order_id'))
+    return len(shop_ids)
+
+
+def render_order_documents(order_id: int) -> None:
+    """
+    Сохраняет отрисованные позиции заказа и его подзаказов магазинов в поле document.
+    Вызывается после фиксации снимка позиций и при их ручном изменении;
+    чтение заказов затем не обращается к позициям.
+    """
+    order_items = list(OrderItem.objects.filter(order_id=order_id).order_by('id'))
+    items = OrderItemSerializer(order_items, many=True).data
+    Order.objects.filter(id=order_id).update(document={'ordered_items': items})
+    by_shop_order = {}
+    for order_item, item in zip(order_items, items):
+        by_shop_order.setdefault(order_item.shop_order_id, []).append(item)
+    for shop_order_id in ShopOrder.objects.filter(order_id=order_id).values_list('id', flat=True):
+        ShopOrder.objects.filter(id=shop_order_id).update(
+            document={'ordered_items': by_shop_order.get(shop_order_id, [])})
+
+
+def order_items_changed(order_id: int) -> None:
+    """
+    Обновляет производные данные заказа после ручного изменения его позиций (например, в админке):
+    итоги заказа и подзаказов и, для оформленного заказа, его документ.
+    """
+    recalculate_order_totals(order_id)
+    recalculate_shop_order_totals(order_id)
+    if Order.objects.filter(id=order_id).exclude(status='basket').exists():
+        render_order_documents(order_id)
+
+
+def snapshot_order_items(order_id: int) -> int:
+    """
+    Фиксирует в позициях заказа цену, название товара и магазин на момент оформления
+    одним UPDATE. После этого изменение или удаление предложения не меняет заказ.
+    """
+    offer = ProductInfo.objects.filter(id=OuterRef('product_info_id'))
+    return OrderItem.objects.filter(order_id=order_id).update(
+        price=Subquery(offer.values('price')[:1]),
+        product_name=Subquery(offer.values('product__name')[:1]),
+        external_id=Subquery(offer.values('external_id')[:1]),
+        shop_id=Subquery(offer.values('shop_id')[:1]),
+        shop_name=Subquery(offer.values('shop__name')[:1]),
+    )
+
+
+def _order_lines(order_id: int) -> list[tuple[int, int]]:
+    # Сортировка по product_info_id задаёт единый порядок блокировок строк склада
+    # во всех транзакциях и исключает взаимные блокировки.
+    # Позиции удалённых предложений (product_info_id = NULL) склад не затрагивают
+    return list(Order.objects.get(id=order_id).ordered_items.
+                filter(product_info__isnull=False).
+                order_by('product_info_id').
+                values_list('product_info_id', 'quantity'))
+
+
+def _stock_changed(product_info_ids) -> None:
+    # update() не отправляет сигналы, поэтому производные данные каталога обновляем явно
+    schedule_best_offer_refresh(ProductInfo.objects.filter(id__in=product_info_ids).values_list('product_id', flat=True))
+    bump_version_on_commit(STOCK_VERSION)
+
+
+def reserve_stock(order_id: int) -> None:
+    """
+    Списывает со склада товары заказа условными UPDATE ... WHERE quantity >= n.
+    Вызывается внутри транзакции: при нехватке хотя бы одного товара выбрасывается OrderError,
+    и вся транзакция откатывается.
+    """
+    lines = _order_lines(order_id)
+    errors = {}
+    for product_info_id, quantity in lines:
+        reserved = (ProductInfo.objects.filter(id=product_info_id, quantity__gte=quantity).
+                    update(quantity=F('quantity') - quantity, updated_at=timezone.now()))
+        if not reserved:
+            errors[product_info_id] = 'Недостаточно товара на складе'
+    if errors:
+        raise OrderError(errors)
+    _stock_changed([product_info_id for product_info_id, _ in lines])
+
+
+def release_stock(order_id: int) -> None:
+    """
+    Возвращает на склад товары заказа (например, при отмене).
+    """
+    lines = _order_lines(order_id)
+    for product_info_id, quantity in lines:
+        (ProductInfo.objects.filter(id=product_info_id).
+         update(quantity=F('quantity') + quantity, updated_at=timezone.now()))
+    _stock_changed([product_info_id for product_info_id, _ in lines])
+
+
+def persist_cached_basket(user_id: int) -> None:
+    """
+    Переносит корзину из кэша в Order/OrderItem (заменяя позиции корзины в БД).
+    Вызывается внутри транзакции оформления; кэш очищается только после её фиксации,
+    поэтому при ошибке оформления корзина пользователя сохраняется.
+    """
+    lines = get_cached_lines(user_id)
+    if not lines:
+        return
+    basket, _ = Order.objects.get_or_create(user_id=user_id, status='basket')
+    OrderItem.objects.filter(order_id=basket.id).delete()
+    existing = set(ProductInfo.objects.filter(id__in=lines).values_list('id', flat=True))
+    OrderItem.objects.bulk_create([
+        OrderItem(order_id=basket.id, product_info_id=product_info_id, quantity=quantity)
+        for product_info_id, quantity in lines.items() if product_info_id in existing
+    ])
+    transaction.on_commit(lambda: clear_cached_basket(user_id), robust=True)
+
+
+def checkout_basket(user_id: int, contact_id: int) -> Order:
+    """
+    Оформляет корзину пользователя в заказ: резервирует товар, фиксирует цены позиций,
+    разбивает заказ на подзаказы магазинов, сохраняет документ заказа
+    и переводит его в статус new в одной транзакции.
+    В dropped_items возвращённого заказа - количество позиций, удалённых как снятые с продажи.
+    """
+    with transaction.atomic():
+        if basket_cache_enabled():
+            persist_cached_basket(user_id)
+        basket = Order.objects.select_for_update().filter(user_id=user_id, status='basket').first()
+        if basket is None or not basket.ordered_items.exists():
+            raise OrderError('Корзина пуста')
+        contact = Contact.objects.filter(id=contact_id, user_id=user_id).first()
+        if contact is None:
+            raise OrderError('Контакт не найден')
+
+        # Позиции предложений, снятых с продажи, удаляются из корзины, остальное оформляется
+        basket.dropped_items = basket.ordered_items.filter(product_info__isnull=True).delete()[0]
+        if basket.dropped_items and not basket.ordered_items.exists():
+            raise OrderError('Товары в корзине сняты с продажи')
+        reserve_stock(basket.id)
+        snapshot_order_items(basket.id)
+        split_order_by_shop(basket.id, 'new')
+        recalculate_order_totals(basket.id)
+        render_order_documents(basket.id)
+        basket.refresh_from_db(fields=['total_sum', 'item_count', 'updated_at', 'document'])
+        basket.contact = contact
+        basket.status = 'new'
+        basket.save()
+        publish_status_changes_on_commit([basket.id])
+    return basket
+
+
+def change_order_status(order: Order, previous_status: str) -> None:
+    """
+    Приводит склад и подзаказы магазинов в соответствие со сменой статуса заказа:
+    отмена возвращает товар, восстановление отменённого заказа снова его резервирует.
+    Вызывается внутри транзакции после сохранения нового статуса.
+    """
+    ShopOrder.objects.filter(order_id=order.id).update(status=order.status, updated_at=timezone.now())
+    _sync_stock(order.id, previous_status, order.status)
+    if order.status != previous_status:
+        publish_status_changes_on_commit([order.id])
+
+
+def _sync_stock(order_id: int, previous_status: str, status: str) -> None:
+    was_reserved = previous_status in RESERVED_STATUSES
+    is_reserved = status in RESERVED_STATUSES
+    if was_reserved and not is_reserved:
+        release_stock(order_id)
+    elif is_reserved and not was_reserved:
+        reserve_stock(order_id)
+
+
+def bulk_change_order_status(order_ids: list[int], status: str) -> dict[int, str]:
+    """
+    Переводит заказы order_ids в статус status по таблице ALLOWED_TRANSITIONS.
+    Статус принятых заказов и их подзаказов меняется одним UPDATE; склад меняется только
+    для заказов, которые выходят из резерва или возвращаются в него (каждый в своей точке сохранения,
+    чтобы нехватка товара по одному заказу не отменяла остальные).
+    Покупателям после фиксации транзакции отправляется одна пачка уведомлений.
+    Возвращает результат по каждому ID: 'ok' или текст ошибки.
+    """
+    results = {}
+    with transaction.atomic():
+        # Сортировка задаёт единый порядок блокировок
+        current = dict(Order.objects.select_for_update().
+                       filter(id__in=order_ids).exclude(status='basket').
+                       order_by('id').values_list('id', 'status'))
+        accepted = []
+        for order_id in order_ids:
+            previous_status = current.get(order_id)
+            if previous_status is None:
+                results[order_id] = 'Заказ не найден'
+            elif status not in ALLOWED_TRANSITIONS[previous_status]:
+                results[order_id] = f'Недопустимый переход статуса: {previous_status} -> {status}'
+            else:
+                try:
+                    with transaction.atomic():
+                        _sync_stock(order_id, previous_status, status)
+                except OrderError:
+                    results[order_id] = 'Недостаточно товара на складе'
+                else:
+                    results[order_id] = 'ok'
+                    accepted.append(order_id)
+
+        if accepted:
+            now = timezone.now()
+            Order.objects.filter(id__in=accepted).update(status=status, updated_at=now)
+            ShopOrder.objects.filter(order_id__in=accepted).update(status=status, updated_at=now)
+            _notify_status_changed(accepted, status)
+            publish_status_changes_on_commit(accepted)
+    return results
+
+
+def _notify_status_changed(order_ids: list[int], status: str) -> None:
+    label = dict(STATE_CHOICES)[status]
+    messages = [
+        {
+            'to_email': email,
+            'subject': 'Статус заказа изменён',
+            'message': f'Статус вашего заказа №{order_id}: {label}.',
+        }
+        for order_id, email in Order.objects.filter(id__in=order_ids).values_list('id', 'user__email')
+        if email
+    ]
+    if messages:
+        transaction.on_commit(lambda: send_email_batch.delay(messages), robust=True)
@@ -0,0 +1,152 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+
+from backend.models import Shop, Category, Parameter
+from backend.services.transactions import TransactionBatch
+from backend.services.versioning import get_version, bump_version_on_commit
+
+
+SHOPS_VERSION = 'ref:shops'
+CATEGORIES_VERSION = 'ref:categories'
+PARAMETERS_VERSION = 'ref:parameters'
+
+
+class _TransactionEntries(TransactionBatch):
+    """
+    Записи справочника, прочитанные или созданные в транзакции: видны её последующим обращениям,
+    в кэш процесса попадают после фиксации.
+    """
+    def __init__(self):
+        super().__init__()
+        self.reference_cache = None
+        self.entries = {}
+
+    def add(self, reference_cache, key, instance) -> None:
+        self.reference_cache = reference_cache
+        self.entries[key] = instance
+
+    def flush(self) -> None:
+        for key, instance in self.entries.items():
+            self.reference_cache.put(key, instance)
+
+
+class ReferenceCache:
+    """
+    Кэш небольшой справочной таблицы в памяти процесса.
+    Размер ограничен (вытесняются давно не использованные записи),
+    актуальность проверяется по версии в общем кэше не чаще раза в REFERENCE_CACHE_POLL_INTERVAL секунд.
+    Промахи (отсутствующие записи) не кэшируются. Записи, прочитанные внутри транзакции,
+    до её фиксации хранятся отдельно и переиспользуются только этой транзакцией.
+    """
+    def __init__(self, model, namespace: str, lookup_field: str = 'pk'):
+        self.model = model
+        self.namespace = namespace
+        self.lookup_field = lookup_field
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+        self._transaction_entries = threading.local()
+
+    def _sync(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < settings.REFERENCE_CACHE_POLL_INTERVAL:
+            return
+        self._checked_at = now
+        version = get_version(self.namespace)
+        if version != self._version:
+            with self._lock:
+                self._entries.clear()
+                self._version = version
+
+    def put(self, key, instance) -> None:
+        with self._lock:
+            self._entries[key] = instance
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.REFERENCE_CACHE_MAX_ENTRIES:
+                self._entries.popitem(last=False)
+
+    def put_on_commit(self, key, instance) -> None:
+        """
+        Кэширует запись, прочитанную или созданную в БД, только после фиксации текущей транзакции
+        (вне транзакции - сразу): при откате в кэше не останется записи, которой нет в БД.
+        До фиксации запись доступна последующим обращениям той же транзакции.
+        """
+        _TransactionEntries.collect(self._transaction_entries, self, key, instance)
+
+    def discard_pending(self) -> None:
+        """
+        Забывает записи, прочитанные в текущей транзакции (справочник в ней изменился).
+        """
+        pending = _TransactionEntries.pending(self._transaction_entries)
+        if pending is not None:
+            pending.entries.clear()
+
+    def get(self, key):
+        """
+        Запись по ключу. Выбрасывает model.DoesNotExist, если записи нет.
+        Возвращается копия, чтобы вызывающий код не изменил закэшированный объект.
+        """
+        self._sync()
+        pending = _TransactionEntries.pending(self._transaction_entries)
+        instance = pending.entries.get(key) if pending is not None else None
+        if instance is None:
+            with self._lock:
+                instance = self._entries.get(key)
+                if instance is not None:
+                    self._entries.move_to_end(key)
+        if instance is None:
+            instance = self.model.objects.get(**{self.lookup_field: key})
+            self.put_on_commit(key, instance)
+        return copy.copy(instance)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+shops = ReferenceCache(Shop, SHOPS_VERSION)
+categories = ReferenceCache(Category, CATEGORIES_VERSION)
+parameters_by_name = ReferenceCache(Parameter, PARAMETERS_VERSION, lookup_field='name')
+
+_caches = {
+    SHOPS_VERSION: (shops,),
+    CATEGORIES_VERSION: (categories,),
+    PARAMETERS_VERSION: (parameters_by_name,),
+}
+
+
+def get_shop(shop_id: int) -> Shop:
+    return shops.get(int(shop_id))
+
+
+def get_category(category_id: int) -> Category:
+    return categories.get(int(category_id))
+
+
+def get_or_create_parameter(name: str) -> tuple[Parameter, bool]:
+    """
+    Аналог Parameter.objects.get_or_create(name=name) с обращением к БД только при промахе.
+    """
+    try:
+        return parameters_by_name.get(name), False
+    except Parameter.DoesNotExist:
+        parameter, created = Parameter.objects.get_or_create(name=name)
+        parameters_by_name.put_on_commit(name, parameter)
+        return parameter, created
+
+
+def invalidate_reference_cache(namespace: str) -> None:
+    """
+    Инвалидирует справочник во всех процессах после фиксации транзакции:
+    локальная копия очищается сразу после коммита, остальные процессы увидят новую версию.
+    """
+    bump_version_on_commit(namespace)
+    for reference_cache in _caches[namespace]:
+        reference_cache.discard_pending()
+        transaction.on_commit(reference_cache.clear, robust=True)
@@ -0,0 +1,56 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django_rest_passwordreset.models import ResetPasswordToken, get_password_reset_token_expiry_time
+from rest_framework.authtoken.models import Token
+
+from backend.models import ConfirmEmailToken
+
+
+def _delete_in_batches(queryset, batch_size: int) -> int:
+    """
+    Удаляет записи queryset пачками по batch_size, каждая пачка - отдельная короткая транзакция.
+    Возвращает количество удалённых записей.
+    """
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            batch = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                return deleted
+            deleted += queryset.model.objects.filter(pk__in=batch).delete()[1].get(queryset.model._meta.label, 0)
+        if len(batch) < batch_size:
+            return deleted
+
+
+def purge_expired_tokens(batch_size: int = None) -> dict:
+    """
+    Удаляет просроченные токены подтверждения email (старше CONFIRM_EMAIL_TOKEN_EXPIRY_HOURS),
+    токены сброса пароля (старше срока django_rest_passwordreset) и токены API неактивных пользователей
+    (старше INACTIVE_USER_TOKEN_EXPIRY_DAYS), пачками по batch_size (TOKEN_PURGE_BATCH_SIZE).
+    Возвращает количество удалённых токенов каждого вида и время работы в секундах.
+    """
+    batch_size = batch_size or settings.TOKEN_PURGE_BATCH_SIZE
+    now = timezone.now()
+    started = time.monotonic()
+    result = {
+        'confirm_email': _delete_in_batches(
+            ConfirmEmailToken.objects.filter(
+                created_at__lt=now - datetime.timedelta(hours=settings.CONFIRM_EMAIL_TOKEN_EXPIRY_HOURS)),
+            batch_size),
+        'password_reset': _delete_in_batches(
+            ResetPasswordToken.objects.filter(
+                created_at__lt=now - datetime.timedelta(hours=get_password_reset_token_expiry_time())),
+            batch_size),
+        # Удаление токенов API сбрасывает их из кэша аутентификации (сигнал post_delete)
+        'auth': _delete_in_batches(
+            Token.objects.filter(
+                user__is_active=False,
+                created__lt=now - datetime.timedelta(days=settings.INACTIVE_USER_TOKEN_EXPIRY_DAYS)),
+            batch_size),
+    }
+    result['seconds'] = round(time.monotonic() - started, 3)
+    return result
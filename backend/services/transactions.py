@@ -0,0 +1,62 @@
+from django.db import transaction
+
+
+class TransactionBatch:
+    """
+    Изменения, накопленные в одной транзакции (точке сохранения) и применяемые одним обработчиком on_commit.
+    Подкласс реализует add (накопить) и flush (применить). Обработчик регистрируется один раз на пачку;
+    при откате Django отбрасывает его, а вместе с ним и накопленные изменения.
+    Вне транзакции изменение применяется сразу.
+    """
+    def __init__(self):
+        self.savepoint_ids = None
+        self.position = None
+        self.committed = False
+
+    def add(self, *args, **kwargs) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        raise NotImplementedError
+
+    def commit(self) -> None:
+        self.committed = True
+        self.flush()
+
+    def is_registered(self, connection) -> bool:
+        # Откат точки сохранения удаляет обработчики из списка, поэтому проверяем, что наш остался на своём месте
+        callbacks = connection.run_on_commit
+        return (not self.committed and self.position < len(callbacks) and
+                callbacks[self.position][1] == self.commit)
+
+    @classmethod
+    def pending(cls, local) -> 'TransactionBatch | None':
+        """
+        Пачка текущей транзакции (точки сохранения), если в ней уже что-то накоплено.
+        """
+        connection = transaction.get_connection()
+        batch = getattr(local, 'batch', None)
+        if (connection.in_atomic_block and isinstance(batch, cls) and
+                batch.savepoint_ids == connection.savepoint_ids and batch.is_registered(connection)):
+            return batch
+        return None
+
+    @classmethod
+    def collect(cls, local, *args, **kwargs) -> None:
+        """
+        Добавляет изменение в пачку текущей транзакции, хранящуюся в local (threading.local).
+        """
+        connection = transaction.get_connection()
+        if not connection.in_atomic_block:
+            batch = cls()
+            batch.add(*args, **kwargs)
+            batch.flush()
+            return
+        batch = cls.pending(local)
+        # Новая пачка нужна, если прежняя относится к другой точке сохранения или её транзакция откатилась
+        if batch is None:
+            batch = local.batch = cls()
+            batch.savepoint_ids = list(connection.savepoint_ids)
+            batch.position = len(connection.run_on_commit)
+            transaction.on_commit(batch.commit, robust=True)
+        batch.add(*args, **kwargs)
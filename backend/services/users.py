@@ -0,0 +1,194 @@
+import csv
+import io
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+
+from backend.models import User, ConfirmEmailToken, USER_TYPE_CHOICES
+
+
+USER_IMPORT_REQUIRED_FIELDS = ('email', 'password', 'first_name', 'last_name', 'company', 'position')
+USER_IMPORT_TYPES = {user_type for user_type, _ in USER_TYPE_CHOICES}
+
+
+class UserImportError(Exception):
+    """
+    Ошибка формата файла пользователей (в целом, а не отдельной строки)
+    """
+
+
+def parse_users_csv(content) -> list[dict]:
+    """
+    Читает CSV с заголовком (email, password, first_name, last_name, company, position и необязательный type)
+    из строки, байтов или файла. Возвращает список строк-словарей.
+    """
+    if hasattr(content, 'read'):
+        content = content.read()
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+    reader = csv.DictReader(io.StringIO(content))
+    missing = set(USER_IMPORT_REQUIRED_FIELDS) - set(reader.fieldnames or ())
+    if missing:
+        raise UserImportError(f'Нет колонок: {", ".join(sorted(missing))}')
+    return [{key: (value or '').strip() for key, value in row.items() if key} for row in reader]
+
+
+def validate_user_rows(rows: list[dict]) -> tuple[list[dict], dict]:
+    """
+    Проверяет строки: email (формат, повторы в файле и в БД), тип пользователя и сложность пароля.
+    Возвращает подходящие строки и ошибки по номерам строк файла (с учётом заголовка).
+    """
+    emails = [row['email'].lower() for row in rows]
+    existing = set(User.objects.filter(email__in=emails).values_list('email', flat=True))
+    existing = {email.lower() for email in existing}
+    seen = set()
+    valid, errors = [], {}
+    for line, (row, email) in enumerate(zip(rows, emails), start=2):
+        row['email'] = email
+        row['type'] = row.get('type') or 'buyer'
+        try:
+            validate_email(email)
+            if email in existing or email in seen:
+                raise ValidationError('Пользователь с таким email уже существует')
+            if row['type'] not in USER_IMPORT_TYPES:
+                raise ValidationError('Некорректный тип пользователя')
+            validate_password(row['password'], User(email=email, first_name=row['first_name'],
+                                                    last_name=row['last_name']))
+        except ValidationError as error:
+            errors[line] = error.messages
+            continue
+        seen.add(email)
+        valid.append(row)
+    return valid, errors
+
+
+def _init_hash_worker():
+    # При запуске процессов через spawn настройки Django в дочернем процессе не загружены
+    django.setup()
+
+
+def hash_passwords(passwords: list[str], workers: int = None) -> list[str]:
+    """
+    Хеширует пароли в пуле процессов (USER_IMPORT_HASH_WORKERS): хеширование нагружает CPU и
+    не распараллеливается потоками из-за GIL. Для одного процесса или пароля пул не создаётся.
+    """
+    workers = workers or settings.USER_IMPORT_HASH_WORKERS
+    if workers <= 1 or len(passwords) <= 1:
+        return [make_password(password) for password in passwords]
+    chunksize = max(1, len(passwords) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=min(workers, len(passwords)), initializer=_init_hash_worker) as executor:
+        return list(executor.map(make_password, passwords, chunksize=chunksize))
+
+
+def create_users(valid: list[dict], hashes: list[str]) -> int:
+    """
+    Создаёт неактивных пользователей из проверенных строк и готовых хешей паролей через bulk_create
+    (без сигнала post_save на каждого пользователя) вместе с токенами подтверждения email.
+    Письма с токенами отправляются одной задачей send_email_batch после фиксации транзакции.
+    Возвращает количество созданных пользователей.
+    """
+    from backend.tasks import send_email_batch
+
+    users = [User(email=row['email'], username=row['email'], password=password, first_name=row['first_name'],
+                  last_name=row['last_name'], company=row['company'], position=row['position'], type=row['type'],
+                  is_active=False)
+             for row, password in zip(valid, hashes)]
+    with transaction.atomic():
+        User.objects.bulk_create(users, batch_size=settings.USER_IMPORT_BATCH_SIZE)
+        tokens = ConfirmEmailToken.objects.bulk_create(
+            [ConfirmEmailToken(user=user, key=ConfirmEmailToken.generate_key()) for user in users],
+            batch_size=settings.USER_IMPORT_BATCH_SIZE)
+        messages = [{'to_email': token.user.email,
+                     'subject': 'Подтвердите свой адрес электронной почты',
+                     'message': f'Ваш токен подтверждения: {token.key}'} for token in tokens]
+        transaction.on_commit(lambda: send_email_batch.delay(messages))
+    return len(users)
+
+
+def import_users(rows: list[dict], workers: int = None) -> dict:
+    """
+    Массовое создание неактивных пользователей в текущем процессе (команда import_users):
+    пароли хешируются в пуле процессов, строки с ошибками пропускаются.
+    Возвращает количество созданных пользователей и ошибки по номерам строк.
+    """
+    valid, errors = validate_user_rows(rows)
+    if not valid:
+        return {'created': 0, 'errors': errors}
+    hashes = hash_passwords([row['password'] for row in valid], workers)
+    return {'created': create_users(valid, hashes), 'errors': errors}
+
+
+def save_users_upload(content: bytes) -> str:
+    """
+    Сохраняет загруженный CSV в USER_IMPORT_UPLOAD_DIR (доступен только владельцу процесса)
+    для задачи backend.import_users. Возвращает путь к файлу.
+    """
+    os.makedirs(settings.USER_IMPORT_UPLOAD_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix='.csv', dir=settings.USER_IMPORT_UPLOAD_DIR)
+    with os.fdopen(fd, 'wb') as file:
+        file.write(content)
+    return path
+
+
+def read_users_upload(path: str) -> list[dict]:
+    with open(path, 'rb') as file:
+        return parse_users_csv(file)
+
+
+def discard_users_upload(path: str) -> None:
+    """
+    Удаляет сохранённый CSV (в нём пароли в открытом виде).
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def plan_users_upload(path: str) -> tuple[list[list[int]], dict]:
+    """
+    Делит подходящие строки сохранённого CSV на части по USER_IMPORT_HASH_CHUNK_SIZE для хеширования
+    паролей отдельными задачами. Возвращает номера строк (с нуля) по частям и ошибки по номерам строк;
+    если подходящих строк нет, удаляет файл.
+    """
+    rows = read_users_upload(path)
+    _, errors = validate_user_rows(rows)
+    indices = [index for index in range(len(rows)) if index + 2 not in errors]
+    if not indices:
+        discard_users_upload(path)
+    size = settings.USER_IMPORT_HASH_CHUNK_SIZE
+    return [indices[start:start + size] for start in range(0, len(indices), size)], errors
+
+
+def hash_users_upload(path: str, indices: list[int]) -> dict[str, str]:
+    """
+    Хеши паролей строк indices сохранённого CSV: {номер строки: хеш}. Пароли в открытом виде
+    остаются в файле и не передаются через брокер задач.
+    """
+    rows = read_users_upload(path)
+    return {str(index): make_password(rows[index]['password']) for index in indices}
+
+
+def create_users_from_upload(path: str, hash_chunks: list[dict[str, str]]) -> dict:
+    """
+    Создаёт пользователей из сохранённого CSV с паролями, захешированными задачами hash_users_upload,
+    и удаляет файл. Строки проверяются повторно: email мог быть занят, пока хешировались пароли.
+    Возвращает количество созданных пользователей и ошибки по номерам строк.
+    """
+    try:
+        rows = read_users_upload(path)
+    finally:
+        discard_users_upload(path)
+    hashes = {int(index): password for chunk in hash_chunks for index, password in chunk.items()}
+    _, errors = validate_user_rows(rows)
+    pairs = [(row, hashes[index]) for index, row in enumerate(rows) if index + 2 not in errors and index in hashes]
+    created = create_users([row for row, _ in pairs], [password for _, password in pairs])
+    return {'created': created, 'errors': errors}
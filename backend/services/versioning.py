@@ -0,0 +1,65 @@
+import threading
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+# Пространство версий для каталога предложений (ProductInfo, параметры, статусы магазинов)
+CATALOG_VERSION = 'catalog'
+
+# Пространство версий остатков предложений: меняется при каждом оформлении и отмене заказа,
+# поэтому отделено от CATALOG_VERSION и не вызывает полную перезагрузку снимка каталога
+STOCK_VERSION = 'catalog:stock'
+
+_pending = threading.local()
+
+
+def _version_key(namespace: str) -> str:
+    return f'version:{namespace}'
+
+
+def get_version(namespace: str) -> int:
+    """
+    Текущая версия данных пространства namespace из общего кэша.
+    Один дешёвый запрос к кэшу, который видят все процессы.
+    """
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+    return version
+
+
+def bump_version(namespace: str) -> int:
+    """
+    Увеличивает версию данных, тем самым инвалидируя все локальные копии в процессах.
+    """
+    key = _version_key(namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Ключа ещё нет (или он вытеснен) - начинаем со второй версии,
+        # чтобы она отличалась от версии по умолчанию
+        cache.add(key, 2, timeout=None)
+        return cache.get(key, 2)
+
+
+def bump_version_on_commit(namespace: str) -> None:
+    """
+    Откладывает увеличение версии до фиксации транзакции,
+    чтобы читатели не загрузили данные до коммита.
+    В рамках одной транзакции версия увеличивается один раз.
+    """
+    pending = getattr(_pending, 'namespaces', None)
+    if pending is None:
+        pending = _pending.namespaces = set()
+    pending.add(namespace)
+    transaction.on_commit(_flush_pending, robust=True)
+
+
+def _flush_pending() -> None:
+    namespaces = getattr(_pending, 'namespaces', None)
+    _pending.namespaces = None
+    for namespace in namespaces or ():
+        bump_version(namespace)
@@ -1,9 +1,18 @@
 from typing import Type
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import Signal, receiver
-from django_rest_passwordreset.signals import reset_password_token_created
-from backend.models import User, ConfirmEmailToken
-from backend.tasks import send_email
+from django_rest_passwordreset.signals import reset_password_token_created, post_password_reset
+from rest_framework.authtoken.models import Token
+from backend.authentication import invalidate_token_cache
+from backend.models import User, ConfirmEmailToken, Shop, Category, Product, ProductInfo, Parameter, \
+    ProductParameter
+from backend.services.basket import recalculate_baskets_with_offers
+from backend.services.best_offers import schedule_best_offer_refresh, schedule_shop_best_offer_refresh
+from backend.services.fragments import schedule_offer_touch
+from backend.services.refcache import (SHOPS_VERSION, CATEGORIES_VERSION, PARAMETERS_VERSION,
+                                       invalidate_reference_cache)
+from backend.services.versioning import CATALOG_VERSION, bump_version_on_commit
+from backend.services.mailer import queue_email
 
 
 new_user_registered = Signal()
@@ -15,7 +24,7 @@ def password_reset_token_created_receiver(sender, instance, reset_password_token
     Отправка письма с токеном для сброса пароля.
     Через Celery.
     """
-    send_email.delay(
+    queue_email(
         to_email=reset_password_token.user.email,
         subject=f"Токен сброса пароля для {reset_password_token.user}",
         message=f"Ваш токен для сброса пароля: {reset_password_token.key}",
@@ -30,7 +39,7 @@ def new_user_registered_receiver(sender: Type[User], instance: User, created: bo
     """
     if created and not instance.is_active:
         token, _ = ConfirmEmailToken.objects.get_or_create(user_id=instance.pk)
-        send_email.delay(
+        queue_email(
             to_email=instance.email,
             subject="Подтвердите свой адрес электронной почты",
             message=f"Ваш токен подтверждения: {token.key}",
@@ -45,10 +54,127 @@ def new_order_signal(sender, user_id, **kwargs):
     """
     try:
         user = User.objects.get(pk=user_id)
-        send_email.delay(
+        queue_email(
             to_email=user.email,
             subject="Новый заказ создан",
             message="Ваш заказ успешно создан.",
         )
     except User.DoesNotExist:
-        pass
\ No newline at end of file
+        pass
+
+
+@receiver(post_save, sender=User)
+def user_changed_token_cache_receiver(sender, instance: User, created: bool, **kwargs):
+    """
+    Сброс кэша проверки токена пользователя при изменении пользователя
+    (смена пароля, деактивация, смена типа): следующий запрос прочитает его из БД.
+    """
+    if not created:
+        invalidate_token_cache(*Token.objects.filter(user_id=instance.pk).values_list('key', flat=True))
+
+
+@receiver(post_password_reset)
+def password_reset_token_cache_receiver(sender, user, *args, **kwargs):
+    """
+    Сброс кэша проверки токена после сброса пароля.
+    """
+    invalidate_token_cache(*Token.objects.filter(user_id=user.pk).values_list('key', flat=True))
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted_receiver(sender, instance: Token, **kwargs):
+    """
+    Удалённый токен (выход, отзыв в админке) сразу перестаёт приниматься.
+    """
+    invalidate_token_cache(instance.key)
+
+
+@receiver(post_save, sender=ProductInfo)
+@receiver(post_delete, sender=ProductInfo)
+def product_info_changed_receiver(sender, instance: ProductInfo, **kwargs):
+    """
+    Пересчёт лучшего предложения по товару после изменения или удаления предложения,
+    а после смены цены - итогов корзин с этим предложением (в той же транзакции).
+    """
+    schedule_best_offer_refresh([instance.product_id])
+    bump_version_on_commit(CATALOG_VERSION)
+    if kwargs['signal'] is post_save and not kwargs['created'] and 'price' in instance.changed_fields():
+        recalculate_baskets_with_offers([instance.id])
+
+
+@receiver(post_save, sender=Shop)
+def shop_changed_receiver(sender, instance: Shop, created: bool, **kwargs):
+    """
+    Пересчёт лучших предложений по товарам магазина (например, после смены статуса)
+    и инвалидация фрагментов его предложений. Повторное сохранение без изменений (импорт) ничего не пересчитывает.
+    """
+    if not created and instance.changed_fields():
+        schedule_shop_best_offer_refresh(instance.id)
+        schedule_offer_touch(shop_id=instance.id)
+        bump_version_on_commit(CATALOG_VERSION)
+
+
+@receiver(post_save, sender=ProductParameter)
+@receiver(post_delete, sender=ProductParameter)
+def product_parameter_changed_receiver(sender, instance: ProductParameter, **kwargs):
+    """
+    Новая версия каталога и инвалидация фрагмента после изменения параметров предложения.
+    """
+    schedule_offer_touch(id=instance.product_info_id)
+    bump_version_on_commit(CATALOG_VERSION)
+
+
+@receiver(post_save, sender=Product)
+def product_changed_receiver(sender, instance: Product, created: bool, **kwargs):
+    """
+    Инвалидация фрагментов предложений после изменения товара,
+    после смены категории - и новая версия каталога (фильтр по категории).
+    """
+    if not created and instance.changed_fields():
+        schedule_offer_touch(product_id=instance.id)
+        if 'category_id' in instance.changed_fields():
+            bump_version_on_commit(CATALOG_VERSION)
+
+
+@receiver(post_save, sender=Category)
+def category_changed_receiver(sender, instance: Category, created: bool, **kwargs):
+    """
+    Инвалидация фрагментов предложений после переименования категории.
+    Повторное сохранение без изменений (update_or_create при каждом импорте) ничего не инвалидирует.
+    """
+    if not created and 'name' in instance.changed_fields():
+        schedule_offer_touch(product__category_id=instance.id)
+
+
+@receiver(post_save, sender=Parameter)
+def parameter_changed_receiver(sender, instance: Parameter, created: bool, **kwargs):
+    """
+    Инвалидация фрагментов предложений и новая версия каталога (фильтр по параметру) после переименования параметра.
+    """
+    if not created and 'name' in instance.changed_fields():
+        schedule_offer_touch(product_parameters__parameter_id=instance.id)
+        bump_version_on_commit(CATALOG_VERSION)
+
+
+REFERENCE_NAMESPACES = {
+    Shop: SHOPS_VERSION,
+    Category: CATEGORIES_VERSION,
+    Parameter: PARAMETERS_VERSION,
+}
+
+
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Shop)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Parameter)
+@receiver(post_delete, sender=Parameter)
+def reference_data_changed_receiver(sender, instance, signal, created: bool = False, **kwargs):
+    """
+    Инвалидация справочного кэша после изменения или удаления записи.
+    Новые записи закэшированные данные не портят, поэтому на создание не реагируем;
+    повторное сохранение без изменений (update_or_create при импорте) кэш тоже не сбрасывает.
+    """
+    if created or (signal is post_save and not instance.changed_fields()):
+        return
+    invalidate_reference_cache(REFERENCE_NAMESPACES[sender])
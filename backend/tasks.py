@@ -1,23 +1,48 @@
 from __future__ import annotations
 
-from celery import shared_task
+from celery import chord, shared_task
+from celery.utils.time import get_exponential_backoff_interval
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
 
 
-@shared_task(name="backend.send_email")
-def send_email(to_email: str, subject: str, message: str) -> None:
+def _send_with_retry(task, messages: list[dict], batch: bool = True) -> int:
+    """
+    Отправка писем через общее SMTP-соединение воркера. Неотправленные письма ставятся на повтор:
+    при превышении лимита провайдера - когда лимит освободится (без ограничения числа повторов),
+    при ошибке SMTP - с экспоненциальной задержкой, не больше EMAIL_MAX_RETRIES раз.
+    Повтор пачки (batch) получает только неотправленные письма.
+    """
+    from backend.services.mailer import EmailDeferred, send_email_messages
+
+    try:
+        return send_email_messages(messages)
+    except EmailDeferred as deferred:
+        options = {'args': [messages[deferred.sent:]], 'kwargs': {}} if batch else {}
+        if deferred.countdown is not None:
+            raise task.retry(countdown=deferred.countdown, max_retries=None, **options)
+        countdown = get_exponential_backoff_interval(settings.EMAIL_RETRY_BACKOFF, task.request.retries,
+                                                     settings.EMAIL_RETRY_BACKOFF_MAX, full_jitter=True)
+        raise task.retry(countdown=countdown, max_retries=settings.EMAIL_MAX_RETRIES, exc=deferred.__cause__,
+                         **options)
+
+
+@shared_task(bind=True, name="backend.send_email")
+def send_email(self, to_email: str, subject: str, message: str) -> None:
     """
     Отправка электронного письма.
     Через Celery.
     """
-    msg = EmailMultiAlternatives(
-        subject,
-        message,
-        getattr(settings, "DEFAULT_FROM_EMAIL", None),
-        [to_email],
-    )
-    msg.send()
+    _send_with_retry(self, [{"to_email": to_email, "subject": subject, "message": message}], batch=False)
+
+
+@shared_task(bind=True, name="backend.send_email_batch")
+def send_email_batch(self, messages: list[dict]) -> int:
+    """
+    Отправка пачки писем через одно SMTP-соединение.
+    messages - список словарей с ключами to_email, subject, message.
+    Через Celery.
+    """
+    return _send_with_retry(self, messages)
 
 
 @shared_task(name="backend.do_import")
@@ -28,3 +53,78 @@ def do_import(file_path: str | None = None) -> dict:
     """
     from backend.services.importer import import_data_from_yaml
     return import_data_from_yaml(file_path)
+
+
+@shared_task(name="backend.archive_orders")
+def archive_orders() -> int:
+    """
+    Перенос завершённых заказов старше ORDER_ARCHIVE_AFTER_DAYS в архив.
+    Через Celery beat.
+    """
+    from backend.services.archive import archive_orders as archive
+    return archive()
+
+
+@shared_task(name="backend.collect_abandoned_baskets")
+def collect_abandoned_baskets() -> dict:
+    """
+    Удаление заброшенных корзин.
+    Через Celery beat.
+    """
+    from backend.services.basket import collect_abandoned_baskets as collect
+    return collect()
+
+
+@shared_task(name="backend.purge_expired_tokens")
+def purge_expired_tokens() -> dict:
+    """
+    Удаление просроченных токенов.
+    Через Celery beat.
+    """
+    from backend.services.tokens import purge_expired_tokens as purge
+    return purge()
+
+
+@shared_task(bind=True, name="backend.import_users")
+def import_users(self, path: str) -> dict:
+    """
+    Массовое создание пользователей из CSV, загруженного через admin/users/import.
+    Пароли хешируются параллельно задачами hash_users_upload по USER_IMPORT_HASH_CHUNK_SIZE строк,
+    пользователи создаются задачей create_users_from_upload; она наследует ID этой задачи,
+    поэтому состояние и результат доступны по исходному task_id. Через Celery.
+    """
+    from backend.services.users import plan_users_upload
+
+    chunks, errors = plan_users_upload(path)
+    if not chunks:
+        return {'created': 0, 'errors': errors}
+    workflow = chord([hash_users_upload.s(path, indices) for indices in chunks],
+                     create_users_from_upload.s(path).on_error(discard_users_upload.si(path)))
+    return self.replace(workflow)
+
+
+@shared_task(name="backend.hash_users_upload")
+def hash_users_upload(path: str, indices: list[int]) -> dict[str, str]:
+    """
+    Хеширование паролей части строк загруженного CSV.
+    """
+    from backend.services.users import hash_users_upload as hash_upload
+    return hash_upload(path, indices)
+
+
+@shared_task(name="backend.create_users_from_upload")
+def create_users_from_upload(hash_chunks: list[dict[str, str]], path: str) -> dict:
+    """
+    Создание пользователей из загруженного CSV по готовым хешам паролей.
+    """
+    from backend.services.users import create_users_from_upload as create_from_upload
+    return create_from_upload(path, hash_chunks)
+
+
+@shared_task(name="backend.discard_users_upload")
+def discard_users_upload(path: str) -> None:
+    """
+    Удаление загруженного CSV, если создание пользователей не удалось.
+    """
+    from backend.services.users import discard_users_upload as discard
+    discard(path)
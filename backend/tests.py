@@ -4,14 +4,52 @@ import django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'orders.settings')
 django.setup()
 
+import asyncio
+import csv
+import datetime
+import gzip
+import io
+import json
+import logging
+import smtplib
+import tempfile
+import threading
+import time
+from unittest import skipUnless
 from unittest.mock import patch
-from django.test import TestCase
-from django.test.utils import override_settings
+from asgiref.sync import sync_to_async
+from celery.exceptions import Retry
+from django.contrib.auth.hashers import make_password
+from django.core import mail
+from django.core.mail import get_connection
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection, transaction
+from django.http import QueryDict
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings, CaptureQueriesContext
+from django.utils import timezone
 from rest_framework.test import APIClient
 from rest_framework.authtoken.models import Token
+from django_rest_passwordreset.models import ResetPasswordToken
+from backend.authentication import CachedTokenAuthentication, _token_cache_key
 from backend.models import (User, Shop, Category, Product,
                             ProductInfo, Parameter, ProductParameter,
-                            Order, OrderItem, Contact)
+                            Order, ShopOrder, OrderItem, Contact, ProductBestOffer, ArchivedOrder,
+                            ConfirmEmailToken)
+from backend.services.catalog_engine import np, ColumnarCatalog, parse_catalog_filters, orm_catalog_page
+from backend.checks import catalog_engine_check
+from backend.services import catalog_engine, fragments, locks, mailer, refcache
+from backend.services.exporter import OFFER_EXPORT_FIELDS
+from backend.services.importer import import_data_from_yaml
+from backend.services.orders import OrderError, checkout_basket, change_order_status, recalculate_order_totals
+from backend.services.versioning import CATALOG_VERSION, STOCK_VERSION, bump_version, get_version
+from backend.tasks import send_email_batch, archive_orders as archive_orders_task, \
+    import_users as import_users_task
+
+
+logger = logging.getLogger(__name__)
 
 
 @override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
@@ -250,6 +288,39 @@ class BasketTests(TestCase):
         basket = Order.objects.get(user=self.user, status='basket')
         self.assertEqual(OrderItem.objects.filter(order=basket).count(), 1)
 
+    def test_add_items_merges_existing_lines(self):
+        """
+        Тест: повторное добавление увеличивает количество в существующей строке корзины
+        """
+        payload = [{"product_info": self.pinfo.id, "quantity": 2}, {"product_info": self.pinfo.id, "quantity": 1}]
+        self.api_client.post('/api/v1/basket', {'items': json_dumps(payload)}, format='json')
+        resp = self.api_client.post('/api/v1/basket',
+                                    {'items': json_dumps([{"product_info": self.pinfo.id, "quantity": 4}])},
+                                    format='json')
+        self.assertTrue(resp.json().get('Status'))
+        item = OrderItem.objects.get(order__user=self.user, order__status='basket')
+        self.assertEqual(item.quantity, 7)
+
+    def test_add_items_is_atomic_on_validation_errors(self):
+        """
+        Тест: при нехватке товара или неактивном магазине корзина не меняется
+        """
+        closed_shop = Shop.objects.create(name='Closed Shop', state=False)
+        closed_info = ProductInfo.objects.create(product=self.product, external_id=3, price=10, price_rrc=10,
+                                                 quantity=10, shop=closed_shop)
+        payload = [{"product_info": self.pinfo.id, "quantity": 11},
+                   {"product_info": closed_info.id, "quantity": 1},
+                   {"product_info": 999999, "quantity": 1}]
+        with CaptureQueriesContext(connection) as context:
+            resp = self.api_client.post('/api/v1/basket', {'items': json_dumps(payload)}, format='json')
+        # Все позиции проверяются одним запросом
+        self.assertEqual(len([query for query in context.captured_queries
+                              if 'FROM "backend_productinfo"' in query['sql']]), 1)
+        errors = resp.json()['Errors']
+        self.assertFalse(resp.json()['Status'])
+        self.assertEqual(set(errors), {str(self.pinfo.id), str(closed_info.id), '999999'})
+        self.assertFalse(OrderItem.objects.filter(order__user=self.user).exists())
+
     def test_update_item_quantity_in_basket(self):
         """
         Тест обновления количества товара в корзине
@@ -270,6 +341,32 @@ class BasketTests(TestCase):
         item.refresh_from_db()
         self.assertEqual(item.quantity, 5)
 
+    def test_bulk_update_basket_in_one_statement(self):
+        """
+        Тест: количества меняются одним UPDATE, нулевое количество удаляет позицию,
+        чужие позиции не затрагиваются
+        """
+        basket = Order.objects.create(user=self.user, status='basket')
+        pinfo2 = ProductInfo.objects.create(product=self.product, external_id=2, price=500, price_rrc=600,
+                                            quantity=10, shop=self.shop)
+        item1 = OrderItem.objects.create(order=basket, product_info=self.pinfo, quantity=1)
+        item2 = OrderItem.objects.create(order=basket, product_info=pinfo2, quantity=1)
+        foreign_basket = Order.objects.create(user=self.shop_user, status='basket')
+        foreign_item = OrderItem.objects.create(order=foreign_basket, product_info=self.pinfo, quantity=1)
+
+        payload = [{"id": item1.id, "quantity": 3}, {"id": item2.id, "quantity": 0},
+                   {"id": foreign_item.id, "quantity": 9}]
+        with CaptureQueriesContext(connection) as context:
+            resp = self.api_client.put('/api/v1/basket', {'items': json_dumps(payload)}, format='json')
+        self.assertEqual(len([query for query in context.captured_queries
+                              if query['sql'].startswith('UPDATE "backend_orderitem"')]), 1)
+        self.assertEqual((resp.json()['Updated'], resp.json()['Removed']), (1, 1))
+        item1.refresh_from_db()
+        foreign_item.refresh_from_db()
+        self.assertEqual(item1.quantity, 3)
+        self.assertEqual(foreign_item.quantity, 1)
+        self.assertFalse(OrderItem.objects.filter(id=item2.id).exists())
+
     def test_delete_items_from_basket(self):
         """
         Тест удаления товаров из корзины
@@ -418,6 +515,1441 @@ class OrdersFlowTests(TestCase):
         mock_signal.send.assert_called()
 
 
+class CatalogExportTests(TestCase):
+    """
+    Тесты потоковой выгрузки каталога
+    """
+    def setUp(self):
+        """
+        Подготовка тестовых данных
+        """
+        self.api_client = APIClient()
+        self.category = Category.objects.create(name='Phones')
+        self.shop = Shop.objects.create(name='Export Shop', state=True)
+        self.closed_shop = Shop.objects.create(name='Closed Shop', state=False)
+        self.product = Product.objects.create(name='iPhone', category=self.category)
+        self.pinfo = ProductInfo.objects.create(product=self.product, shop=self.shop, external_id=1,
+                                                model='14', price=1000, price_rrc=1200, quantity=10)
+        ProductInfo.objects.create(product=self.product, shop=self.closed_shop, external_id=2,
+                                   model='14', price=900, price_rrc=1200, quantity=3)
+        ProductParameter.objects.create(product_info=self.pinfo,
+                                        parameter=Parameter.objects.create(name='color'),
+                                        value='black')
+
+    def test_export_ndjson_streams_active_offers(self):
+        """
+        Тест выгрузки в NDJSON: только активные магазины, параметры вложены в строку
+        """
+        resp = self.api_client.get('/api/v1/products/export')
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.streaming)
+        lines = b''.join(resp.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 1)
+        row = json.loads(lines[0])
+        self.assertEqual(row['id'], self.pinfo.id)
+        self.assertEqual(row['parameters'], {'color': 'black'})
+
+    def test_export_csv_gzip_with_updated_since(self):
+        """
+        Тест выгрузки в CSV со сжатием и фильтром по дате обновления
+        """
+        resp = self.api_client.get('/api/v1/products/export',
+                                   {'output': 'csv', 'gzip': 'true', 'updated_since': '2000-01-01T00:00:00Z'})
+        self.assertEqual(resp['Content-Type'], 'application/gzip')
+        content = gzip.decompress(b''.join(resp.streaming_content)).decode('utf-8')
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual([int(row['id']) for row in rows], [self.pinfo.id])
+
+        resp = self.api_client.get('/api/v1/products/export',
+                                   {'output': 'csv', 'updated_since': '2999-01-01T00:00:00Z'})
+        content = b''.join(resp.streaming_content).decode('utf-8')
+        self.assertEqual(content.splitlines(), [','.join(OFFER_EXPORT_FIELDS)])
+
+    def test_export_rejects_bad_ids_before_streaming(self):
+        """
+        Тест: некорректный shop_id отклоняется обычным ответом, а не обрывом потока
+        """
+        resp = self.api_client.get('/api/v1/products/export', {'shop_id': 'abc'})
+        self.assertFalse(resp.streaming)
+        self.assertEqual(resp.json(), {'Status': False, 'Errors': 'Некорректное значение shop_id'})
+
+
+class BestOfferTests(TestCase):
+    """
+    Тесты таблицы лучших предложений по товарам
+    """
+    def setUp(self):
+        """
+        Подготовка тестовых данных: один товар в двух магазинах
+        """
+        self.api_client = APIClient()
+        self.category = Category.objects.create(name='Phones')
+        self.shop_user = User.objects.create_user(email='best@example.com', username='best',
+                                                  password='Str0ngP@ssw0rd!', type='shop', is_active=True)
+        self.cheap_shop = Shop.objects.create(name='Cheap Shop', state=True, user=self.shop_user)
+        self.other_shop = Shop.objects.create(name='Other Shop', state=True)
+        self.product = Product.objects.create(name='iPhone', category=self.category)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cheap = ProductInfo.objects.create(product=self.product, shop=self.cheap_shop, external_id=1,
+                                                    price=900, price_rrc=1200, quantity=2)
+            ProductInfo.objects.create(product=self.product, shop=self.other_shop, external_id=2,
+                                       price=1000, price_rrc=1200, quantity=5)
+
+    def test_best_offer_aggregates_across_shops(self):
+        """
+        Тест: минимальная цена, суммарное количество и число предложений по товару
+        """
+        best = ProductBestOffer.objects.get(product=self.product)
+        self.assertEqual(best.price, 900)
+        self.assertEqual(best.shop_id, self.cheap_shop.id)
+        self.assertEqual(best.total_quantity, 7)
+        self.assertEqual(best.offer_count, 2)
+
+        resp = self.api_client.get('/api/v1/products/compare', {'ids': str(self.product.id)})
+        self.assertEqual(resp.json()['Products'][0]['price'], '900.00')
+
+    def test_best_offer_follows_shop_state_and_stock(self):
+        """
+        Тест: отключение магазина и нулевой остаток исключают предложение
+        """
+        self.api_client.force_authenticate(self.shop_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.api_client.post('/api/v1/partner/state', {'state': 'off'}, format='json')
+        best = ProductBestOffer.objects.get(product=self.product)
+        self.assertEqual(best.shop_id, self.other_shop.id)
+        self.assertEqual(best.offer_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductInfo.objects.filter(shop=self.other_shop).get().delete()
+        self.assertFalse(ProductBestOffer.objects.filter(product=self.product).exists())
+        self.assertEqual(self.api_client.get('/api/v1/products').json()['Products'], [])
+
+
+class CatalogEngineTests(TestCase):
+    """
+    Тесты фильтрации и сортировки каталога через ORM и колоночный движок
+    """
+    def setUp(self):
+        """
+        Подготовка тестовых данных: предложения с разными ценами и диагональю
+        """
+        self.api_client = APIClient()
+        category = Category.objects.create(name='TV')
+        shop = Shop.objects.create(name='TV Shop', state=True)
+        Shop.objects.create(name='Closed', state=False)
+        diagonal = Parameter.objects.create(name='Диагональ')
+        self.infos = []
+        for external_id, (price, size) in enumerate([(300, '55'), (100, '32'), (200, '43'), (200, 'нет')]):
+            product = Product.objects.create(name=f'TV {external_id}', category=category)
+            info = ProductInfo.objects.create(product=product, shop=shop, external_id=external_id,
+                                              price=price, price_rrc=price, quantity=external_id + 1)
+            ProductParameter.objects.create(product_info=info, parameter=diagonal, value=size)
+            self.infos.append(info)
+        # Снимок каталога из другого теста не используется
+        engine_patcher = patch.object(catalog_engine, '_engine', None)
+        engine_patcher.start()
+        self.addCleanup(engine_patcher.stop)
+
+    def test_product_info_view_filters_sorts_and_paginates(self):
+        """
+        Тест фильтров по цене, сортировки и постраничного вывода через ORM
+        """
+        resp = self.api_client.get('/api/v1/products/info',
+                                   {'ordering': '-price', 'price_min': 150, 'limit': 2})
+        data = resp.json()
+        self.assertEqual(data['Count'], 3)
+        self.assertEqual([item['id'] for item in data['ProductInfos']], [self.infos[0].id, self.infos[2].id])
+
+    def test_orm_parameter_filter_skips_non_numeric_values(self):
+        """
+        Тест: числовой фильтр по параметру выполняется в БД и не учитывает нечисловые значения
+        """
+        ProductParameter.objects.filter(product_info=self.infos[2]).update(value='43,5')
+        count, ids = orm_catalog_page(parse_catalog_filters(QueryDict('param=Диагональ::50')))
+        self.assertEqual((count, ids), (2, [self.infos[1].id, self.infos[2].id]))
+        count, ids = orm_catalog_page(parse_catalog_filters(QueryDict('param=Диагональ:-1:10')))
+        self.assertEqual((count, ids), (0, []))
+
+    @skipUnless(np is not None, 'NumPy не установлен')
+    def test_columnar_engine_matches_orm(self):
+        """
+        Тест: колоночный движок возвращает те же страницы, что и ORM
+        """
+        engine = ColumnarCatalog.load(version=0)
+        for query in ('', 'ordering=price', 'ordering=-price&limit=2', 'price_max=250&offset=1',
+                      'param=Диагональ:40:&ordering=quantity', 'param=Вес::10', 'ordering=-id'):
+            filters = parse_catalog_filters(QueryDict(query))
+            self.assertEqual(engine.page(filters), orm_catalog_page(filters), query)
+
+        with override_settings(CATALOG_ENGINE='columnar'):
+            resp = self.api_client.get('/api/v1/products/info', {'ordering': 'price', 'limit': 1})
+        self.assertEqual(resp.json()['ProductInfos'][0]['id'], self.infos[1].id)
+
+    @skipUnless(np is not None, 'NumPy не установлен')
+    def test_stock_change_reloads_only_quantities_in_background(self):
+        """
+        Тест: смена остатков не перезагружает снимок в запросе, фоновое обновление перечитывает только quantity
+        """
+        engine = catalog_engine.reload_catalog_engine()
+        ProductInfo.objects.filter(id=self.infos[0].id).update(quantity=100)
+        bump_version(STOCK_VERSION)
+        with patch.object(catalog_engine, '_start_reload') as start_reload:
+            self.assertIs(catalog_engine.get_catalog_engine(), engine)
+            start_reload.assert_not_called()
+            self.assertIs(catalog_engine.get_catalog_engine(quantity=True), engine)
+            start_reload.assert_called_once()
+
+        with self.assertNumQueries(1):
+            reloaded = catalog_engine.reload_catalog_engine()
+        self.assertIs(reloaded.ids, engine.ids)
+        _, ids = reloaded.page(parse_catalog_filters(QueryDict('ordering=-quantity&limit=1')))
+        self.assertEqual(ids, [self.infos[0].id])
+
+    def test_category_and_parameter_changes_bump_catalog_version(self):
+        """
+        Тест: смена категории товара и переименование параметра дают новую версию каталога,
+        повторное сохранение без изменений - нет
+        """
+        product = Product.objects.get(id=self.infos[0].product_id)
+        parameter = Parameter.objects.get(name='Диагональ')
+        version = get_version(CATALOG_VERSION)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+            parameter.save()
+        self.assertEqual(get_version(CATALOG_VERSION), version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.category = Category.objects.create(name='Monitors')
+            product.save()
+        self.assertGreater(get_version(CATALOG_VERSION), version)
+        version = get_version(CATALOG_VERSION)
+        with self.captureOnCommitCallbacks(execute=True):
+            parameter.name = 'Экран'
+            parameter.save()
+        self.assertGreater(get_version(CATALOG_VERSION), version)
+
+    def test_columnar_engine_requires_numpy(self):
+        """
+        Тест: CATALOG_ENGINE = 'columnar' без NumPy - ошибка проверки, а не тихий переход на ORM
+        """
+        with override_settings(CATALOG_ENGINE='columnar'), patch.object(catalog_engine, 'np', None):
+            errors = catalog_engine_check(None)
+        self.assertEqual([error.id for error in errors], ['backend.E001'])
+
+
+class OfferFragmentCacheTests(TestCase):
+    """
+    Тесты кэша сериализованных предложений
+    """
+    def setUp(self):
+        """
+        Подготовка тестовых данных
+        """
+        cache.clear()
+        refcache.parameters_by_name.clear()
+        self.addCleanup(refcache.parameters_by_name.clear)
+        self.api_client = APIClient()
+        # Изменения подготовки применяются сразу, чтобы не попасть в пачку изменений теста
+        with self.captureOnCommitCallbacks(execute=True):
+            category = Category.objects.create(name='Phones')
+            shop = Shop.objects.create(name='Fragment Shop', state=True)
+            product = Product.objects.create(name='iPhone', category=category)
+            self.pinfo = ProductInfo.objects.create(product=product, shop=shop, external_id=1,
+                                                    price=1000, price_rrc=1200, quantity=10)
+            self.parameter = ProductParameter.objects.create(product_info=self.pinfo,
+                                                             parameter=Parameter.objects.create(name='color'),
+                                                             value='black')
+        self.pinfo.refresh_from_db()
+
+    def test_cached_fragments_skip_serialization_queries(self):
+        """
+        Тест: повторный запрос собирается из кэша без загрузки связанных объектов
+        """
+        first = self.api_client.get('/api/v1/products/info').json()
+        # count + страница ID + версии строк, без select_related/prefetch
+        with self.assertNumQueries(3):
+            second = self.api_client.get('/api/v1/products/info').json()
+        self.assertEqual(first, second)
+
+    def test_parameter_change_invalidates_fragment(self):
+        """
+        Тест: изменение параметра предложения приводит к повторной сериализации
+        """
+        self.api_client.get('/api/v1/products/info')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.parameter.value = 'white'
+            self.parameter.save()
+        data = self.api_client.get('/api/v1/products/info').json()
+        self.assertEqual(data['ProductInfos'][0]['product_parameters'][0]['value'], 'white')
+
+    def test_many_touches_applied_by_one_callback(self):
+        """
+        Тест: тысячи изменений одной транзакции применяются одним обработчиком on_commit пачками UPDATE
+        """
+        updated_at = self.pinfo.updated_at
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                for product_info_id in range(self.pinfo.id, self.pinfo.id + 1500):
+                    fragments.schedule_offer_touch(id=product_info_id)
+                    fragments.schedule_offer_touch(id=product_info_id)
+        self.assertEqual(len(callbacks), 1)
+        self.pinfo.refresh_from_db()
+        self.assertGreater(self.pinfo.updated_at, updated_at)
+
+    def test_price_upload_does_not_touch_other_shops(self):
+        """
+        Тест: загрузка прайса с той же категорией не меняет версию предложений других магазинов,
+        переименование категории - меняет
+        """
+        partner = User.objects.create_user(email='fragment-shop@example.com', username='fragment-shop',
+                                           type='shop', is_active=True)
+        category = self.pinfo.product.category
+        price_list = (f'shop: Partner Shop\ncategories:\n  - id: {category.id}\n    name: Phones\n'
+                      f'goods:\n  - id: 1\n    category: {category.id}\n    model: x\n'
+                      f'    name: Pixel\n    price: 900\n    price_rrc: 950\n    quantity: 3\n'
+                      f'    parameters:\n      color: white\n')
+        partner_client = APIClient()
+        partner_client.force_authenticate(partner)
+        updated_at = self.pinfo.updated_at
+        with patch('backend.views.get') as get_mock, self.captureOnCommitCallbacks(execute=True):
+            get_mock.return_value.content = price_list.encode('utf-8')
+            data = partner_client.post('/api/v1/partner/update', {'url': 'https://example.com/price.yaml'}).json()
+        self.assertTrue(data['Status'])
+        self.pinfo.refresh_from_db()
+        self.assertEqual(self.pinfo.updated_at, updated_at)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            category.name = 'Smartphones'
+            category.save()
+        self.pinfo.refresh_from_db()
+        self.assertGreater(self.pinfo.updated_at, updated_at)
+
+
+class ReferenceCacheTests(TestCase):
+    """
+    Тесты справочного кэша магазинов, категорий и параметров
+    """
+    def setUp(self):
+        """
+        Подготовка тестовых данных
+        """
+        cache.clear()
+        for reference_cache in (refcache.shops, refcache.categories, refcache.parameters_by_name):
+            reference_cache.clear()
+            # Записи теста откатываются вместе с ним и не должны остаться в кэше для следующих тестов
+            self.addCleanup(reference_cache.clear)
+        self.api_client = APIClient()
+        self.shop = Shop.objects.create(name='Cached Shop', state=True)
+
+    def test_shop_detail_served_from_cache(self):
+        """
+        Тест: повторный запрос магазина не обращается к БД, изменение магазина инвалидирует кэш
+        """
+        # Прочитанная запись попадает в кэш после фиксации транзакции
+        with self.captureOnCommitCallbacks(execute=True):
+            self.api_client.get(f'/api/v1/shops/{self.shop.id}')
+        with self.assertNumQueries(0):
+            resp = self.api_client.get(f'/api/v1/shops/{self.shop.id}')
+        self.assertEqual(resp.json()['Shop']['name'], 'Cached Shop')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shop.name = 'Renamed Shop'
+            self.shop.save()
+        resp = self.api_client.get(f'/api/v1/shops/{self.shop.id}')
+        self.assertEqual(resp.json()['Shop']['name'], 'Renamed Shop')
+
+    def test_repeated_import_skips_category_and_parameter_lookups(self):
+        """
+        Тест: в первом импорте каждая категория читается для товаров один раз, в следующих
+        (после фиксации предыдущих) категории и параметры берутся из кэша
+        """
+        def import_selects():
+            with CaptureQueriesContext(connection) as context, self.captureOnCommitCallbacks(execute=True):
+                import_data_from_yaml()
+            return [query['sql'] for query in context.captured_queries if query['sql'].startswith('SELECT')]
+
+        def category_selects(selects):
+            return [sql for sql in selects if 'FROM "backend_category" WHERE' in sql]
+
+        first = import_selects()
+        # update_or_create каждой категории и по одному чтению категории для товаров
+        self.assertEqual(len(category_selects(first)), 2 * Category.objects.count())
+        import_selects()
+        third = import_selects()
+        # Категории читаются только их собственным update_or_create, а не для каждого товара
+        self.assertEqual(len(category_selects(third)), Category.objects.count())
+        self.assertEqual([sql for sql in third if 'FROM "backend_parameter"' in sql], [])
+
+    def test_rolled_back_parameter_not_cached(self):
+        """
+        Тест: параметр, созданный в откатившейся транзакции, не остаётся в кэше
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                refcache.get_or_create_parameter('Откат')
+                raise RuntimeError
+        self.assertFalse(Parameter.objects.filter(name='Откат').exists())
+        parameter, created = refcache.get_or_create_parameter('Откат')
+        self.assertTrue(created)
+        self.assertTrue(Parameter.objects.filter(id=parameter.id).exists())
+
+
+def create_checkout_fixture(stock, buyers):
+    """
+    Магазин с одним товаром и покупатели, у каждого в корзине одна единица этого товара
+    """
+    category = Category.objects.create(name='Stock')
+    shop = Shop.objects.create(name='Stock Shop', state=True)
+    product = Product.objects.create(name='Scarce item', category=category)
+    pinfo = ProductInfo.objects.create(product=product, shop=shop, external_id=1,
+                                       price=100, price_rrc=100, quantity=stock)
+    customers = []
+    for number in range(buyers):
+        user = User.objects.create_user(email=f'stock{number}@example.com', username=f'stock{number}',
+                                        is_active=True)
+        contact = Contact.objects.create(user=user, city='City', street='Street', house='1', phone='123')
+        basket = Order.objects.create(user=user, status='basket')
+        OrderItem.objects.create(order=basket, product_info=pinfo, quantity=1)
+        customers.append((user, contact))
+    return pinfo, customers
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class StockReservationTests(TestCase):
+    """
+    Тесты резервирования товара при оформлении и отмене заказа
+    """
+    def setUp(self):
+        """
+        Подготовка тестовых данных: на складе одна единица товара, два покупателя
+        """
+        self.pinfo, self.customers = create_checkout_fixture(stock=1, buyers=2)
+
+    def test_checkout_reserves_stock_and_rejects_oversell(self):
+        """
+        Тест: первый заказ списывает остаток, второй отклоняется без изменений корзины
+        """
+        (first, first_contact), (second, second_contact) = self.customers
+        checkout_basket(first.id, first_contact.id)
+        self.pinfo.refresh_from_db()
+        self.assertEqual(self.pinfo.quantity, 0)
+
+        with self.assertRaises(OrderError):
+            checkout_basket(second.id, second_contact.id)
+        self.assertTrue(Order.objects.filter(user=second, status='basket').exists())
+
+    def test_admin_cancel_returns_stock(self):
+        """
+        Тест: отмена заказа через admin API возвращает товар на склад
+        """
+        user, contact = self.customers[0]
+        order = checkout_basket(user.id, contact.id)
+        admin = User.objects.create_superuser(email='admin@example.com', password='Str0ngP@ssw0rd!',
+                                              username='admin')
+        client = APIClient()
+        client.force_authenticate(admin)
+        resp = client.patch(f'/api/v1/admin/orders/{order.id}', {'status': 'canceled'}, format='json')
+        self.assertEqual(resp.status_code, 200)
+        self.pinfo.refresh_from_db()
+        self.assertEqual(self.pinfo.quantity, 1)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class CheckoutStressTests(TransactionTestCase):
+    """
+    Нагрузочный тест параллельного оформления заказов
+    """
+    stock = 5
+    buyers = 20
+
+    def test_concurrent_checkouts_do_not_oversell(self):
+        """
+        Тест: параллельные оформления заказов не продают больше, чем есть на складе
+        """
+        pinfo, customers = create_checkout_fixture(stock=self.stock, buyers=self.buyers)
+        outcomes = []
+        barrier = threading.Barrier(len(customers))
+
+        def worker(user, contact):
+            barrier.wait()
+            try:
+                checkout_basket(user.id, contact.id)
+                outcomes.append('ok')
+            except OrderError:
+                outcomes.append('rejected')
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=customer) for customer in customers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        pinfo.refresh_from_db()
+        self.assertEqual(outcomes.count('ok'), self.stock)
+        self.assertEqual(outcomes.count('rejected'), self.buyers - self.stock)
+        self.assertEqual(pinfo.quantity, 0)
+        self.assertEqual(Order.objects.filter(status='new').count(), self.stock)
+        logger.info('Оформление заказов: %.1f попыток/с', len(customers) / elapsed)
+
+
+class OrderTotalsTests(TestCase):
+    """
+    Тесты сохранённых итогов заказа
+    """
+    def setUp(self):
+        """
+        Подготовка тестовых данных
+        """
+        self.api_client = APIClient()
+        self.user = User.objects.create_user(email='totals@example.com', username='totals', is_active=True)
+        self.api_client.force_authenticate(self.user)
+        category = Category.objects.create(name='Phones')
+        shop = Shop.objects.create(name='Totals Shop', state=True)
+        product = Product.objects.create(name='iPhone', category=category)
+        self.pinfo = ProductInfo.objects.create(product=product, shop=shop, external_id=1,
+                                                price=100, price_rrc=120, quantity=10)
+        self.pinfo2 = ProductInfo.objects.create(product=product, shop=shop, external_id=2,
+                                                 price=50, price_rrc=60, quantity=10)
+
+    def test_basket_mutations_keep_totals(self):
+        """
+        Тест: добавление, изменение и удаление позиций обновляют итоги корзины
+        """
+        self.api_client.post('/api/v1/basket', {'items': json_dumps([
+            {'product_info': self.pinfo.id, 'quantity': 2}, {'product_info': self.pinfo2.id, 'quantity': 1}])},
+            format='json')
+        basket = Order.objects.get(user=self.user, status='basket')
+        self.assertEqual((basket.total_sum, basket.item_count), (250, 2))
+
+        item = basket.ordered_items.get(product_info=self.pinfo)
+        self.api_client.put('/api/v1/basket', {'items': json_dumps([{'id': item.id, 'quantity': 3}])},
+                            format='json')
+        basket.refresh_from_db()
+        self.assertEqual(basket.total_sum, 350)
+
+        self.api_client.delete('/api/v1/basket', {'items': str(item.id)}, format='json')
+        basket.refresh_from_db()
+        self.assertEqual((basket.total_sum, basket.item_count), (50, 1))
+        self.assertEqual(self.api_client.get('/api/v1/basket').json()[0]['total_sum'], '50.00')
+
+    def test_price_change_recalculates_baskets(self):
+        """
+        Тест: смена цены предложения пересчитывает итоги корзин с ним, проверка итогов расхождений не находит
+        """
+        self.api_client.post('/api/v1/basket', {'items': json_dumps([
+            {'product_info': self.pinfo.id, 'quantity': 2}])}, format='json')
+        admin = User.objects.create_superuser(email='totals-admin@example.com', username='totals-admin',
+                                              password='Str0ngP@ssw0rd!')
+        admin_client = APIClient()
+        admin_client.force_authenticate(admin)
+        response = admin_client.patch(f'/api/v1/admin/product-infos/{self.pinfo.id}', {'price': '150.00'},
+                                      format='json')
+        self.assertEqual(response.status_code, 200)
+        basket = self.api_client.get('/api/v1/basket').json()[0]
+        self.assertEqual(basket['total_sum'], '300.00')
+        call_command('check_order_totals', stdout=io.StringIO())
+
+    def test_check_and_backfill_commands(self):
+        """
+        Тест: проверка находит расхождения, пересчёт их устраняет
+        """
+        order = Order.objects.create(user=self.user, status='new')
+        OrderItem.objects.create(order=order, product_info=self.pinfo, quantity=2)
+        with self.assertRaises(CommandError):
+            call_command('check_order_totals', stdout=io.StringIO())
+        call_command('backfill_order_totals', stdout=io.StringIO())
+        order.refresh_from_db()
+        self.assertEqual((order.total_sum, order.item_count), (200, 1))
+        call_command('check_order_totals', stdout=io.StringIO())
+
+
+class OrderSnapshotTests(TestCase):
+    """
+    Тесты фиксации цен и товаров в позициях заказа
+    """
+    def setUp(self):
+        """
+        Подготовка тестовых данных
+        """
+        self.api_client = APIClient()
+        self.user = User.objects.create_user(email='snapshot@example.com', username='snapshot', is_active=True)
+        self.api_client.force_authenticate(self.user)
+        self.contact = Contact.objects.create(user=self.user, city='Moscow', street='Tverskaya', phone='+79990000000')
+        category = Category.objects.create(name='Phones')
+        self.shop = Shop.objects.create(name='Snapshot Shop', state=True)
+        product = Product.objects.create(name='iPhone', category=category)
+        self.pinfo = ProductInfo.objects.create(product=product, shop=self.shop, external_id=7,
+                                                price=100, price_rrc=120, quantity=10)
+        basket = Order.objects.create(user=self.user, status='basket')
+        OrderItem.objects.create(order=basket, product_info=self.pinfo, quantity=2)
+
+    def test_checkout_keeps_price(self):
+        """
+        Тест: изменение цены после оформления не меняет заказ
+        """
+        order = checkout_basket(self.user.id, self.contact.id)
+        item = order.ordered_items.get()
+        self.assertEqual((item.price, item.product_name, item.external_id, item.shop_id, item.shop_name),
+                         (100, 'iPhone', 7, self.shop.id, 'Snapshot Shop'))
+
+        ProductInfo.objects.filter(id=self.pinfo.id).update(price=500)
+        recalculate_order_totals(order.id)
+        order.refresh_from_db()
+        self.assertEqual(order.total_sum, 200)
+        data = self.api_client.get('/api/v1/orders').json()
+        self.assertEqual(data['results'][0]['ordered_items'][0]['price'], '100.00')
+
+    def test_deleted_offer_keeps_order_lines(self):
+        """
+        Тест: удаление предложения не удаляет позиции оформленного заказа
+        """
+        order = checkout_basket(self.user.id, self.contact.id)
+        self.pinfo.delete()
+        item = order.ordered_items.get()
+        self.assertIsNone(item.product_info_id)
+        self.assertEqual((item.price, item.product_name), (100, 'iPhone'))
+        order.status = 'canceled'
+        change_order_status(order, 'new')
+
+    def test_price_reupload_keeps_basket_lines(self):
+        """
+        Тест: повторная загрузка прайса обновляет предложения на месте, позиции корзины сохраняются,
+        позиции предложений, которых нет в прайсе, удаляются из корзины
+        """
+        partner = User.objects.create_user(email='snapshot-shop@example.com', username='snapshot-shop',
+                                           type='shop', is_active=True)
+        Shop.objects.filter(id=self.shop.id).update(user=partner)
+        ipad = Product.objects.create(name='iPad', category=self.pinfo.product.category)
+        removed = ProductInfo.objects.create(product=ipad, shop=self.shop, external_id=8,
+                                             price=50, price_rrc=50, quantity=5)
+        basket = Order.objects.get(user=self.user, status='basket')
+        OrderItem.objects.create(order=basket, product_info=removed, quantity=1)
+        price_list = (f'shop: Snapshot Shop\ncategories:\n  - id: {self.pinfo.product.category_id}\n    name: Phones\n'
+                      f'goods:\n  - id: 7\n    category: {self.pinfo.product.category_id}\n    model: x\n'
+                      f'    name: iPhone\n    price: 150\n    price_rrc: 160\n    quantity: 10\n'
+                      f'    parameters:\n      color: black\n')
+        partner_client = APIClient()
+        partner_client.force_authenticate(partner)
+        with patch('backend.views.get') as get_mock:
+            get_mock.return_value.content = price_list.encode('utf-8')
+            data = partner_client.post('/api/v1/partner/update', {'url': 'https://example.com/price.yaml'}).json()
+        self.assertTrue(data['Status'])
+
+        self.assertFalse(ProductInfo.objects.filter(id=removed.id).exists())
+        item = basket.ordered_items.get()
+        self.assertEqual(item.product_info_id, self.pinfo.id)
+        basket.refresh_from_db()
+        self.assertEqual(basket.total_sum, 300)
+
+    def test_checkout_drops_lines_of_removed_offers(self):
+        """
+        Тест: позиции без предложения удаляются при оформлении и показываются пользователю, а не блокируют заказ
+        """
+        basket = Order.objects.get(user=self.user, status='basket')
+        gone = ProductInfo.objects.create(product=self.pinfo.product, shop=self.shop, external_id=9,
+                                          price=10, price_rrc=10, quantity=5)
+        OrderItem.objects.create(order=basket, product_info=gone, quantity=1)
+        gone.delete()
+        data = self.api_client.post('/api/v1/orders', {'contact_id': str(self.contact.id)}).json()
+        self.assertTrue(data['Status'])
+        self.assertIn('удалено из корзины: 1', data['Message'])
+        self.assertEqual(Order.objects.get(id=basket.id).ordered_items.count(), 1)
+
+
+@override_settings(BASKET_BACKEND='cache')
+class CachedBasketTests(TestCase):
+    """
+    Тесты корзины в кэше
+    """
+    def setUp(self):
+        """
+        Подготовка тестовых данных
+        """
+        cache.clear()
+        self.api_client = APIClient()
+        self.user = User.objects.create_user(email='cached@example.com', username='cached', is_active=True)
+        self.api_client.force_authenticate(self.user)
+        self.contact = Contact.objects.create(user=self.user, city='Moscow', street='Tverskaya', phone='+79990000000')
+        category = Category.objects.create(name='Phones')
+        shop = Shop.objects.create(name='Cached Shop', state=True)
+        product = Product.objects.create(name='iPhone', category=category)
+        self.pinfo = ProductInfo.objects.create(product=product, shop=shop, external_id=1,
+                                                price=100, price_rrc=120, quantity=10)
+        self.pinfo2 = ProductInfo.objects.create(product=product, shop=shop, external_id=2,
+                                                 price=50, price_rrc=60, quantity=10)
+
+    def test_basket_lives_in_cache_until_checkout(self):
+        """
+        Тест: изменения корзины не пишут в БД, оформление переносит корзину в заказ
+        """
+        response = self.api_client.post('/api/v1/basket', {'items': json_dumps([
+            {'product_info': self.pinfo.id, 'quantity': 2}, {'product_info': self.pinfo2.id, 'quantity': 1}])},
+            format='json')
+        self.assertTrue(response.json()['Status'])
+        response = self.api_client.put('/api/v1/basket', {'items': json_dumps([
+            {'id': self.pinfo.id, 'quantity': 3}, {'id': self.pinfo2.id, 'quantity': 0}])}, format='json')
+        self.assertEqual((response.json()['Updated'], response.json()['Removed']), (1, 1))
+        self.assertFalse(Order.objects.exists())
+
+        basket = self.api_client.get('/api/v1/basket').json()[0]
+        self.assertEqual((basket['total_sum'], basket['item_count']), ('300.00', 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.api_client.post('/api/v1/orders', {'contact_id': str(self.contact.id)}, format='json')
+        self.assertTrue(response.json()['Status'])
+        order = Order.objects.get(user=self.user)
+        self.assertEqual((order.status, order.total_sum), ('new', 300))
+        self.assertEqual(self.api_client.get('/api/v1/basket').json(), [])
+
+    def test_invalid_addition_keeps_cached_basket(self):
+        """
+        Тест: при ошибке проверки корзина в кэше не меняется
+        """
+        self.api_client.post('/api/v1/basket', {'items': json_dumps([
+            {'product_info': self.pinfo.id, 'quantity': 2}])}, format='json')
+        response = self.api_client.post('/api/v1/basket', {'items': json_dumps([
+            {'product_info': self.pinfo.id, 'quantity': 9}])}, format='json')
+        self.assertFalse(response.json()['Status'])
+        self.assertEqual(self.api_client.get('/api/v1/basket').json()[0]['ordered_items'][0]['quantity'], 2)
+
+
+class OrderHistoryTests(TestCase):
+    """
+    Тесты постраничной истории заказов
+    """
+    def setUp(self):
+        """
+        Подготовка тестовых данных
+        """
+        self.api_client = APIClient()
+        self.user = User.objects.create_user(email='history@example.com', username='history', is_active=True)
+        self.api_client.force_authenticate(self.user)
+        Order.objects.create(user=self.user, status='basket')
+        for index in range(5):
+            order = Order.objects.create(user=self.user, status='delivered' if index % 2 else 'new')
+            Order.objects.filter(id=order.id).update(created_at=timezone.now() - datetime.timedelta(days=index))
+
+    def test_cursor_pagination(self):
+        """
+        Тест: страницы по курсору покрывают все заказы без повторов, корзина не попадает в историю
+        """
+        seen = []
+        url = '/api/v1/orders?limit=2'
+        while url:
+            with self.assertNumQueries(2):
+                data = self.api_client.get(url).json()
+            seen += [order['id'] for order in data['results']]
+            url = data['next']
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(seen, list(Order.objects.exclude(status='basket').order_by('-created_at').
+                                    values_list('id', flat=True)))
+
+    def test_filters(self):
+        """
+        Тест: фильтры по статусу и дате, ошибка при неизвестном статусе
+        """
+        data = self.api_client.get('/api/v1/orders?status=delivered').json()
+        self.assertEqual({order['status'] for order in data['results']}, {'delivered'})
+        self.assertEqual(len(data['results']), 2)
+
+        created_from = (timezone.now() - datetime.timedelta(days=1, hours=1)).isoformat()
+        data = self.api_client.get('/api/v1/orders', {'created_from': created_from}).json()
+        self.assertEqual(len(data['results']), 2)
+
+        self.assertFalse(self.api_client.get('/api/v1/orders?status=basket').json()['Status'])
+
+
+class ShopOrderTests(TestCase):
+    """
+    Тесты подзаказов магазинов
+    """
+    def setUp(self):
+        """
+        Подготовка тестовых данных
+        """
+        self.api_client = APIClient()
+        self.buyer = User.objects.create_user(email='split@example.com', username='split', is_active=True)
+        self.contact = Contact.objects.create(user=self.buyer, city='Moscow', street='Tverskaya', phone='+79990000000')
+        self.partner = User.objects.create_user(email='partner-split@example.com', username='partner-split',
+                                                is_active=True, type='shop')
+        category = Category.objects.create(name='Phones')
+        product = Product.objects.create(name='iPhone', category=category)
+        self.shop = Shop.objects.create(name='Own Shop', state=True, user=self.partner)
+        other_shop = Shop.objects.create(name='Other Shop', state=True)
+        basket = Order.objects.create(user=self.buyer, status='basket')
+        for shop, price, quantity in ((self.shop, 100, 2), (other_shop, 70, 1)):
+            info = ProductInfo.objects.create(product=product, shop=shop, external_id=1,
+                                              price=price, price_rrc=price, quantity=10)
+            OrderItem.objects.create(order=basket, product_info=info, quantity=quantity)
+
+    def test_checkout_splits_order_by_shop(self):
+        """
+        Тест: заказ разбивается на подзаказы со своими позициями и итогами, партнёр видит только свой
+        """
+        order = checkout_basket(self.buyer.id, self.contact.id)
+        self.assertEqual(sorted(order.shop_orders.values_list('total_sum', 'item_count', 'status')),
+                         [(70, 1, 'new'), (200, 1, 'new')])
+
+        self.api_client.force_authenticate(self.partner)
+        with self.assertNumQueries(2):
+            data = self.api_client.get('/api/v1/partner/orders').json()
+        self.assertEqual(len(data['results']), 1)
+        shop_order = data['results'][0]
+        self.assertEqual((shop_order['order'], shop_order['total_sum'], shop_order['contact']),
+                         (order.id, '200.00', self.contact.id))
+        self.assertEqual([item['shop_name'] for item in shop_order['ordered_items']], ['Own Shop'])
+
+        order.status = 'canceled'
+        order.save()
+        change_order_status(order, 'new')
+        self.assertEqual(set(order.shop_orders.values_list('status', flat=True)), {'canceled'})
+
+    def test_partner_export_streams_own_lines(self):
+        """
+        Тест: выгрузка партнёра - одна строка CSV на позицию своего магазина, с контактом и суммой
+        """
+        order = checkout_basket(self.buyer.id, self.contact.id)
+        self.api_client.force_authenticate(self.partner)
+        response = self.api_client.get('/api/v1/partner/orders/export?output=csv&status=new')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode('utf-8'))))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['order_id'], rows[0]['quantity'], rows[0]['price'], rows[0]['sum']),
+                         (str(order.id), '2', '100.00', '200.00'))
+        self.assertEqual((rows[0]['external_id'], rows[0]['phone']), ('1', '+79990000000'))
+
+        response = self.api_client.get('/api/v1/partner/orders/export?status=delivered')
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class OrderBulkStatusTests(TestCase):
+    """
+    Тесты массовой смены статуса заказов
+    """
+    def setUp(self):
+        """
+        Подготовка тестовых данных
+        """
+        self.pinfo, customers = create_checkout_fixture(stock=3, buyers=3)
+        self.orders = [checkout_basket(user.id, contact.id) for user, contact in customers]
+        admin = User.objects.create_superuser(email='bulk-admin@example.com', password='Str0ngP@ssw0rd!',
+                                              username='bulk-admin')
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(admin)
+
+    def test_bulk_transition_reports_per_order(self):
+        """
+        Тест: допустимые переходы применяются, недопустимые и несуществующие заказы отклоняются,
+        уведомления уходят одной пачкой
+        """
+        first, second, third = self.orders
+        Order.objects.filter(id__in=[first.id, second.id]).update(status='assembled')
+        with patch('backend.services.orders.send_email_batch') as send_batch, \
+                self.captureOnCommitCallbacks(execute=True):
+            data = self.api_client.post('/api/v1/admin/orders/status', {
+                'ids': [first.id, second.id, third.id, 999999], 'status': 'shipped'}, format='json').json()
+        self.assertEqual(data['Updated'], 2)
+        self.assertEqual(data['Results'][str(first.id)], 'ok')
+        self.assertIn('Недопустимый переход', data['Results'][str(third.id)])
+        self.assertEqual(data['Results']['999999'], 'Заказ не найден')
+        self.assertEqual(set(Order.objects.filter(id__in=[first.id, second.id]).values_list('status', flat=True)),
+                         {'shipped'})
+        self.assertEqual(set(ShopOrder.objects.filter(order_id=first.id).values_list('status', flat=True)),
+                         {'shipped'})
+        send_batch.delay.assert_called_once()
+        messages = send_batch.delay.call_args.args[0]
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(send_email_batch(messages), 2)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_bulk_cancel_and_restore_stock(self):
+        """
+        Тест: массовая отмена возвращает товар, восстановление без остатка отклоняется
+        """
+        ids = ','.join(str(order.id) for order in self.orders)
+        data = self.api_client.post('/api/v1/admin/orders/status', {'ids': ids, 'status': 'canceled'},
+                                    format='json').json()
+        self.assertEqual(data['Updated'], 3)
+        self.pinfo.refresh_from_db()
+        self.assertEqual(self.pinfo.quantity, 3)
+
+        ProductInfo.objects.filter(id=self.pinfo.id).update(quantity=2)
+        data = self.api_client.post('/api/v1/admin/orders/status', {'ids': ids, 'status': 'new'},
+                                    format='json').json()
+        self.assertEqual(data['Updated'], 2)
+        self.assertEqual(list(data['Results'].values()).count('Недостаточно товара на складе'), 1)
+        self.pinfo.refresh_from_db()
+        self.assertEqual(self.pinfo.quantity, 0)
+
+
+class IdempotencyTests(TestCase):
+    """
+    Тесты повторов запросов с Idempotency-Key
+    """
+    def setUp(self):
+        """
+        Подготовка тестовых данных
+        """
+        cache.clear()
+        self.pinfo, customers = create_checkout_fixture(stock=10, buyers=1)
+        self.user, self.contact = customers[0]
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(self.user)
+
+    def test_basket_replay_does_not_write_twice(self):
+        """
+        Тест: повтор добавления с тем же ключом возвращает первый ответ, другой запрос с ключом отклоняется
+        """
+        payload = {'items': json_dumps([{'product_info': self.pinfo.id, 'quantity': 2}])}
+        first = self.api_client.post('/api/v1/basket', payload, format='json', HTTP_IDEMPOTENCY_KEY='add-1')
+        replay = self.api_client.post('/api/v1/basket', payload, format='json', HTTP_IDEMPOTENCY_KEY='add-1')
+        self.assertEqual(first.json(), replay.json())
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(OrderItem.objects.get(order__user=self.user).quantity, 3)
+
+        other = {'items': json_dumps([{'product_info': self.pinfo.id, 'quantity': 5}])}
+        response = self.api_client.post('/api/v1/basket', other, format='json', HTTP_IDEMPOTENCY_KEY='add-1')
+        self.assertEqual(response.status_code, 422)
+
+    def test_expired_lock_not_released_by_previous_owner(self):
+        """
+        Тест: запрос, потерявший блокировку по истечении срока, не снимает блокировку следующего владельца
+        """
+        first = locks.acquire_lock('idempotency:test:lock', ttl=60)
+        self.assertIsNone(locks.acquire_lock('idempotency:test:lock', ttl=60))
+        # Срок блокировки первого запроса истёк, её занял повтор
+        cache.delete('idempotency:test:lock')
+        second = locks.acquire_lock('idempotency:test:lock', ttl=60)
+        locks.release_lock('idempotency:test:lock', first)
+        self.assertEqual(cache.get('idempotency:test:lock'), second)
+        locks.release_lock('idempotency:test:lock', second)
+        self.assertIsNone(cache.get('idempotency:test:lock'))
+
+    def test_checkout_replay_returns_first_result(self):
+        """
+        Тест: повтор оформления заказа не возвращает ошибку пустой корзины
+        """
+        payload = {'contact_id': str(self.contact.id)}
+        with patch('backend.views.new_order') as new_order:
+            first = self.api_client.post('/api/v1/orders', payload, format='json', HTTP_IDEMPOTENCY_KEY='checkout')
+            replay = self.api_client.post('/api/v1/orders', payload, format='json', HTTP_IDEMPOTENCY_KEY='checkout')
+        self.assertTrue(first.json()['Status'])
+        self.assertEqual(first.json(), replay.json())
+        new_order.send.assert_called_once()
+        self.assertEqual(Order.objects.filter(user=self.user).exclude(status='basket').count(), 1)
+
+
+class OrderArchiveTests(TestCase):
+    """
+    Тесты архивации завершённых заказов
+    """
+    def setUp(self):
+        """
+        Подготовка тестовых данных
+        """
+        self.pinfo, customers = create_checkout_fixture(stock=10, buyers=1)
+        self.user, contact = customers[0]
+        self.old = checkout_basket(self.user.id, contact.id)
+        Order.objects.filter(id=self.old.id).update(status='delivered',
+                                                    updated_at=timezone.now() - datetime.timedelta(days=400))
+        self.fresh = Order.objects.create(user=self.user, status='delivered')
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(self.user)
+
+    def test_archive_moves_old_terminal_orders(self):
+        """
+        Тест: старые завершённые заказы переносятся в архив вместе с позициями, свежие остаются
+        """
+        self.assertEqual(archive_orders_task(), 1)
+        self.assertFalse(Order.objects.filter(id=self.old.id).exists())
+        self.assertTrue(Order.objects.filter(id=self.fresh.id).exists())
+        archived = ArchivedOrder.objects.get(id=self.old.id)
+        self.assertEqual((archived.total_sum, archived.ordered_items.get().price), (100, 100))
+
+        hot = self.api_client.get('/api/v1/orders').json()['results']
+        self.assertEqual([order['id'] for order in hot], [self.fresh.id])
+        history = self.api_client.get('/api/v1/orders?archive=true').json()['results']
+        self.assertEqual([order['id'] for order in history], [self.old.id])
+        self.assertEqual(history[0]['ordered_items'][0]['product_name'], 'Scarce item')
+
+    def test_partner_sees_archived_shop_orders(self):
+        """
+        Тест: подзаказы магазина архивируются вместе с заказом и доступны партнёру с archive=true
+        """
+        partner = User.objects.create_user(email='archive-shop@example.com', username='archive-shop',
+                                           type='shop', is_active=True)
+        Shop.objects.filter(id=self.pinfo.shop_id).update(user=partner)
+        shop_order_id = ShopOrder.objects.get(order_id=self.old.id).id
+        archive_orders_task()
+
+        partner_client = APIClient()
+        partner_client.force_authenticate(partner)
+        self.assertEqual(partner_client.get('/api/v1/partner/orders').json()['results'], [])
+        history = partner_client.get('/api/v1/partner/orders', {'archive': 'true'}).json()['results']
+        self.assertEqual([(order['id'], order['order']) for order in history], [(shop_order_id, self.old.id)])
+        self.assertEqual(history[0]['ordered_items'][0]['product_name'], 'Scarce item')
+
+        resp = partner_client.get('/api/v1/partner/orders/export', {'archive': 'true'})
+        rows = [json.loads(line) for line in b''.join(resp.streaming_content).decode('utf-8').splitlines()]
+        self.assertEqual([(row['order_id'], row['shop_order_id']) for row in rows], [(self.old.id, shop_order_id)])
+
+
+class AbandonedBasketTests(TestCase):
+    """
+    Тесты удаления заброшенных корзин
+    """
+    def test_collects_stale_and_empty_baskets_in_batches(self):
+        """
+        Тест: старые и пустые корзины удаляются пачками, свежие корзины и заказы остаются
+        """
+        pinfo, customers = create_checkout_fixture(stock=10, buyers=4)
+        baskets = list(Order.objects.filter(status='basket').order_by('id'))
+        old = timezone.now() - datetime.timedelta(days=40)
+        Order.objects.filter(id__in=[baskets[0].id, baskets[1].id]).update(updated_at=old)
+        baskets[2].ordered_items.all().delete()
+        recalculate_order_totals(baskets[2].id)
+        Order.objects.filter(id=baskets[2].id).update(updated_at=timezone.now() - datetime.timedelta(hours=2))
+        placed = Order.objects.create(user=customers[0][0], status='delivered')
+        Order.objects.filter(id=placed.id).update(updated_at=old)
+
+        out = io.StringIO()
+        call_command('collect_baskets', '--batch-size', '1', stdout=out)
+        self.assertIn('Удалено корзин: 3, позиций: 2', out.getvalue())
+        self.assertEqual(list(Order.objects.filter(status='basket').values_list('id', flat=True)), [baskets[3].id])
+        self.assertTrue(Order.objects.filter(id=placed.id).exists())
+
+
+class OrderDocumentTests(TestCase):
+    """
+    Тесты документов оформленных заказов
+    """
+    def test_orders_are_read_from_document(self):
+        """
+        Тест: список заказов читается одним запросом, статус берётся из строки заказа
+        """
+        pinfo, customers = create_checkout_fixture(stock=10, buyers=3)
+        orders = [checkout_basket(user.id, contact.id) for user, contact in customers]
+        Order.objects.filter(id=orders[0].id).update(status='shipped')
+        Product.objects.filter(id=pinfo.product_id).update(name='Renamed')
+
+        admin = User.objects.create_superuser(email='doc-admin@example.com', password='Str0ngP@ssw0rd!',
+                                              username='doc-admin')
+        api_client = APIClient()
+        api_client.force_authenticate(admin)
+        with self.assertNumQueries(1):
+            data = api_client.get('/api/v1/admin/orders').json()
+        self.assertEqual(len(data), 3)
+        shipped = next(order for order in data if order['id'] == orders[0].id)
+        self.assertEqual(shipped['status'], 'shipped')
+        self.assertEqual(shipped['ordered_items'][0]['product_name'], 'Scarce item')
+        self.assertEqual(shipped['ordered_items'][0]['price'], '100.00')
+
+
+class OrderEventsTests(TestCase):
+    """
+    Тесты потока событий о смене статусов заказов
+    """
+    def setUp(self):
+        """
+        Подготовка тестовых данных
+        """
+        self.pinfo, customers = create_checkout_fixture(stock=10, buyers=1)
+        self.user, self.contact = customers[0]
+        self.token = Token.objects.create(user=self.user)
+
+    async def test_stream_delivers_status_change(self):
+        """
+        Тест: после оформления заказа подписчик получает событие со статусом
+        """
+        response = await self.async_client.get('/api/v1/orders/events',
+                                                headers={'Authorization': f'Token {self.token.key}'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertTrue((await anext(stream)).startswith(b'retry:'))
+        # Подписка оформляется при первом ожидании сообщения
+        pending = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0.05)
+
+        def checkout():
+            with self.captureOnCommitCallbacks(execute=True):
+                return checkout_basket(self.user.id, self.contact.id)
+        order = await sync_to_async(checkout)()
+
+        chunk = (await asyncio.wait_for(pending, timeout=5)).decode('utf-8')
+        self.assertTrue(chunk.startswith('event: order_status'))
+        event = json.loads(chunk.split('data: ', 1)[1])
+        self.assertEqual((event['order_id'], event['status']), (order.id, 'new'))
+        await response.streaming_content.aclose()
+
+    async def test_stream_requires_authentication(self):
+        """
+        Тест: без токена поток не открывается
+        """
+        response = await self.async_client.get('/api/v1/orders/events')
+        self.assertEqual(response.status_code, 403)
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    """
+    Тесты кэширования проверки токена
+    """
+    def setUp(self):
+        """
+        Подготовка тестовых данных
+        """
+        cache.clear()
+        self.user = User.objects.create_user(email='cached-token@example.com', username='cached-token',
+                                             password='Str0ngP@ssw0rd!', is_active=True)
+        self.token = Token.objects.create(user=self.user)
+        self.api_client = APIClient()
+        self.api_client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_token_lookup_is_cached(self):
+        """
+        Тест: повторный запрос с тем же токеном не обращается к таблице токенов
+        """
+        with CaptureQueriesContext(connection) as first:
+            self.assertEqual(self.api_client.get('/api/v1/user/details').status_code, 200)
+        with CaptureQueriesContext(connection) as second:
+            self.assertEqual(self.api_client.get('/api/v1/user/details').status_code, 200)
+        self.assertEqual(len(second), len(first) - 1)
+        self.assertFalse([query for query in second.captured_queries if 'authtoken_token' in query['sql']])
+
+    def test_cache_invalidated_on_deactivation_and_logout(self):
+        """
+        Тест: деактивация пользователя и выход сразу отзывают закэшированный токен
+        """
+        self.api_client.get('/api/v1/user/details')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.api_client.get('/api/v1/user/details').status_code, 401)
+
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.api_client.get('/api/v1/user/details').status_code, 200)
+        self.assertTrue(self.api_client.post('/api/v1/user/logout').json()['Status'])
+        self.assertEqual(self.api_client.get('/api/v1/user/details').status_code, 401)
+
+    def test_cached_entry_has_no_password_hash(self):
+        """
+        Тест: в кэш не попадает хеш пароля, сохранение восстановленного из кэша пользователя его не затирает
+        """
+        self.api_client.get('/api/v1/user/details')
+        cached_user, _ = CachedTokenAuthentication().authenticate_credentials(self.token.key)
+        entry = cache.get(_token_cache_key(self.token.key))
+        self.assertNotIn(self.user.password, repr(entry))
+        self.assertEqual(cached_user.get_deferred_fields(), {'password'})
+
+        cached_user.first_name = 'Cached'
+        cached_user.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Cached')
+        self.assertTrue(self.user.check_password('Str0ngP@ssw0rd!'))
+
+
+class SlidingWindowThrottleTests(TestCase):
+    """
+    Тесты ограничения частоты запросов
+    """
+    def setUp(self):
+        cache.clear()
+        self.api_client = APIClient()
+
+    def tearDown(self):
+        cache.clear()
+
+    @override_settings(THROTTLE_BUDGETS={'login': {'ip': '3/min'}})
+    def test_login_over_budget_rejected_without_queries(self):
+        """
+        Тест: запрос сверх бюджета получает 429 до выполнения представления и запросов к БД
+        """
+        data = {'email': 'nobody@example.com', 'password': 'wrong'}
+        for _ in range(3):
+            self.assertEqual(self.api_client.post('/api/v1/user/login', data).status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api_client.post('/api/v1/user/login', data)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(len(queries), 0)
+
+    @override_settings(THROTTLE_BUDGETS={'login': {'ip': '2/min'}})
+    def test_forwarded_for_header_does_not_bypass_ip_budget(self):
+        """
+        Тест: подставной X-Forwarded-For не меняет IP клиента для бюджета, а за доверенным прокси
+        учитывается адрес, добавленный прокси
+        """
+        data = {'email': 'nobody@example.com', 'password': 'wrong'}
+        statuses = [self.api_client.post('/api/v1/user/login', data, HTTP_X_FORWARDED_FOR=f'10.0.0.{number}').
+                    status_code for number in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+        cache.clear()
+        with patch('rest_framework.settings.api_settings.NUM_PROXIES', 1):
+            statuses = [self.api_client.post('/api/v1/user/login', data,
+                                             HTTP_X_FORWARDED_FOR=f'10.0.0.{number}, 192.0.2.1').status_code
+                        for number in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+    @override_settings(THROTTLE_BUDGETS={'catalog': {'user': '2/min'}})
+    def test_user_scope_is_per_user(self):
+        """
+        Тест: бюджет user считается отдельно для каждого пользователя, анонимы по нему не ограничиваются
+        """
+        user = User.objects.create_user(email='throttle@example.com', username='throttle',
+                                        password='Str0ngP@ssw0rd!', is_active=True)
+        self.api_client.force_authenticate(user)
+        statuses = [self.api_client.get('/api/v1/products').status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(APIClient().get('/api/v1/products').status_code, 200)
+
+    @override_settings(THROTTLE_BUDGETS={'catalog': {'ip': '100/min', 'user': '2/min'}})
+    def test_rejected_request_does_not_drain_other_budgets(self):
+        """
+        Тест: запрос, отклонённый одним бюджетом, не учитывается в остальных
+        """
+        user = User.objects.create_user(email='throttle-ip@example.com', username='throttle-ip',
+                                        password='Str0ngP@ssw0rd!', is_active=True)
+        self.api_client.force_authenticate(user)
+        statuses = [self.api_client.get('/api/v1/products').status_code for _ in range(5)]
+        self.assertEqual(statuses, [200, 200, 429, 429, 429])
+        # Сумма двух окон - на случай, если запросы попали на границу минуты
+        index = int(time.time() // 60)
+        self.assertEqual(sum(cache.get(f'throttle:catalog:ip:127.0.0.1:{i}', 0) for i in (index - 1, index)), 2)
+
+
+class TokenPurgeTests(TestCase):
+    """
+    Тесты удаления просроченных токенов
+    """
+    def test_purges_expired_tokens_in_batches(self):
+        """
+        Тест: удаляются только просроченные токены и токены API неактивных пользователей
+        """
+        old = timezone.now() - datetime.timedelta(days=30)
+        users = [User.objects.create_user(email=f'purge{i}@example.com', username=f'purge{i}',
+                                          password='Str0ngP@ssw0rd!', is_active=i % 2 == 0) for i in range(4)]
+        for user in users:
+            ConfirmEmailToken.objects.get_or_create(user=user)
+            ResetPasswordToken.objects.create(user=user)
+            Token.objects.create(user=user)
+        for model in (ConfirmEmailToken, ResetPasswordToken):
+            model.objects.filter(user__in=users[:3]).update(created_at=old)
+        Token.objects.filter(user__in=users).update(created=old)
+
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('purge_tokens', '--batch-size', '2', stdout=out)
+        self.assertIn('подтверждения: 3, сброса пароля: 3, API: 2', out.getvalue())
+        self.assertEqual(ConfirmEmailToken.objects.filter(user__in=users).count(), 1)
+        self.assertEqual(set(Token.objects.values_list('user_id', flat=True)), {users[0].id, users[2].id})
+
+
+class UserImportTests(TestCase):
+    """
+    Тесты массового создания пользователей
+    """
+    def setUp(self):
+        self.admin = User.objects.create_superuser(email='import-admin@example.com', username='import-admin',
+                                                   password='Str0ngP@ssw0rd!')
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(self.admin)
+
+    def test_import_csv_validated_in_request_and_created_by_task(self):
+        """
+        Тест: файл проверяется в запросе, пароли хешируются отдельными задачами по частям,
+        пользователи и токены создаются пачкой, письма уходят одной задачей, ошибочные строки пропускаются
+        """
+        content = ('email,password,first_name,last_name,company,position\n'
+                   'Buyer1@example.com,Str0ngP@ssw0rd!1,Ivan,Ivanov,ACME,Buyer\n'
+                   'buyer2@example.com,Str0ngP@ssw0rd!2,Petr,Petrov,ACME,Buyer\n'
+                   'buyer3@example.com,Str0ngP@ssw0rd!3,Anna,Sidorova,ACME,Lead\n'
+                   'buyer1@example.com,Str0ngP@ssw0rd!4,Dup,Dup,ACME,Buyer\n'
+                   'weak@example.com,123,Weak,Weak,ACME,Buyer\n')
+        with tempfile.TemporaryDirectory() as upload_dir, override_settings(USER_IMPORT_UPLOAD_DIR=upload_dir):
+            with patch('backend.views.import_users_task') as import_task:
+                import_task.delay.return_value.id = 'import-task'
+                response = self.api_client.post('/api/v1/admin/users/import', content, content_type='text/csv')
+            self.assertEqual(response.status_code, 202)
+            data = response.json()
+            self.assertEqual((data['task_id'], data['Accepted']), ('import-task', 3))
+            self.assertEqual(set(data['Errors']), {'5', '6'})
+            self.assertFalse(User.objects.filter(email__startswith='buyer').exists())
+
+            path = import_task.delay.call_args.args[0]
+            with patch('backend.tasks.send_email_batch') as batch_task, \
+                    patch('backend.services.users.make_password', wraps=make_password) as hasher, \
+                    patch.object(import_users_task, 'replace') as replace, \
+                    override_settings(USER_IMPORT_HASH_CHUNK_SIZE=2), \
+                    self.captureOnCommitCallbacks(execute=True):
+                import_users_task(path)
+                # Задача заменяется аккордом: хеширование частями, затем создание пользователей
+                workflow = replace.call_args.args[0]
+                self.assertEqual(len(workflow.tasks), 2)
+                result = workflow.body([signature() for signature in workflow.tasks])
+            self.assertEqual(hasher.call_count, 3)
+            self.assertEqual(result['created'], 3)
+            self.assertEqual(os.listdir(upload_dir), [])
+
+        users = User.objects.filter(email__startswith='buyer').order_by('email')
+        self.assertEqual([user.email for user in users], ['buyer1@example.com', 'buyer2@example.com',
+                                                          'buyer3@example.com'])
+        self.assertTrue(users[0].check_password('Str0ngP@ssw0rd!1'))
+        self.assertFalse(any(user.is_active for user in users))
+        self.assertEqual(ConfirmEmailToken.objects.filter(user__in=users).count(), 3)
+        batch_task.delay.assert_called_once()
+        self.assertEqual(len(batch_task.delay.call_args.args[0]), 3)
+
+        with patch.object(import_users_task, 'AsyncResult') as async_result:
+            async_result.return_value.state = 'SUCCESS'
+            async_result.return_value.result = result
+            status = self.api_client.get('/api/v1/admin/users/import/import-task').json()
+        async_result.assert_called_once_with('import-task')
+        self.assertEqual((status['status'], status['Created']), ('SUCCESS', 3))
+
+    def test_upload_removed_when_task_not_queued(self):
+        """
+        Тест: если задачу не удалось поставить в очередь, сохранённый файл с паролями удаляется
+        """
+        content = ('email,password,first_name,last_name,company,position\n'
+                   'queue@example.com,Str0ngP@ssw0rd!1,Ivan,Ivanov,ACME,Buyer\n')
+        with tempfile.TemporaryDirectory() as upload_dir, override_settings(USER_IMPORT_UPLOAD_DIR=upload_dir):
+            with patch('backend.views.import_users_task') as import_task:
+                import_task.delay.side_effect = ConnectionError('broker unavailable')
+                with self.assertRaises(ConnectionError):
+                    self.api_client.post('/api/v1/admin/users/import', content, content_type='text/csv')
+            self.assertEqual(os.listdir(upload_dir), [])
+
+    def test_import_command_hashes_in_process_pool(self):
+        """
+        Тест: команда import_users хеширует пароли в пуле процессов
+        """
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write('email,password,first_name,last_name,company,position\n'
+                       'pool1@example.com,Str0ngP@ssw0rd!1,Ivan,Ivanov,ACME,Buyer\n'
+                       'pool2@example.com,Str0ngP@ssw0rd!2,Petr,Petrov,ACME,Buyer\n')
+        out = io.StringIO()
+        try:
+            with patch('backend.tasks.send_email_batch'):
+                call_command('import_users', file.name, '--workers', '2', stdout=out)
+        finally:
+            os.remove(file.name)
+        self.assertIn('Создано пользователей: 2', out.getvalue())
+        self.assertTrue(User.objects.get(email='pool2@example.com').check_password('Str0ngP@ssw0rd!2'))
+
+    @patch('backend.services.mailer.send_email_batch')
+    def test_register_writes_user_once(self, _send_email_batch):
+        """
+        Тест: при регистрации пользователь записывается одним INSERT, без повторного сохранения пароля
+        """
+        payload = {'first_name': 'Single', 'last_name': 'Write', 'email': 'single-write@example.com',
+                   'password': 'Str0ngP@ssw0rd!', 'company': 'ACME', 'position': 'Buyer'}
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().post('/api/v1/user/register', payload, format='json')
+        self.assertTrue(response.json()['Status'])
+        self.assertFalse([query for query in queries.captured_queries
+                          if query['sql'].startswith('UPDATE "backend_user"')])
+        self.assertTrue(User.objects.get(email='single-write@example.com').check_password('Str0ngP@ssw0rd!'))
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class MailerTests(TestCase):
+    """
+    Тесты пакетной отправки почты через общее соединение
+    """
+    messages = [{'to_email': f'mail{i}@example.com', 'subject': 'Тема', 'message': 'Текст'} for i in range(3)]
+
+    def setUp(self):
+        cache.clear()
+        mailer.close_pooled_connection()
+
+    def tearDown(self):
+        mailer.close_pooled_connection()
+
+    def test_queued_emails_drained_as_one_batch(self):
+        """
+        Тест: письма одной транзакции уходят одной задачей после фиксации
+        """
+        with patch('backend.services.mailer.send_email_batch') as batch_task, \
+                self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                for item in self.messages:
+                    mailer.queue_email(**item)
+                batch_task.delay.assert_not_called()
+        batch_task.delay.assert_called_once_with(self.messages)
+
+    def test_rolled_back_transaction_sends_nothing(self):
+        """
+        Тест: письма откатившейся транзакции не отправляются и не попадают в пачку следующей
+        """
+        with patch('backend.services.mailer.send_email_batch') as batch_task, \
+                self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    mailer.queue_email(**self.messages[0])
+                    raise DatabaseError('откат')
+            except DatabaseError:
+                pass
+            batch_task.delay.assert_not_called()
+            with transaction.atomic():
+                mailer.queue_email(**self.messages[1])
+        batch_task.delay.assert_called_once_with([self.messages[1]])
+
+    def test_rolled_back_savepoint_email_dropped(self):
+        """
+        Тест: письмо из откатившейся точки сохранения не отправляется, остальные письма транзакции уходят
+        """
+        with patch('backend.services.mailer.send_email_batch') as batch_task, \
+                self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                mailer.queue_email(**self.messages[0])
+                try:
+                    with transaction.atomic():
+                        mailer.queue_email(**self.messages[1])
+                        raise DatabaseError('откат')
+                except DatabaseError:
+                    pass
+                mailer.queue_email(**self.messages[2])
+        sent = [item for call in batch_task.delay.call_args_list for item in call.args[0]]
+        self.assertEqual(sent, [self.messages[0], self.messages[2]])
+
+    def test_connection_reused_between_batches(self):
+        """
+        Тест: несколько пачек отправляются через одно соединение
+        """
+        with patch('backend.services.mailer.get_connection', wraps=get_connection) as connect:
+            self.assertEqual(send_email_batch(self.messages), 3)
+            self.assertEqual(send_email_batch(self.messages[:1]), 1)
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(len(mail.outbox), 4)
+
+    @override_settings(EMAIL_RATE_LIMIT='2/min')
+    def test_rate_limit_and_smtp_error_retry_unsent_messages(self):
+        """
+        Тест: при превышении лимита провайдера и ошибке SMTP на повтор ставятся только неотправленные письма
+        """
+        with patch.object(send_email_batch, 'retry', side_effect=Retry()) as retry:
+            with self.assertRaises(Retry):
+                send_email_batch(self.messages)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(retry.call_args.kwargs['args'], [self.messages[2:]])
+        self.assertGreater(retry.call_args.kwargs['countdown'], 0)
+        self.assertIsNone(retry.call_args.kwargs['max_retries'])
+
+        cache.clear()
+        with patch.object(send_email_batch, 'retry', side_effect=Retry()) as retry, \
+                patch.object(mail.backends.locmem.EmailBackend, 'send_messages',
+                             side_effect=smtplib.SMTPServerDisconnected('closed')):
+            with self.assertRaises(Retry):
+                send_email_batch(self.messages)
+        self.assertEqual(retry.call_args.kwargs['args'], [self.messages])
+        self.assertIsInstance(retry.call_args.kwargs['exc'], smtplib.SMTPServerDisconnected)
+
+
 # вспомогательная функция для сериализации в JSON
 import json
 
@@ -0,0 +1,97 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+
+def parse_rate(rate: str) -> tuple[int, int]:
+    """
+    '100/min' -> (100, 60). Период задаётся первой буквой: s, m, h, d.
+    """
+    limit, period = rate.split('/')
+    return int(limit), PERIODS[period.strip()[0]]
+
+
+def sliding_window_hit(key: str, limit: int, window: int, now: float) -> float:
+    """
+    Учитывает запрос в счётчике скользящего окна и возвращает оценку числа запросов за последние window секунд.
+    Хранятся два счётчика фиксированных окон (текущее и предыдущее), предыдущее учитывается с весом
+    оставшейся доли окна. Запрос сверх лимита из счётчика вычитается, чтобы не продлевать блокировку.
+    Все операции - атомарные add/incr общего кэша.
+    """
+    index = int(now // window)
+    current_key, previous_key = f'{key}:{index}', f'{key}:{index - 1}'
+    cache.add(current_key, 0, timeout=window * 2)
+    try:
+        current = cache.incr(current_key)
+    except ValueError:
+        # Ключ вытеснен между add и incr
+        cache.set(current_key, 1, timeout=window * 2)
+        current = 1
+    previous = cache.get(previous_key, 0)
+    estimate = previous * (1 - (now % window) / window) + current
+    if estimate > limit:
+        cache.decr(current_key)
+    return estimate
+
+
+def sliding_window_release(key: str, window: int, now: float) -> None:
+    """
+    Отменяет запрос, учтённый sliding_window_hit в том же окне (например, если его отклонил другой бюджет).
+    """
+    try:
+        cache.decr(f'{key}:{int(now // window)}')
+    except ValueError:
+        pass
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Ограничение частоты запросов по скользящему окну в общем кэше.
+    Представление задаёт throttle_scope, бюджеты берутся из settings.THROTTLE_BUDGETS:
+    {scope: {'ip' | 'user' | 'token': '<N>/<период>'}}. Проверяются все применимые к запросу бюджеты
+    (ip - для всех, user - для аутентифицированных, token - для запросов с токеном).
+    Представления без throttle_scope не ограничиваются.
+    """
+    def __init__(self):
+        self._wait = None
+
+    def get_identity(self, request, kind: str):
+        if kind == 'ip':
+            return self.get_ident(request)
+        if kind == 'user' and request.user and request.user.is_authenticated:
+            return str(request.user.pk)
+        if kind == 'token' and getattr(request.auth, 'key', None):
+            return hashlib.sha256(request.auth.key.encode('utf-8')).hexdigest()[:32]
+        return None
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        budgets = settings.THROTTLE_BUDGETS.get(scope) if scope else None
+        if not budgets:
+            return True
+
+        now = time.time()
+        counted = []
+        for kind, rate in budgets.items():
+            identity = self.get_identity(request, kind)
+            if identity is None:
+                continue
+            limit, window = parse_rate(rate)
+            key = f'throttle:{scope}:{kind}:{identity}'
+            if sliding_window_hit(key, limit, window, now) > limit:
+                # Отклонённый запрос не должен расходовать остальные бюджеты
+                for counted_key, counted_window in counted:
+                    sliding_window_release(counted_key, counted_window, now)
+                self._wait = window - now % window
+                return False
+            counted.append((key, window))
+        return True
+
+    def wait(self):
+        return self._wait
@@ -6,15 +6,16 @@ from rest_framework.urls import app_name
 from backend.views import (ShopUpdate, RegisterAccountView, ConfirmAccountView,
                            AccountDetailsView, LoginAccountView, LogoutAccountView,
                            ShopListView, ShopDetailView, CategoryListView,
-                           CategoryDetailView, ProductListView, ProductDetailView,
-                           ProductInfoView, BasketView, PartnerUpdateView,
-                           PartnerStateView, PartnerOrdersView, ContactView,
-                           OrderView,
+                           CategoryDetailView, ProductListView, ProductDetailView, ProductCompareView,
+                           ProductInfoView, ProductInfoExportView, BasketView, PartnerUpdateView,
+                           PartnerStateView, PartnerOrdersView, PartnerOrdersExportView, ContactView,
+                           OrderView, OrderEventsView,
                            AdminCategoryListCreateView, AdminCategoryDetailView,
                            AdminProductListCreateView, AdminProductDetailView,
                            AdminProductInfoListCreateView, AdminProductInfoDetailView,
                            AdminShopListCreateView, AdminShopDetailView,
-                           AdminOrderListView, AdminOrderDetailUpdateView)
+                           AdminOrderListView, AdminOrderDetailUpdateView, AdminOrderBulkStatusView,
+                           AdminUserImportView, AdminUserImportStatusView)
 
 
 app_name = 'backend'
@@ -36,12 +37,16 @@ urlpatterns = [
     path('categories/<int:pk>', CategoryDetailView.as_view(), name='category-detail'),
     path('products', ProductListView.as_view(), name='product-list'),
     path('products/<int:pk>', ProductDetailView.as_view(), name='product-detail'),
+    path('products/compare', ProductCompareView.as_view(), name='product-compare'),
     path('products/info', ProductInfoView.as_view(), name='product-info'),
+    path('products/export', ProductInfoExportView.as_view(), name='product-export'),
     path('basket', BasketView.as_view(), name='basket'),
     path('partner/update', PartnerUpdateView.as_view(), name='partner-update'),
     path('partner/state', PartnerStateView.as_view(), name='partner-state'),
     path('partner/orders', PartnerOrdersView.as_view(), name='partner-orders'),
+    path('partner/orders/export', PartnerOrdersExportView.as_view(), name='partner-orders-export'),
     path('orders', OrderView.as_view(), name='orders'),
+    path('orders/events', OrderEventsView.as_view(), name='order-events'),
     # Admin API склад
     path('admin/categories', AdminCategoryListCreateView.as_view(), name='admin-category-list'),
     path('admin/categories/<int:pk>', AdminCategoryDetailView.as_view(), name='admin-category-detail'),
@@ -52,5 +57,9 @@ urlpatterns = [
     path('admin/shops', AdminShopListCreateView.as_view(), name='admin-shop-list'),
     path('admin/shops/<int:pk>', AdminShopDetailView.as_view(), name='admin-shop-detail'),
     path('admin/orders', AdminOrderListView.as_view(), name='admin-order-list'),
+    path('admin/orders/status', AdminOrderBulkStatusView.as_view(), name='admin-order-bulk-status'),
     path('admin/orders/<int:pk>', AdminOrderDetailUpdateView.as_view(), name='admin-order-detail'),
+    path('admin/users/import', AdminUserImportView.as_view(), name='admin-user-import'),
+    path('admin/users/import/<str:task_id>', AdminUserImportStatusView.as_view(),
+         name='admin-user-import-status'),
 ]
@@ -1,16 +1,25 @@
+import csv
+import time
+from enum import Enum
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from django.core.validators import URLValidator
-from django.db import IntegrityError
-from django.db.models import Q, Sum, F
-from django.http import JsonResponse
-from enum import Enum
-from typing import Optional
+from django.db import IntegrityError, transaction
+from django.db.models import Q, prefetch_related_objects
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+from django.views import View
 from requests import get
 from yaml import load as load_yaml, Loader
 from rest_framework.authtoken.models import Token
-from rest_framework.authentication import TokenAuthentication, SessionAuthentication
+from rest_framework.exceptions import ValidationError as DRFValidationError, AuthenticationFailed
+from rest_framework.authentication import SessionAuthentication
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -18,13 +27,43 @@ from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIV
 from ujson import loads as load_json
 from backend.signals import new_user_registered, new_order
 from .models import User, Shop, Category, Product, ProductInfo, \
-    Parameter, ProductParameter, Contact, Order, OrderItem, ConfirmEmailToken
+    ProductParameter, Contact, Order, ConfirmEmailToken, ProductBestOffer, ShopOrder, \
+    ArchivedOrder, ArchivedShopOrder
 from .serializers import UserSerializer, ShopSerializer, \
-    CategorySerializer, ProductSerializer, ProductInfoSerializer, \
-    OrderSerializer, OrderItemSerializer, ContactSerializer, \
+    CategorySerializer, ProductSerializer, \
+    OrderSerializer, ContactSerializer, \
     CategoryAdminSerializer, ProductAdminWriteSerializer, ProductInfoAdminWriteSerializer, \
-    ShopAdminSerializer, OrderAdminUpdateSerializer
-from .tasks import do_import
+    ShopAdminSerializer, OrderAdminUpdateSerializer, ProductBestOfferSerializer, ShopOrderSerializer, \
+    ArchivedOrderSerializer, ArchivedShopOrderSerializer
+from .tasks import do_import, import_users as import_users_task
+from .pagination import OrderCursorPagination
+from .authentication import CachedTokenAuthentication, invalidate_token_cache
+from .idempotency import idempotent
+from .services.basket import BasketError, add_basket_items, update_basket_items, remove_basket_items, \
+    cached_basket_data, remove_offers_from_baskets
+from .services.basket_cache import basket_cache_enabled
+from .services.best_offers import schedule_shop_best_offer_refresh
+from .services.catalog_engine import parse_catalog_filters, catalog_page
+from .services.versioning import CATALOG_VERSION, bump_version_on_commit
+from .services.fragments import render_offers
+from .services.orders import OrderError, checkout_basket, change_order_status, parse_order_filters, \
+    bulk_change_order_status, ALLOWED_TRANSITIONS, BULK_STATUS_MAX_ORDERS
+from .services.refcache import SHOPS_VERSION, get_shop, get_category, get_or_create_parameter, \
+    invalidate_reference_cache
+from .services.users import UserImportError, parse_users_csv, validate_user_rows, save_users_upload, \
+    discard_users_upload
+from .services.events import get_event_channel, user_channel, shop_channel
+from .services.exporter import (OFFER_EXPORT_FIELDS, offers_export_queryset, iter_offer_rows,
+                                ORDER_LINE_EXPORT_FIELDS, partner_order_lines_queryset, iter_order_line_rows,
+                                ndjson_chunks, csv_chunks, gzip_chunks)
+
+
+def prefetch_order_items(orders) -> None:
+    """
+    Подгружает позиции одним запросом только для заказов без сохранённого документа
+    (у оформленных заказов позиции берутся из документа).
+    """
+    prefetch_related_objects([order for order in orders if order.document is None], 'ordered_items')
 
 
 class BooleanState(Enum):
@@ -60,6 +99,8 @@ class RegisterAccountView(APIView):
     """
     Регистрация нового пользователя
     """
+    throttle_scope = 'register'
+
     def post(self, request, *args, **kwargs):
         if {'first_name', 'last_name', 'email', 'password', 'company', 'position'}.issubset(request.data):
             # Валидация пароля на сложность
@@ -74,9 +115,8 @@ class RegisterAccountView(APIView):
                 # Сериализация данных пользователя и проверка на валидность
                 user_serializer = UserSerializer(data=request.data)
                 if user_serializer.is_valid():
-                    user = user_serializer.save()
-                    user.set_password(request.data['password'])    # Хешируем пароль
-                    user.save()    # Сохраняем хешированный пароль
+                    # Пароль хешируется до сохранения, чтобы пользователь записывался в БД один раз
+                    user = user_serializer.save(password=make_password(request.data['password']))
                     new_user_registered.send(sender=self.__class__, user_id=user.id)
                     return JsonResponse({'Status': True, 'Message': 'Регистрация прошла успешно'})
                 else:
@@ -116,6 +156,8 @@ class LoginAccountView(APIView):
     """
     Авторизация пользователя
     """
+    throttle_scope = 'login'
+
     def post(self, request, *args, **kwargs):
         if {'email', 'password'}.issubset(request.data):
             user = authenticate(request, username=request.data['email'], password=request.data['password'])
@@ -131,11 +173,15 @@ class LogoutAccountView(APIView):
     """
     Выход пользователя
     """
-    authentication_classes = [TokenAuthentication, SessionAuthentication]
+    authentication_classes = [CachedTokenAuthentication, SessionAuthentication]
     permission_classes = [IsAuthenticated]
     def post(self, request, *args, **kwargs):
         # DRF ensures user is authenticated due to permission_classes
-        request.user.auth_token.delete()
+        token = Token.objects.filter(user_id=request.user.id).first()
+        if token is not None:
+            key = token.key
+            token.delete()
+            invalidate_token_cache(key)
         return JsonResponse({'Status': True, 'Message': 'Вы успешно вышли из системы'})
 
 
@@ -151,9 +197,11 @@ class ShopDetailView(APIView):
     """
     Получение данных конкретного магазина
     """
-    def get(self, request, shop_id, *args, **kwargs):
+    def get(self, request, pk, *args, **kwargs):
         try:
-            shop = Shop.objects.get(id=shop_id, state=True)
+            shop = get_shop(pk)
+            if not shop.state:
+                raise Shop.DoesNotExist
             shop_serializer = ShopSerializer(shop)
             return JsonResponse({'Status': True, 'Shop': shop_serializer.data})
         except Shop.DoesNotExist:
@@ -172,9 +220,9 @@ class CategoryDetailView(APIView):
     """
     Получение данных конкретной категории
     """
-    def get(self, request, category_id, *args, **kwargs):
+    def get(self, request, pk, *args, **kwargs):
         try:
-            category = Category.objects.get(id=category_id)
+            category = get_category(pk)
             category_serializer = CategorySerializer(category)
             return JsonResponse({'Status': True, 'Category': category_serializer.data})
         except Category.DoesNotExist:
@@ -183,16 +231,46 @@ class CategoryDetailView(APIView):
 
 class ProductListView(APIView):
     """
-    Получение списка всех продуктов
+    Получение списка всех продуктов в наличии с лучшим предложением по каждому.
+    Данные берутся из предрасчитанной таблицы лучших предложений.
     """
-    queryset = Product.objects.all()
-    serializer_class = ProductSerializer(queryset, many=True)
+    throttle_scope = 'catalog'
+
+    def get(self, request, *args, **kwargs):
+        queryset = ProductBestOffer.objects.select_related('product__category', 'shop')
+
+        category_id = request.query_params.get('category_id')
+        if category_id:
+            queryset = queryset.filter(product__category_id=category_id)
+
+        serializer = ProductBestOfferSerializer(queryset, many=True)
+        return JsonResponse({'Status': True, 'Products': serializer.data})
+
+
+class ProductCompareView(APIView):
+    """
+    Сравнение лучших предложений по нескольким товарам.
+    ID товаров передаются через запятую в параметре ids.
+    """
+    throttle_scope = 'catalog'
+
+    def get(self, request, *args, **kwargs):
+        ids = [item for item in request.query_params.get('ids', '').split(',') if item.isdigit()]
+        if not ids:
+            return JsonResponse({'Status': False, 'Errors': 'Не переданы ID товаров'})
+
+        queryset = (ProductBestOffer.objects.filter(product_id__in=ids).
+                    select_related('product__category', 'shop'))
+        serializer = ProductBestOfferSerializer(queryset, many=True)
+        return JsonResponse({'Status': True, 'Products': serializer.data})
 
 
 class ProductDetailView(APIView):
     """
     Получение данных конкретного продукта
     """
+    throttle_scope = 'catalog'
+
     def get(self, request, product_id, *args, **kwargs):
         try:
             product = Product.objects.get(id=product_id)
@@ -204,33 +282,86 @@ class ProductDetailView(APIView):
 
 class ProductInfoView(APIView):
     """
-    Получение информации о продукте в конкретном магазине
+    Получение информации о продукте в конкретном магазине.
+    Поддерживает фильтры shop_id, category_id, price_min, price_max,
+    param=<название>:<мин>:<макс>, сортировку ordering и постраничный вывод offset/limit.
     """
+    throttle_scope = 'catalog'
+
     def get(self, request, *args, **kwargs):
-        # Начинаем с базового запроса, чтобы фильтровать только активные магазины
-        query = Q(shop__state=True)
+        try:
+            filters = parse_catalog_filters(request.query_params)
+        except ValueError as error:
+            return JsonResponse({'Status': False, 'Errors': str(error)})
 
-        # Получаем параметры запроса
-        shop_id = request.query_params.get('shop_id')
-        category_id = request.query_params.get('category_id')
+        # Сначала отбираем только ID нужной страницы (через БД или колоночный движок)
+        total, page_ids = catalog_page(filters)
 
-        # Если передан shop_id, добавляем его в запрос
-        if shop_id:
-            query = query & Q(shop_id=shop_id)
+        # Затем собираем ответ из закэшированных фрагментов, сериализуя только промахи
+        return JsonResponse({'Status': True, 'Count': total, 'ProductInfos': render_offers(page_ids)})
 
-        # Если передан category_id, добавляем его в запрос
-        if category_id:
-            query = query & Q(product__category_id=category_id)
 
-        # Получаем queryset с фильтрацией и оптимизацией запросов
-        queryset = (ProductInfo.objects.filter(query).
-                    select_related('shop', 'product__category').    # Для получения связанных объектов
-                    prefetch_related('product_parameters__parameter').    # Для многих параметров
-                    distinct())    # Убираем дубликаты
+class StreamingExportMixin:
+    """
+    Потоковый ответ выгрузки в формате NDJSON или CSV (параметр output), по запросу сжатый gzip.
+    """
+    content_types = {
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv',
+    }
+
+    def get_output(self, request):
+        # Параметр называется output, так как format зарезервирован DRF
+        output = request.query_params.get('output', 'ndjson').lower()
+        return output if output in self.content_types else None
 
-        # Сериализуем queryset
-        serializer = ProductInfoSerializer(queryset, many=True)
-        return JsonResponse({'Status': True, 'ProductInfos': serializer.data})
+    def export_response(self, request, output: str, rows, fields: tuple, basename: str) -> StreamingHttpResponse:
+        if output == 'csv':
+            chunks = csv_chunks(rows, fields)
+        else:
+            chunks = ndjson_chunks(rows)
+
+        filename = f'{basename}.{output}'
+        content_type = self.content_types[output]
+        if parse_boolean_state(request.query_params.get('gzip', '')):
+            chunks = gzip_chunks(chunks)
+            filename += '.gz'
+            content_type = 'application/gzip'
+
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class ProductInfoExportView(StreamingExportMixin, APIView):
+    """
+    Потоковая выгрузка каталога предложений в формате NDJSON или CSV.
+    Ответ формируется по мере чтения из БД, поэтому память не зависит от размера каталога.
+    """
+    throttle_scope = 'catalog_export'
+
+    def get(self, request, *args, **kwargs):
+        output = self.get_output(request)
+        if output is None:
+            return JsonResponse({'Status': False, 'Errors': 'Поддерживаются форматы: ndjson, csv'})
+
+        updated_since = request.query_params.get('updated_since')
+        if updated_since:
+            updated_since = parse_datetime(updated_since)
+            if updated_since is None:
+                return JsonResponse({'Status': False, 'Errors': 'Некорректное значение updated_since'})
+
+        # Параметры проверяются до начала потока: после отправки заголовков ошибку уже не вернуть
+        ids = {}
+        for param in ('shop_id', 'category_id'):
+            value = request.query_params.get(param)
+            if value:
+                if not value.isdigit():
+                    return JsonResponse({'Status': False, 'Errors': f'Некорректное значение {param}'})
+                ids[param] = int(value)
+
+        queryset = offers_export_queryset(updated_since=updated_since, **ids)
+        return self.export_response(request, output, iter_offer_rows(queryset), OFFER_EXPORT_FIELDS, 'catalog')
 
 
 class BasketView(APIView):
@@ -240,17 +371,19 @@ class BasketView(APIView):
     def get(self, request, *args, **kwargs):
         """ Получение текущей корзины пользователя """
         if request.user.is_authenticated:
+            if basket_cache_enabled():
+                return Response(cached_basket_data(request.user.id))
+            # Итоги хранятся в самом заказе, агрегировать позиции не нужно
             basket = (Order.objects.filter(user_id=request.user.id, status='basket').
-                      prefetch_related('ordered_items__product_info__product__category',
-                                       'ordered_items__product_info__product_parameters__parameter').
-                      annotate(total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).
-                      distinct())
+                      prefetch_related('ordered_items__product_info__product',
+                                       'ordered_items__product_info__shop'))
 
             serializer = OrderSerializer(basket, many=True)
             return Response(serializer.data)
         return JsonResponse({'Status': False, 'Errors': 'Пользователь не аутентифицирован'}, status=403)
 
 
+    @idempotent
     def post(self, request, *args, **kwargs):
         """ Добавление товара в корзину пользователя """
         if request.user.is_authenticated:
@@ -261,21 +394,13 @@ class BasketView(APIView):
                 except ValueError:
                     return JsonResponse({'Status': False, 'Errors': 'Неверный формат данных'})
                 else:
-                    basket, _ = Order.objects.get_or_create(user_id=request.user.id, status='basket')
-                    objects_created = 0
-                    for order_item in items_dict:
-                        order_item.update({'order': basket.id})
-                        serializer = OrderItemSerializer(data=order_item)
-                        if serializer.is_valid():
-                            try:
-                                serializer.save()
-                            except IntegrityError as error:
-                                return JsonResponse({'Status': False, 'Errors': str(error)})
-                            else:
-                                objects_created += 1
-                        else:
-                            return JsonResponse({'Status': False, 'Errors': serializer.errors})
-                    return JsonResponse({'Status': True, 'Message': 'Товар добавлен в корзину'})
+                    # Все позиции проверяются и записываются одной транзакцией: либо все, либо ничего
+                    try:
+                        objects_created = add_basket_items(request.user.id, items_dict)
+                    except BasketError as error:
+                        return JsonResponse({'Status': False, 'Errors': error.errors})
+                    return JsonResponse({'Status': True, 'Message': 'Товар добавлен в корзину',
+                                         'Count': objects_created})
             return JsonResponse({'Status': False, 'Errors': 'Нет данных для добавления'})
         return JsonResponse({'Status': False, 'Errors': 'Пользователь не аутентифицирован'}, status=403)
 
@@ -285,17 +410,11 @@ class BasketView(APIView):
         if request.user.is_authenticated:
             items_string = request.data.get('items')
             if items_string:
-                items_list = items_string.split(',')
-                basket, _ = Order.objects.get_or_create(user_id=request.user.id, status='basket')
-                query = Q()
-                objects_deleted = False
-                for order_item_id in items_list:
-                    if order_item_id.isdigit():
-                        query = query | Q(id=int(order_item_id), order_id=basket.id)
-                        objects_deleted = True
+                items_list = [int(order_item_id) for order_item_id in items_string.split(',')
+                              if order_item_id.isdigit()]
 
-                if objects_deleted:
-                    deleted_count = OrderItem.objects.filter(query).delete()[0]
+                if items_list:
+                    deleted_count = remove_basket_items(request.user.id, items_list)
                     return JsonResponse({'Status': True, 'Message': f'Удалено позиций: {deleted_count}'})
                 else:
                     return JsonResponse({'Status': False, 'Errors': 'Нет корректных ID для удаления'})
@@ -312,13 +431,13 @@ class BasketView(APIView):
                 except ValueError:
                     return JsonResponse({'Status': False, 'Errors': 'Неверный формат данных'})
                 else:
-                    basket, _ = Order.objects.get_or_create(user_id=request.user.id, status='basket')
-                    objects_updated = 0
-                    for order_item in items_dict:
-                        if type(order_item['id']) == int and type(order_item['quantity']) == int:
-                            objects_updated += (OrderItem.objects.filter(id=order_item['id'], order_id=basket.id).
-                                                update(quantity=order_item['quantity']))
-                    return JsonResponse({'Status': True, 'Message': 'Корзина успешно обновлена'})
+                    # Все изменения применяются одним UPDATE, нулевое количество удаляет позицию
+                    try:
+                        objects_updated, objects_deleted = update_basket_items(request.user.id, items_dict)
+                    except BasketError as error:
+                        return JsonResponse({'Status': False, 'Errors': error.errors})
+                    return JsonResponse({'Status': True, 'Message': 'Корзина успешно обновлена',
+                                         'Updated': objects_updated, 'Removed': objects_deleted})
             return JsonResponse({'Status': False, 'Errors': 'Нет данных для обновления'})
         return JsonResponse({'Status': False, 'Errors': 'Пользователь не аутентифицирован'}, status=403)
 
@@ -327,6 +446,8 @@ class PartnerUpdateView(APIView):
     """
     Обновление информации партнёра
     """
+    throttle_scope = 'partner_update'
+
     def post(self, request, *args, **kwargs):
         """ Обновление информации """
         if request.user.type != 'shop':
@@ -342,26 +463,32 @@ class PartnerUpdateView(APIView):
             else:
                 steam = get(url).content
                 data = load_yaml(steam, Loader=Loader)
-                shop, _ = Shop.objects.get_or_create(user_id=request.user.id, name=data['shop'])
-                for category in data['categories']:
-                    category_obj, _ = Category.objects.get_or_create(id=category['id'], name=category['name'])
-                    category_obj.shops.add(shop.id)
-                    category_obj.save()
-                ProductInfo.objects.filter(shop_id=shop.id).delete()
-                for item in data['goods']:
-                    product, _ = Product.objects.get_or_create(name=item['name'], category_id=item['category'])
-                    product_info = ProductInfo.objects.create(product_id=product.id,
-                                                              external_id=item['id'],
-                                                              model=item['model'],
-                                                              price=item['price'],
-                                                              price_rrc=item['price_rrc'],
-                                                              quantity=item['quantity'],
-                                                              shop_id=shop.id,)
-                    for parameter_name, parameter_value in item['parameters'].items():
-                        parameter_obj, _ = Parameter.objects.get_or_create(name=parameter_name)
-                        ProductParameter.objects.create(product_info_id=product_info.id,
-                                                        parameter_id=parameter_obj.id,
-                                                        value=parameter_value)
+                # Прайс загружается целиком в одной транзакции: пересчёт лучших предложений
+                # выполняется один раз после фиксации, а не на каждую строку
+                with transaction.atomic():
+                    shop, _ = Shop.objects.get_or_create(user_id=request.user.id, name=data['shop'])
+                    for category in data['categories']:
+                        category_obj, _ = Category.objects.get_or_create(id=category['id'], name=category['name'])
+                        category_obj.shops.add(shop.id)
+                    # Предложения обновляются на месте, чтобы позиции корзин продолжали на них ссылаться;
+                    # удаляются только предложения, которых нет в новом прайсе
+                    kept_ids = []
+                    for item in data['goods']:
+                        product, _ = Product.objects.get_or_create(name=item['name'], category_id=item['category'])
+                        product_info, _ = ProductInfo.objects.update_or_create(
+                            product_id=product.id, shop_id=shop.id, external_id=item['id'],
+                            defaults={'model': item['model'], 'price': item['price'],
+                                      'price_rrc': item['price_rrc'], 'quantity': item['quantity']})
+                        kept_ids.append(product_info.id)
+                        ProductParameter.objects.filter(product_info_id=product_info.id).delete()
+                        for parameter_name, parameter_value in item['parameters'].items():
+                            parameter_obj, _ = get_or_create_parameter(parameter_name)
+                            ProductParameter.objects.create(product_info_id=product_info.id,
+                                                            parameter_id=parameter_obj.id,
+                                                            value=parameter_value)
+                    removed = ProductInfo.objects.filter(shop_id=shop.id).exclude(id__in=kept_ids)
+                    remove_offers_from_baskets(removed.values_list('id', flat=True))
+                    removed.delete()
                 return JsonResponse({'Status': True, 'Message': 'Информация успешно обновлена'})
         return JsonResponse({'Status': False, 'Errors': 'URL не передан'})
 
@@ -391,7 +518,13 @@ class PartnerStateView(APIView):
             if state is not None:
                 parsed_state = parse_boolean_state(state)
                 if parsed_state is not None:
-                    Shop.objects.filter(user_id=request.user.id).update(state=parsed_state)
+                    with transaction.atomic():
+                        Shop.objects.filter(user_id=request.user.id).update(state=parsed_state)
+                        # update() не отправляет post_save, поэтому пересчёт запускаем явно
+                        for shop_id in Shop.objects.filter(user_id=request.user.id).values_list('id', flat=True):
+                            schedule_shop_best_offer_refresh(shop_id)
+                        bump_version_on_commit(CATALOG_VERSION)
+                        invalidate_reference_cache(SHOPS_VERSION)
                     return JsonResponse({'Status': True, 'Message': 'Состояние успешно изменено'})
                 return JsonResponse({'Status': False, 'Errors': 'Некорректное значение состояния'})
             return JsonResponse({'Status': False, 'Errors': 'Состояние не передано'})
@@ -403,23 +536,65 @@ class PartnerOrdersView(APIView):
     Просмотр заказов партнёра
     """
     def get(self, request, *args, **kwargs):
-        """ Получение заказов партнёра """
+        """
+        Получение подзаказов магазина партнёра постранично (cursor, limit), с фильтрами status, created_from, created_to.
+        С archive=true - подзаказы из архива завершённых заказов.
+        """
         if request.user.is_authenticated:
             if request.user.type != 'shop':
                 return JsonResponse({'Status': False, 'Errors': 'Пользователь не является партнёром'}, status=403)
 
-            orders = (Order.objects.filter(ordered_items__product_info__shop__user_id=request.user.id).
-                      exclude(status='basket').
-                      prefetch_related('ordered_items__product_info__product__category',
-                                       'ordered_items__product_info__product_parameters__parameter').
-                      annotate(total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).
-                      distinct())
+            shop_id = Shop.objects.filter(user_id=request.user.id).values_list('id', flat=True).first()
+            if shop_id is None:
+                return JsonResponse({'Status': False, 'Errors': 'Магазин не найден'})
+            try:
+                filters = parse_order_filters(request.query_params)
+            except OrderError as error:
+                return JsonResponse({'Status': False, 'Errors': error.errors})
 
-            serializer = OrderSerializer(orders, many=True)
-            return Response(serializer.data)
+            # Партнёр видит только свои подзаказы и их позиции, без соединения с чужими позициями
+            if parse_boolean_state(request.query_params.get('archive')):
+                model, serializer_class = ArchivedShopOrder, ArchivedShopOrderSerializer
+            else:
+                model, serializer_class = ShopOrder, ShopOrderSerializer
+            orders = model.objects.filter(shop_id=shop_id, **filters).select_related('order')
+
+            paginator = OrderCursorPagination()
+            page = paginator.paginate_queryset(orders, request, view=self)
+            prefetch_order_items(page)
+            serializer = serializer_class(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
         return JsonResponse({'Status': False, 'Errors': 'Пользователь не аутентифицирован'}, status=403)
 
 
+class PartnerOrdersExportView(StreamingExportMixin, APIView):
+    """
+    Потоковая выгрузка позиций заказов магазина партнёра в формате NDJSON или CSV:
+    одна строка на позицию, с фильтрами status, created_from, created_to (archive=true - из архива).
+    """
+    def get(self, request, *args, **kwargs):
+        """ Выгрузка позиций подзаказов магазина партнёра """
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Errors': 'Пользователь не аутентифицирован'}, status=403)
+        if request.user.type != 'shop':
+            return JsonResponse({'Status': False, 'Errors': 'Пользователь не является партнёром'}, status=403)
+
+        output = self.get_output(request)
+        if output is None:
+            return JsonResponse({'Status': False, 'Errors': 'Поддерживаются форматы: ndjson, csv'})
+        shop_id = Shop.objects.filter(user_id=request.user.id).values_list('id', flat=True).first()
+        if shop_id is None:
+            return JsonResponse({'Status': False, 'Errors': 'Магазин не найден'})
+        try:
+            filters = parse_order_filters(request.query_params)
+        except OrderError as error:
+            return JsonResponse({'Status': False, 'Errors': error.errors})
+
+        archive = bool(parse_boolean_state(request.query_params.get('archive')))
+        rows = iter_order_line_rows(partner_order_lines_queryset(shop_id, filters, archive=archive))
+        return self.export_response(request, output, rows, ORDER_LINE_EXPORT_FIELDS, 'orders')
+
+
 class ContactView(APIView):
     """
     Просмотр и управление контактами пользователя
@@ -495,43 +670,53 @@ class OrderView(APIView):
     Просмотр и управление заказами пользователя
     """
     def get(self, request, *args, **kwargs):
-        """ Получение заказов пользователя """
+        """
+        Получение заказов пользователя постранично (cursor, limit), с фильтрами status, created_from, created_to.
+        С archive=true выполняется поиск по архиву завершённых заказов.
+        """
         if request.user.is_authenticated:
-            orders = (Order.objects.filter(user_id=request.user.id).
-                      exclude(status='basket').
-                      prefetch_related('ordered_items__product_info__product__category',
-                                       'ordered_items__product_info__product_parameters__parameter').
-                      select_related('contact').
-                      annotate(total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).
-                      distinct())
-
-            serializer = OrderSerializer(orders, many=True)
-            return Response(serializer.data)
+            try:
+                filters = parse_order_filters(request.query_params)
+            except OrderError as error:
+                return JsonResponse({'Status': False, 'Errors': error.errors})
+
+            if parse_boolean_state(request.query_params.get('archive')):
+                orders = ArchivedOrder.objects.filter(user_id=request.user.id, **filters)
+                serializer_class = ArchivedOrderSerializer
+            else:
+                orders = Order.objects.filter(user_id=request.user.id, **filters).select_related('contact')
+                if 'status__in' not in filters:
+                    orders = orders.exclude(status='basket')
+                serializer_class = OrderSerializer
+
+            paginator = OrderCursorPagination()
+            page = paginator.paginate_queryset(orders, request, view=self)
+            prefetch_order_items(page)
+            serializer = serializer_class(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
         return JsonResponse({'Status': False, 'Errors': 'Пользователь не аутентифицирован'}, status=403)
 
 
+    @idempotent
     def post(self, request, *args, **kwargs):
         """ Оформление заказа пользователя """
         if request.user.is_authenticated:
             contact_id = request.data.get('contact_id')
             if contact_id and contact_id.isdigit():
                 try:
-                    basket = Order.objects.filter(user_id=request.user.id, status='basket').first()
-                    if basket:
-                        contact = Contact.objects.filter(id=int(contact_id), user_id=request.user.id).first()
-                        if contact:
-                            basket.contact = contact
-                            basket.status = 'new'
-                            basket.save()
-                            new_order.send(sender=self.__class__, user_id=request.user.id, order_id=basket.id)
-                            return JsonResponse({'Status': True, 'Message': 'Заказ успешно оформлен'})
-                        else:
-                            return JsonResponse({'Status': False, 'Errors': 'Контакт не найден'})
-                    else:
-                        return JsonResponse({'Status': False, 'Errors': 'Корзина пуста'})
+                    # Резервирование товара и смена статуса выполняются одной транзакцией
+                    order = checkout_basket(request.user.id, int(contact_id))
+                except OrderError as error:
+                    return JsonResponse({'Status': False, 'Errors': error.errors})
                 except IntegrityError as error:
                     print(error)
                     return JsonResponse({'Status': False, 'Errors': 'Ошибка при оформлении заказа'})
+                new_order.send(sender=self.__class__, user_id=request.user.id, order_id=order.id)
+                if order.dropped_items:
+                    return JsonResponse({'Status': True,
+                                         'Message': f'Заказ успешно оформлен. Позиций снято с продажи и удалено '
+                                                    f'из корзины: {order.dropped_items}'})
+                return JsonResponse({'Status': True, 'Message': 'Заказ успешно оформлен'})
             return JsonResponse({'Status': False, 'Errors': 'Некорректный или отсутствующий ID контакта'})
         return JsonResponse({'Status': False, 'Errors': 'Пользователь не аутентифицирован'}, status=403)
 
@@ -604,6 +789,11 @@ class AdminProductInfoDetailView(RetrieveUpdateDestroyAPIView):
     serializer_class = ProductInfoAdminWriteSerializer
     permission_classes = [IsAdminUser]
 
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            remove_offers_from_baskets([instance.id])
+            instance.delete()
+
 
 class AdminShopListCreateView(ListCreateAPIView):
     """
@@ -631,17 +821,31 @@ class AdminOrderListView(ListAPIView):
     """
     Отображает список всех заказов (Order),
     исключая заказы со статусом "статус корзины" (basket).
-    Включает информацию о контакте и пользователе,
-    а также детали о заказанных товарах,
-    связанных продуктах, категориях и параметрах продуктов.
-    """
-    queryset = Order.objects.select_related('contact', 'user').prefetch_related(
-        'ordered_items__product_info__product__category',
-        'ordered_items__product_info__product_parameters__parameter',
-    ).exclude(status='basket').order_by('-created_at')
+    Позиции оформленных заказов берутся из документа, сохранённого при оформлении,
+    поэтому список читается одним запросом.
+    С параметром archive=true возвращает архивные заказы.
+    """
+    queryset = Order.objects.exclude(status='basket').order_by('-created_at')
     serializer_class = OrderSerializer
     permission_classes = [IsAdminUser]
 
+    def use_archive(self) -> bool:
+        return bool(parse_boolean_state(self.request.query_params.get('archive')))
+
+    def get_queryset(self):
+        # Архив завершённых заказов запрашивается явно параметром archive=true
+        if self.use_archive():
+            return ArchivedOrder.objects.order_by('-created_at')
+        return super().get_queryset()
+
+    def get_serializer(self, *args, **kwargs):
+        if args and kwargs.get('many'):
+            prefetch_order_items(args[0])
+        return super().get_serializer(*args, **kwargs)
+
+    def get_serializer_class(self):
+        return ArchivedOrderSerializer if self.use_archive() else OrderSerializer
+
 
 class AdminOrderDetailUpdateView(RetrieveUpdateAPIView):
     """
@@ -655,5 +859,147 @@ class AdminOrderDetailUpdateView(RetrieveUpdateAPIView):
     serializer_class = OrderAdminUpdateSerializer
     permission_classes = [IsAdminUser]
 
+    def perform_update(self, serializer):
+        # Отмена заказа возвращает товар на склад, восстановление - снова резервирует
+        with transaction.atomic():
+            previous_status = Order.objects.select_for_update().values_list('status', flat=True).get(
+                pk=serializer.instance.pk)
+            order = serializer.save()
+            try:
+                change_order_status(order, previous_status)
+            except OrderError as error:
+                raise DRFValidationError({'status': error.errors})
+
+
+class AdminOrderBulkStatusView(APIView):
+    """
+    Массовая смена статуса заказов.
+    Принимает ids (список или строку через запятую) и status,
+    возвращает результат по каждому заказу.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        """ Перевод заказов в новый статус """
+        ids, status = request.data.get('ids'), request.data.get('status')
+        if isinstance(ids, str):
+            ids = [int(order_id) for order_id in ids.split(',') if order_id.strip().isdigit()]
+        if not isinstance(ids, list) or not ids or not all(type(order_id) is int for order_id in ids):
+            return JsonResponse({'Status': False, 'Errors': 'Не указаны ID заказов'})
+        if len(ids) > BULK_STATUS_MAX_ORDERS:
+            return JsonResponse({'Status': False, 'Errors': f'Не больше {BULK_STATUS_MAX_ORDERS} заказов за запрос'})
+        if status not in ALLOWED_TRANSITIONS:
+            return JsonResponse({'Status': False, 'Errors': 'Некорректный статус'})
+
+        results = bulk_change_order_status(list(dict.fromkeys(ids)), status)
+        return JsonResponse({'Status': True,
+                             'Updated': sum(result == 'ok' for result in results.values()),
+                             'Results': results})
+
+
+class AdminUserImportView(APIView):
+    """
+    Массовое создание пользователей из CSV (файл file или тело запроса text/csv).
+    Колонки: email, password, first_name, last_name, company, position и необязательный type.
+    Файл проверяется в запросе, пользователи создаются задачей Celery backend.import_users;
+    состояние задачи - GET admin/users/import/<task_id>.
+    Пользователи создаются неактивными, письма с токенами подтверждения отправляются одной задачей.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        """ Проверка файла и постановка создания пользователей в очередь """
+        if request.content_type.startswith('multipart/'):
+            upload = request.FILES.get('file')
+            content = upload.read() if upload else b''
+        else:
+            content = request.body
+        if not content:
+            return JsonResponse({'Status': False, 'Errors': 'Не передан файл'})
+        try:
+            rows = parse_users_csv(content)
+        except (UserImportError, UnicodeDecodeError, csv.Error) as error:
+            return JsonResponse({'Status': False, 'Errors': f'Некорректный файл: {error}'})
+        if len(rows) > settings.USER_IMPORT_MAX_ROWS:
+            return JsonResponse({'Status': False,
+                                 'Errors': f'Не больше {settings.USER_IMPORT_MAX_ROWS} пользователей за запрос'})
+        valid, errors = validate_user_rows(rows)
+        if not valid:
+            return JsonResponse({'Status': False, 'Errors': errors})
+
+        path = save_users_upload(content)
+        try:
+            async_result = import_users_task.delay(path)
+        except Exception:
+            # Задача не поставлена - файл с паролями никто не удалит
+            discard_users_upload(path)
+            raise
+        return JsonResponse({'Status': True, 'task_id': async_result.id, 'status': 'queued',
+                             'Accepted': len(valid), 'Errors': errors}, status=202)
 
 
+class AdminUserImportStatusView(APIView):
+    """
+    Состояние задачи массового создания пользователей: status (состояние Celery) и,
+    после завершения, количество созданных пользователей и ошибки по строкам.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, task_id, *args, **kwargs):
+        """ Состояние задачи """
+        async_result = import_users_task.AsyncResult(task_id)
+        data = {'Status': True, 'task_id': task_id, 'status': async_result.state}
+        if async_result.successful():
+            data.update(Created=async_result.result['created'], Errors=async_result.result['errors'])
+        elif async_result.failed():
+            data.update(Status=False, Errors='Ошибка при создании пользователей')
+        return JsonResponse(data)
+
+
+class OrderEventsView(View):
+    """
+    Поток Server-Sent Events со сменами статусов заказов текущего пользователя,
+    а для партнёра - и подзаказов его магазина. Работает на ASGI (orders/asgi.py).
+    Аутентификация - заголовок Authorization: Token ... или сессия.
+    Поток закрывается через SSE_MAX_DURATION секунд, клиент переподключается сам.
+    """
+    async def get(self, request, *args, **kwargs):
+        user = await self.authenticate(request)
+        if user is None:
+            return JsonResponse({'Status': False, 'Errors': 'Пользователь не аутентифицирован'}, status=403)
+
+        channels = [user_channel(user.id)]
+        if user.type == 'shop':
+            shop_id = await Shop.objects.filter(user_id=user.id).values_list('id', flat=True).afirst()
+            if shop_id is not None:
+                channels.append(shop_channel(shop_id))
+
+        response = StreamingHttpResponse(self.stream(channels), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @staticmethod
+    async def authenticate(request):
+        keyword, _, key = request.headers.get('Authorization', '').partition(' ')
+        if keyword == 'Token' and key:
+            try:
+                user, _ = await sync_to_async(CachedTokenAuthentication().authenticate_credentials)(key.strip())
+            except AuthenticationFailed:
+                user = None
+        else:
+            user = await request.auser()
+        return user if user is not None and user.is_authenticated and user.is_active else None
+
+    @staticmethod
+    async def stream(channels: list[str]):
+        yield f'retry: {settings.SSE_RETRY_MS}\n\n'
+        deadline = time.monotonic() + settings.SSE_MAX_DURATION
+        async for message in get_event_channel().listen(channels, timeout=settings.SSE_HEARTBEAT_INTERVAL):
+            if message is None:
+                # Комментарий SSE не даёт прокси закрыть простаивающее соединение
+                yield ': keepalive\n\n'
+            else:
+                yield f'event: order_status\ndata: {message}\n\n'
+            if time.monotonic() > deadline:
+                break
@@ -82,6 +82,16 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Транзакции сразу берут блокировку записи: параллельные оформления заказов
+        # ждут друг друга (timeout), а не падают с "database is locked"
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # Тестовая БД в файле, чтобы многопоточные тесты работали с обычными блокировками SQLite
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -134,18 +144,93 @@ EMAIL_HOST_PASSWORD = '123'
 EMAIL_PORT = '465'
 EMAIL_USE_SSL = True
 
+# Отправка почты воркерами: лимит провайдера (EMAIL_HOST) на все воркеры, время жизни простаивающего
+# SMTP-соединения и повторы при ошибках SMTP с экспоненциальной задержкой (секунды)
+EMAIL_RATE_LIMIT = os.getenv('EMAIL_RATE_LIMIT', '600/min')
+EMAIL_CONNECTION_MAX_IDLE = 60
+EMAIL_MAX_RETRIES = 5
+EMAIL_RETRY_BACKOFF = 10
+EMAIL_RETRY_BACKOFF_MAX = 600
+
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Общий кэш процессов: Redis, если задан CACHE_URL, иначе память текущего процесса
+CACHE_URL = os.getenv('CACHE_URL')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Время жизни закэшированного JSON отдельного предложения (ProductInfo), секунды
+OFFER_FRAGMENT_TIMEOUT = 60 * 60 * 24
+
+# Справочный кэш (Shop, Category, Parameter) в памяти процесса:
+# максимум записей на таблицу и интервал проверки версии в общем кэше, секунды
+REFERENCE_CACHE_MAX_ENTRIES = 10000
+REFERENCE_CACHE_POLL_INTERVAL = 1.0
+
+# Движок выборки каталога для ProductInfoView: 'orm' или 'columnar' (требует NumPy)
+CATALOG_ENGINE = os.getenv('CATALOG_ENGINE', 'orm')
+
+# Хранилище корзины: 'db' (Order/OrderItem) или 'cache' (общий кэш, в БД только при оформлении заказа)
+BASKET_BACKEND = os.getenv('BASKET_BACKEND', 'db')
+# Время жизни корзины в кэше с момента последнего изменения, секунды
+BASKET_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+# Канал событий о смене статусов заказов (Redis pub/sub); если не задан - память процесса
+EVENTS_URL = os.getenv('EVENTS_URL', CACHE_URL)
+# Поток SSE orders/events: интервал keepalive и максимальная длительность соединения, секунды;
+# пауза перед переподключением клиента, миллисекунды
+SSE_HEARTBEAT_INTERVAL = 15
+SSE_MAX_DURATION = 60 * 5
+SSE_RETRY_MS = 3000
+
+# Заголовок Idempotency-Key: сколько хранится первый ответ и сколько повтор ждёт выполняющийся запрос, секунды
+IDEMPOTENCY_KEY_TIMEOUT = 60 * 60 * 24
+IDEMPOTENCY_LOCK_TIMEOUT = 10
+# Время жизни блокировки выполняющегося запроса: больше самого долгого запроса, включая ожидание
+# блокировки SQLite (DATABASES['default']['OPTIONS']['timeout']), иначе повтор выполнил бы запись второй раз
+IDEMPOTENCY_LOCK_TTL = 120
+
+# Сколько хранится в кэше результат проверки токена API (токен и пользователь), секунды
+TOKEN_CACHE_TIMEOUT = 60
+
 # DRF settings: enable TokenAuthentication so Authorization: Token ... works
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'backend.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',
     ),
+    'DEFAULT_THROTTLE_CLASSES': (
+        'backend.throttling.SlidingWindowThrottle',
+    ),
+    # Число доверенных обратных прокси перед приложением: IP клиента для бюджетов ip берётся
+    # из X-Forwarded-For только на столько адресов с конца, без прокси - REMOTE_ADDR.
+    # Без этой настройки клиент подставлял бы в X-Forwarded-For любой адрес и обходил лимиты
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '0')),
+}
+
+# Бюджеты запросов для представлений с throttle_scope (скользящее окно в общем кэше):
+# ip - для всех запросов, user - для аутентифицированных, token - для запросов с токеном API
+THROTTLE_BUDGETS = {
+    'login': {'ip': '20/min'},
+    'register': {'ip': '10/min'},
+    'partner_update': {'user': '10/hour', 'ip': '30/hour'},
+    'catalog': {'ip': '600/min', 'user': '600/min', 'token': '600/min'},
+    'catalog_export': {'ip': '10/min', 'user': '10/min'},
 }
 
 # Celery configuration: use Redis as broker and result backend
@@ -156,3 +241,46 @@ CELERY_TASK_ALWAYS_EAGER = False
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+
+# Периодические задачи (запускаются процессом celery beat)
+CELERY_BEAT_SCHEDULE = {
+    'archive-orders': {
+        'task': 'backend.archive_orders',
+        'schedule': 60 * 60 * 24,
+    },
+    'collect-abandoned-baskets': {
+        'task': 'backend.collect_abandoned_baskets',
+        'schedule': 60 * 60,
+    },
+    'purge-expired-tokens': {
+        'task': 'backend.purge_expired_tokens',
+        'schedule': 60 * 60,
+    },
+}
+
+# Архив заказов: завершённые заказы, не менявшиеся столько дней, переносятся в архивные таблицы
+ORDER_ARCHIVE_AFTER_DAYS = int(os.getenv('ORDER_ARCHIVE_AFTER_DAYS', 365))
+ORDER_ARCHIVE_BATCH_SIZE = 500
+
+# Удаление заброшенных корзин: не менявшиеся BASKET_GC_AFTER_DAYS дней
+# и пустые старше BASKET_GC_EMPTY_AFTER_HOURS часов, пачками по BASKET_GC_BATCH_SIZE
+BASKET_GC_AFTER_DAYS = int(os.getenv('BASKET_GC_AFTER_DAYS', 30))
+BASKET_GC_EMPTY_AFTER_HOURS = 1
+BASKET_GC_BATCH_SIZE = 500
+
+# Удаление просроченных токенов: подтверждения email старше CONFIRM_EMAIL_TOKEN_EXPIRY_HOURS часов,
+# сброса пароля старше DJANGO_REST_MULTITOKENAUTH_RESET_TOKEN_EXPIRY_TIME часов (по умолчанию 24)
+# и токенов API неактивных пользователей старше INACTIVE_USER_TOKEN_EXPIRY_DAYS дней
+CONFIRM_EMAIL_TOKEN_EXPIRY_HOURS = int(os.getenv('CONFIRM_EMAIL_TOKEN_EXPIRY_HOURS', 48))
+INACTIVE_USER_TOKEN_EXPIRY_DAYS = int(os.getenv('INACTIVE_USER_TOKEN_EXPIRY_DAYS', 7))
+TOKEN_PURGE_BATCH_SIZE = 1000
+
+# Массовое создание пользователей из CSV: процессы для хеширования паролей (команда import_users),
+# размер пачки bulk_create, ограничение числа строк в одном запросе к admin/users/import
+# и каталог, через который загруженный файл передаётся задаче Celery (общий для web и воркеров)
+USER_IMPORT_HASH_WORKERS = int(os.getenv('USER_IMPORT_HASH_WORKERS', os.cpu_count() or 1))
+USER_IMPORT_BATCH_SIZE = 500
+USER_IMPORT_MAX_ROWS = 5000
+# Сколько паролей хеширует одна задача при импорте через admin/users/import (задачи выполняются параллельно)
+USER_IMPORT_HASH_CHUNK_SIZE = 100
+USER_IMPORT_UPLOAD_DIR = Path(os.getenv('USER_IMPORT_UPLOAD_DIR', BASE_DIR / 'uploads' / 'users'))
@@ -15,6 +15,7 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
+from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from django.urls import path, include
 
 from backend.views import ShopUpdate
@@ -23,3 +24,6 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include('backend.urls', namespace='backend')),
 ]
+
+# Статика админки в режиме отладки, если приложение запущено не через runserver (gunicorn, uvicorn)
+urlpatterns += staticfiles_urlpatterns()